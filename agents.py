@@ -3,11 +3,20 @@ import json
 import re
 import os
 import ast
-from typing import Dict, Any, Optional, List, Union
-from utils import call_openrouter, save_json, save_text, load_json, add_to_qdrant, get_from_qdrant, logger
+import logging
+from typing import Dict, Any, Optional, List, Union, Callable
+from utils import call_openrouter, save_json, save_text, load_json, add_to_qdrant, get_from_qdrant, logger, log_payload, read_settings_section
 from verification import VerificationAgent
+from transitions import TransitionEngine, NO_COMMAND
+from code_patch import apply_unified_diff, PatchError
+from code_analysis import endpoint_checks
+from loadgen import targets_from_checks, evaluate, PERFORMANCE_DEFAULTS
 
 class BaseAgent:
+    # Версия шаблона промпта: увеличивается при изменении промпта агента,
+    # чтобы закэшированные результаты этапа стали недействительны
+    prompt_version = "1"
+
     def __init__(self):
         self.verifier = VerificationAgent()
 
@@ -79,7 +88,7 @@ class DecomposerAgent(BaseAgent):
 - Форматы ответов
 - Внешние зависимости (например, Flask)
 """
-        logger.info(f"Промпт для DecomposerAgent: {prompt}")
+        log_payload("Промпт", "DecomposerAgent", prompt)
         
         try:
             # Вызов LLM
@@ -155,7 +164,7 @@ class ValidatorAgent(BaseAgent):
 
 Если какой-то из критериев не выполнен, укажи это в комментариях.
 """
-        logger.info(f"Промпт для ValidatorAgent: {prompt}")
+        log_payload("Промпт", "ValidatorAgent", prompt)
         
         try:
             # Вызов LLM
@@ -196,7 +205,7 @@ class ConsistencyAgent(BaseAgent):
 - Логика модулей не противоречит друг другу
 - Нет конфликтов между зависимостями разных модулей
 """
-        logger.info(f"Промпт для ConsistencyAgent: {prompt}")
+        log_payload("Промпт", "ConsistencyAgent", prompt)
         
         try:
             # Вызов LLM
@@ -239,7 +248,7 @@ class CodeGeneratorAgent(BaseAgent):
 - Реализовать валидацию входных данных
 - Код должен быть готов к запуску
 """
-        logger.info(f"Промпт для CodeGeneratorAgent: {prompt}")
+        log_payload("Промпт", "CodeGeneratorAgent", prompt)
         
         try:
             # Вызов LLM
@@ -264,6 +273,99 @@ class CodeGeneratorAgent(BaseAgent):
             logger.error(f"Ошибка в CodeGeneratorAgent: {str(e)}")
             return self._format_result({"error": str(e)}, 0.0, "codegen")
 
+    def run_patch(self, plan: Any, code: str, issues: List[str]) -> Dict[str, Any]:
+        """Исправление кода по замечаниям верификации через unified diff.
+
+        Модель возвращает только изменения, поэтому объём ответа пропорционален
+        размеру исправления, а не всего файла. Если diff не применяется или
+        ломает синтаксис, возвращается ошибка и вызывающий код переходит
+        к полной регенерации.
+        """
+        numbered = "\n".join(f"{i:4d} | {line}" for i, line in enumerate(code.splitlines(), 1))
+        issues_str = "\n".join(f"- {issue}" for issue in issues)
+        prompt = f"""
+Ты — Агент-генератор кода. Исправь замечания верификации в файле app.py, не переписывая его целиком.
+
+Замечания:
+{issues_str}
+
+Текущий код (номер строки | строка):
+{numbered}
+
+Верни только unified diff для app.py (заголовки --- a/app.py, +++ b/app.py и фрагменты @@ с 3 строками контекста).
+Номера строк в diff не включай в содержимое строк. Не добавляй пояснений.
+"""
+        log_payload("Промпт", "CodeGeneratorAgent", prompt)
+
+        try:
+            diff = call_openrouter(prompt)
+            patched = apply_unified_diff(code, diff)
+            syntax_issues = self._validate_python_syntax(patched)
+            if syntax_issues:
+                raise PatchError("; ".join(syntax_issues))
+
+            save_text(patched, "project/app.py")
+            verification = self.verifier.verify("codegen", patched, "", {"decomposer": plan})
+            confidence = verification["confidence"] if verification["status"] == "passed" else self._estimate_confidence(patched, verification["issues"])
+            logger.info(f"Код исправлен патчем: {len(diff)} символов ответа вместо {len(patched)}")
+            result = self._format_result(patched, confidence, "codegen")
+            result["patched"] = True
+            return result
+        except PatchError as e:
+            logger.warning(f"Патч не применён, потребуется полная генерация: {str(e)}")
+            return self._format_result({"error": str(e)}, 0.0, "codegen")
+        except Exception as e:
+            logger.error(f"Ошибка в CodeGeneratorAgent.run_patch: {str(e)}")
+            return self._format_result({"error": str(e)}, 0.0, "codegen")
+
+    def run_optimize(self, plan: Any, code: str, report: str) -> Dict[str, Any]:
+        """Оптимизация работающего кода по отчёту профилировщика через unified diff.
+
+        Поведение и API не меняются; файл не сохраняется — вызывающий код
+        принимает вариант только после тестов и повторного замера.
+        """
+        numbered = "\n".join(f"{i:4d} | {line}" for i, line in enumerate(code.splitlines(), 1))
+        plan_str = json.dumps(plan) if isinstance(plan, dict) else str(plan)
+        prompt = f"""
+Ты — Агент-генератор кода. Код app.py проходит тесты, но не выдерживает нагрузку. Оптимизируй узкие места по профилю.
+
+План: {plan_str[:1000]}
+
+Профиль под нагрузкой:
+{report}
+
+Текущий код (номер строки | строка):
+{numbered}
+
+Правила:
+- Маршруты, параметры, коды и формат ответов не меняются
+- Исправляй то, что видно в профиле: повторные вычисления, блокирующие вызовы в обработчиках, лишние выделения памяти, логирование на каждый запрос
+- Не добавляй новых внешних зависимостей
+
+Верни только unified diff для app.py (заголовки --- a/app.py, +++ b/app.py и фрагменты @@ с 3 строками контекста).
+Номера строк в diff не включай в содержимое строк. Не добавляй пояснений.
+"""
+        log_payload("Промпт", "CodeGeneratorAgent", prompt)
+
+        try:
+            diff = call_openrouter(prompt)
+            optimized = apply_unified_diff(code, diff)
+            syntax_issues = self._validate_python_syntax(optimized)
+            if syntax_issues:
+                raise PatchError("; ".join(syntax_issues))
+
+            verification = self.verifier.verify("codegen", optimized, "", {"decomposer": plan})
+            confidence = verification["confidence"] if verification["status"] == "passed" else self._estimate_confidence(optimized, verification["issues"])
+            result = self._format_result(optimized, confidence, "codegen")
+            result["optimized"] = True
+            return result
+        except PatchError as e:
+            logger.warning(f"Оптимизирующий патч не применён: {str(e)}")
+            return self._format_result({"error": str(e)}, 0.0, "codegen")
+        except Exception as e:
+            logger.error(f"Ошибка в CodeGeneratorAgent.run_optimize: {str(e)}")
+            return self._format_result({"error": str(e)}, 0.0, "codegen")
+
 class CodeExtractorAgent(BaseAgent):
     def run(self, code: Any) -> Dict[str, Any]:
         """Извлечение и сохранение кода в файл."""
@@ -288,7 +390,7 @@ class CodeExtractorAgent(BaseAgent):
 
 Для API-сервера обычно используется имя файла app.py или server.py.
 """
-        logger.info(f"Промпт для CodeExtractorAgent: {prompt}")
+        log_payload("Промпт", "CodeExtractorAgent", prompt)
         
         try:
             # Вызов LLM
@@ -348,7 +450,7 @@ class DockerRunnerAgent(BaseAgent):
 
 Обрати внимание: {"файл существует" if file_exists else "файл будет создан позже"}
 """
-        logger.info(f"Промпт для DockerRunnerAgent: {prompt}")
+        log_payload("Промпт", "DockerRunnerAgent", prompt)
         
         try:
             # Вызов LLM
@@ -396,7 +498,7 @@ class KnowledgeExtractorAgent(BaseAgent):
 - pattern: паттерны проектирования
 - error: обнаруженные ошибки или проблемы
 """
-        logger.info(f"Промпт для KnowledgeExtractorAgent: {prompt}")
+        log_payload("Промпт", "KnowledgeExtractorAgent", prompt)
         
         try:
             # Вызов LLM
@@ -423,20 +525,26 @@ class KnowledgeExtractorAgent(BaseAgent):
             return self._format_result({"error": str(e)}, 0.0, "knowledge")
 
 class CoordinatorAgent(BaseAgent):
-    def run(self, source: str, data: Any) -> str:
-        """Определение следующего агента."""
-        # Ожидаемый порядок выполнения
-        expected_flow = {
-            "decomposer": "validator",
-            "validator": "consistency",
-            "consistency": "codegen",
-            "codegen": "extractor",
-            "extractor": "docker",
-            "docker": "tester",
-            "tester": "docs",
-            "docs": None
-        }
-        
+    def __init__(self):
+        super().__init__()
+        self.transitions = TransitionEngine.from_settings()
+
+    def run(self, source: str, data: Any) -> Optional[str]:
+        """Определение следующего агента.
+
+        Для агентов из порядка flow переход вычисляется правилами без LLM;
+        LLM спрашивается только о нестандартном источнике и только при
+        transitions.llm_fallback.
+        """
+        if self.transitions.knows(source):
+            return self.transitions.next_agent(source, data)
+        if not self.transitions.llm_fallback:
+            logger.warning(f"Неизвестный источник {source}, переход к {self.transitions.fallback_agent}")
+            return self.transitions.fallback_agent
+        return self._ask_llm(source, data)
+
+    def _ask_llm(self, source: str, data: Any) -> Optional[str]:
+        """Запасной путь: выбор следующего агента через LLM."""
         # Подготовка данных для промпта
         data_str = json.dumps(data) if isinstance(data, (dict, list)) else str(data)
         
@@ -444,7 +552,7 @@ class CoordinatorAgent(BaseAgent):
         prompt = f"""
 Ты — Агент-координатор. Определи следующего агента для данных: {data_str[:500]}{"..." if len(data_str) > 500 else ""} от {source}. 
 
-Порядок: decomposer → validator → consistency → codegen → extractor → docker → tester → docs. 
+Порядок: {" → ".join(self.transitions.flow)}. 
 
 Обрати внимание на:
 - Статус выполнения предыдущего агента
@@ -453,28 +561,47 @@ class CoordinatorAgent(BaseAgent):
 
 Верни только имя следующего агента без дополнительного текста.
 """
-        logger.info(f"Промпт для CoordinatorAgent: {prompt}")
+        log_payload("Промпт", "CoordinatorAgent", prompt)
         
         # Вызов LLM
         next_agent = call_openrouter(prompt).strip()
         
-        # Логика определения следующего агента
-        if source in expected_flow:
-            # Проверка корректности ответа LLM
-            if next_agent not in expected_flow.values():
-                logger.warning(f"Координатор предложил {next_agent}, что не является допустимым агентом")
-                next_agent = expected_flow[source]
+        # Проверка корректности ответа LLM
+        if not self.transitions.knows(next_agent):
+            logger.warning(f"Координатор предложил {next_agent}, что не является допустимым агентом")
+            next_agent = self.transitions.fallback_agent
         
         return next_agent
 
 class MonitorAgent(BaseAgent):
+    def __init__(self):
+        super().__init__()
+        self.transitions = TransitionEngine.from_settings()
+
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Мониторинг состояния системы и агентов."""
+        """Мониторинг состояния системы и агентов.
+
+        Команда вычисляется по времени работы этапа и счётчикам запусков;
+        LLM спрашивается только о состоянии с неизвестным текущим агентом
+        и только при transitions.llm_fallback.
+        """
+        current = state.get("current_agent")
+        if current is None or self.transitions.knows(current) or not self.transitions.llm_fallback:
+            command = self.transitions.monitor_command(state)
+            if command != NO_COMMAND:
+                logger.info(f"Монитор: {command}")
+            return self._format_result({"command": command}, 1.0, "monitor")
+        return self._ask_llm(state)
+
+    def _ask_llm(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Запасной путь: команда монитора через LLM."""
+        # Сериализация состояния выполняется один раз
+        state_str = json.dumps(state, indent=2)
         # Формирование промпта для монитора
         prompt = f"""
-Ты — Агент-монитор. Проверь состояние: {json.dumps(state, indent=2)[:1000]}{"..." if len(json.dumps(state, indent=2)) > 1000 else ""}. Тебе нужно:
-1. Если агент работает >10 минут, верни {{"command": "Перезапустить <имя>"}}.
-2. Если validator >3 раз подряд, верни {{"command": "Принудительный переход к consistency"}}.
+Ты — Агент-монитор. Проверь состояние: {state_str[:1000]}{"..." if len(state_str) > 1000 else ""}. Тебе нужно:
+1. Если агент работает >{self.transitions.max_stage_seconds} секунд, верни {{"command": "Перезапустить <имя>"}}.
+2. Если validator >{self.transitions.max_consecutive_runs.get("validator", 3)} раз подряд, верни {{"command": "Принудительный переход к consistency"}}.
 3. Иначе верни {{"command": "none"}} в JSON без обёрток.
 
 Обрати внимание:
@@ -482,11 +609,7 @@ class MonitorAgent(BaseAgent):
 - Текущий агент: {state.get("current_agent", "unknown")}
 - Текущий шаг: {state.get("step", 0)}
 """
-        logger.info(f"Промпт для MonitorAgent: {prompt}")
-        
-        # Проверка validator_consecutive_runs
-        if "validator_consecutive_runs" not in state:
-            state["validator_consecutive_runs"] = 0
+        log_payload("Промпт", "MonitorAgent", prompt)
         
         try:
             # Вызов LLM
@@ -543,7 +666,7 @@ class TesterAgent(BaseAgent):
 
 Верни {{"tests": "..."}} в JSON без обёрток.
 """
-        logger.info(f"Промпт для TesterAgent: {prompt}")
+        log_payload("Промпт", "TesterAgent", prompt)
         
         try:
             # Вызов LLM
@@ -605,7 +728,7 @@ class DocumentationAgent(BaseAgent):
 - Примеры
 - Требования
 """
-        logger.info(f"Промпт для DocumentationAgent: {prompt}")
+        log_payload("Промпт", "DocumentationAgent", prompt)
         
         try:
             # Вызов LLM
@@ -627,6 +750,60 @@ class DocumentationAgent(BaseAgent):
             logger.error(f"Ошибка в DocumentationAgent: {str(e)}")
             return self._format_result({"error": str(e)}, 0.0, "docs")
 
+class PerformanceAgent(BaseAgent):
+    def __init__(self):
+        super().__init__()
+        self.settings = read_settings_section("performance", PERFORMANCE_DEFAULTS)
+        # Нагрузочный прогон в песочнице (ExecutionEnvironment.run_load), подключается снаружи
+        self.runner: Optional[Callable[[str, List[Dict[str, str]]], Dict[str, Any]]] = None
+
+    def register_runner(self, runner: Callable[[str, List[Dict[str, str]]], Dict[str, Any]]) -> None:
+        self.runner = runner
+
+    def run(self, plan: Any, code: Any = None) -> Dict[str, Any]:
+        """Нагрузочная проверка HTTP-сервиса без LLM.
+
+        Цели нагрузки — маршруты плана с параметрами по типам из плана; пороги
+        RPS, p95/p99 и доли ошибок берутся из секции performance.
+        """
+        if isinstance(code, dict) and "data" in code:
+            code = code["data"]
+        if os.path.exists("project/app.py"):
+            with open("project/app.py", "r") as f:
+                code = f.read()
+        plan_data = plan.get("data", plan) if isinstance(plan, dict) else plan
+
+        if not self.settings["enabled"] or self.runner is None or not isinstance(code, str):
+            report = {"status": "skipped", "reason": "нагрузочная проверка отключена или недоступна"}
+            return self._format_result(report, 1.0, "performance")
+
+        checks = endpoint_checks(code, plan_data, limit=int(self.settings["max_targets"]))
+        # Нагрузка должна идти через обработчик, а не через ветку ошибки валидации (4xx не считается ошибкой)
+        handled = [check for check in checks if check["expect_ok"]]
+        if checks and not handled:
+            logger.warning("Ни для одного маршрута нет параметров с типами из плана: "
+                           "под нагрузкой могут оказаться ответы 4xx вместо обработчика")
+        targets = targets_from_checks(handled or checks)
+        execution = self.runner(code, targets)
+        if execution["status"] == "skipped":
+            logger.info(f"Нагрузочная проверка пропущена: {execution['logs']}")
+            report = {"status": "skipped", "reason": execution["logs"]}
+        elif "metrics" not in execution:
+            log_payload("Сервер не запустился для нагрузки", "performance", execution["logs"], logging.ERROR)
+            report = {"status": "failed", "targets": targets,
+                      "violations": [f"сервер не готов к нагрузке: {execution.get('error', 'unknown')}"]}
+        else:
+            violations = evaluate(execution["metrics"], self.settings)
+            if execution["status"] != "success":
+                violations.insert(0, f"сервер упал под нагрузкой: {execution['logs'][:300]}")
+            report = {"status": "failed" if violations else "passed", "targets": targets,
+                      "metrics": execution["metrics"], "violations": violations}
+        save_json(report, "project/performance.json")
+
+        verification = self.verifier.verify("performance", report, "")
+        confidence = verification["confidence"] if verification["status"] == "passed" else self._estimate_confidence(report, verification["issues"])
+        return self._format_result(report, confidence, "performance")
+
 def initialize_agents():
     """Инициализация всех агентов системы."""
     try:
@@ -641,7 +818,8 @@ def initialize_agents():
             "coordinator": CoordinatorAgent(),
             "monitor": MonitorAgent(),
             "tester": TesterAgent(),
-            "docs": DocumentationAgent()
+            "docs": DocumentationAgent(),
+            "performance": PerformanceAgent()
         }
         logger.info(f"Инициализировано {len(agents)} агентов: {', '.join(agents.keys())}")
         return agents
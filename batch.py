@@ -0,0 +1,172 @@
+# batch.py
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List
+from utils import logger, save_json, load_yaml, percentile
+
+
+BATCH_DEFAULTS = {
+    "workers": 2,
+    "output_dir": "batch_runs",
+    "max_tasks_per_child": 1,
+}
+
+
+def load_tasks(source: str) -> List[Dict[str, str]]:
+    """Загрузка задач из JSONL-файла или директории.
+
+    Строка JSONL — объект {"id": ..., "task": ...} или просто строка задачи.
+    В директории читаются все *.jsonl, а каждый *.txt/*.md считается одной задачей.
+    """
+    tasks = []
+
+    def add(task: str, task_id: str = None) -> None:
+        task = task.strip()
+        if task:
+            tasks.append({"id": task_id or f"task_{len(tasks) + 1:04d}", "task": task})
+
+    def read_jsonl(path: str) -> None:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Пропущена строка {line_no} в {path}: {str(e)}")
+                    continue
+                if isinstance(entry, str):
+                    add(entry)
+                elif isinstance(entry, dict) and "task" in entry:
+                    add(entry["task"], entry.get("id"))
+                else:
+                    logger.error(f"Пропущена строка {line_no} в {path}: нет поля task")
+
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if name.endswith(".jsonl"):
+                read_jsonl(path)
+            elif name.endswith((".txt", ".md")):
+                with open(path, 'r', encoding='utf-8') as f:
+                    add(f.read(), os.path.splitext(name)[0])
+    else:
+        read_jsonl(source)
+
+    # Идентификаторы становятся именами директорий, поэтому должны быть уникальны и безопасны
+    seen = set()
+    for entry in tasks:
+        task_id = re.sub(r'[^\w.-]', '_', str(entry["id"]))
+        while task_id in seen:
+            task_id += "_"
+        seen.add(task_id)
+        entry["id"] = task_id
+    return tasks
+
+
+def run_task(entry: Dict[str, str], output_dir: str, settings_path: str) -> Dict[str, Any]:
+    """Выполнение одной задачи в рабочем процессе с отдельной директорией проекта."""
+    workdir = os.path.abspath(os.path.join(output_dir, entry["id"]))
+    os.makedirs(workdir, exist_ok=True)
+    shutil.copy(settings_path, os.path.join(workdir, "settings.yml"))
+    # Все пути конвейера относительные (project/...), поэтому смена директории изолирует задачу
+    os.chdir(workdir)
+
+    started = time.monotonic()
+    try:
+        from main import run_pipeline
+        summary = run_pipeline(entry["task"])
+        result = {"id": entry["id"], "status": "success" if summary["success"] else "failed", **summary}
+    except Exception as e:
+        logger.error(f"Задача {entry['id']} завершилась исключением: {str(e)}")
+        result = {"id": entry["id"], "task": entry["task"], "status": "error", "success": False, "error": str(e)}
+    result["latency"] = time.monotonic() - started
+    result["workdir"] = workdir
+    save_json(result, os.path.join(workdir, "result.json"))
+    return result
+
+
+def summarize(results: List[Dict[str, Any]], wall_time: float) -> Dict[str, Any]:
+    """Сводка пропускной способности и задержек пакета."""
+    latencies = [r["latency"] for r in results]
+    succeeded = sum(1 for r in results if r.get("success"))
+    return {
+        "tasks": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "wall_time": wall_time,
+        "throughput_per_min": len(results) / wall_time * 60 if wall_time > 0 else 0.0,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies, default=0.0)
+        }
+    }
+
+
+def run_batch(source: str, workers: int, output_dir: str, settings_path: str = "settings.yml",
+              max_tasks_per_child: int = 1) -> Dict[str, Any]:
+    """Прогон очереди задач через пул рабочих процессов."""
+    tasks = load_tasks(source)
+    if not tasks:
+        logger.error(f"Не найдено задач в {source}")
+        return summarize([], 0.0)
+
+    output_dir = os.path.abspath(output_dir)
+    settings_path = os.path.abspath(settings_path)
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Пакетный запуск: {len(tasks)} задач, {workers} процессов, результаты в {output_dir}")
+
+    started = time.monotonic()
+    results = []
+    results_path = os.path.join(output_dir, "results.jsonl")
+    with open(results_path, 'w', encoding='utf-8') as results_file, \
+            ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=max_tasks_per_child) as pool:
+        futures = {pool.submit(run_task, entry, output_dir, settings_path): entry for entry in tasks}
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # Падение рабочего процесса целиком (например, нехватка памяти)
+                result = {"id": entry["id"], "task": entry["task"], "status": "error",
+                          "success": False, "error": str(e), "latency": 0.0}
+            results.append(result)
+            results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            results_file.flush()
+            logger.info(f"Задача {result['id']}: {result['status']} за {result['latency']:.1f} сек "
+                        f"({len(results)}/{len(tasks)})")
+
+    summary = summarize(results, time.monotonic() - started)
+    save_json(summary, os.path.join(output_dir, "summary.json"))
+    logger.info(
+        f"Пакет завершён: {summary['succeeded']}/{summary['tasks']} успешно, "
+        f"{summary['throughput_per_min']:.2f} задач/мин, p50={summary['latency']['p50']:.1f} сек, "
+        f"p95={summary['latency']['p95']:.1f} сек"
+    )
+    return summary
+
+
+def main():
+    settings = (load_yaml("settings.yml") or {}).get("batch") or {}
+    config = {**BATCH_DEFAULTS, **settings}
+
+    parser = argparse.ArgumentParser(description="Пакетный запуск задач через пул процессов")
+    parser.add_argument("source", help="JSONL-файл с задачами или директория с задачами")
+    parser.add_argument("--workers", type=int, default=config["workers"], help="Число рабочих процессов")
+    parser.add_argument("--output", default=config["output_dir"], help="Директория для результатов")
+    parser.add_argument("--settings", default="settings.yml", help="Файл настроек для каждой задачи")
+    args = parser.parse_args()
+
+    summary = run_batch(args.source, args.workers, args.output, args.settings, config["max_tasks_per_child"])
+    sys.exit(0 if summary["tasks"] and summary["failed"] == 0 else 1)
+
+if __name__ == "__main__":
+    main()
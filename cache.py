@@ -0,0 +1,162 @@
+# cache.py
+import os
+import json
+import hashlib
+from typing import Dict, Any, Optional, List
+from utils import logger, MODEL
+from scheduler import DEFAULT_STAGES
+
+
+CACHE_DEFAULTS = {
+    "enabled": True,
+    "dir": ".cache",
+    "max_entries": 500,
+    "verdict_max_entries": 2000,
+}
+
+# Секции settings.yml верхнего уровня, которые читает этап помимо feedback и pipeline
+STAGE_SECTIONS = {
+    "performance": ("performance", "profiling"),
+}
+
+
+def stable_hash(value: Any) -> str:
+    """sha256 от канонического JSON-представления значения."""
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def artifact_of(result: Any) -> Any:
+    """Содержимое результата агента без метаданных (timestamp, confidence)."""
+    if isinstance(result, dict) and "data" in result:
+        return result["data"]
+    return result
+
+
+class DiskCache:
+    """Кэш JSON-значений на диске, ограниченный числом записей.
+
+    Каждая запись — отдельный файл; при превышении max_entries удаляются
+    записи, к которым дольше всего не обращались (по mtime).
+    """
+
+    def __init__(self, directory: str, max_entries: int = 500):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)  # Отметка об использовании для вытеснения LRU
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Повреждённая запись кэша {path}: {str(e)}")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Ошибка записи в кэш {path}: {str(e)}")
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        """Удаление самых давно использованных записей сверх лимита."""
+        try:
+            entries = [
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory) if name.endswith(".json")
+            ]
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=os.path.getmtime)
+            for path in entries[:len(entries) - self.max_entries]:
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"Ошибка очистки кэша {self.directory}: {str(e)}")
+
+
+class StageCache:
+    """Мемоизация этапов конвейера по хэшу их входов.
+
+    Ключ этапа включает задачу, артефакты вышестоящих этапов, версию шаблона
+    промпта, модель и относящиеся к этапу настройки. Изменение любого входа
+    меняет ключ этапа, а через его артефакт — и ключи всех нижестоящих этапов.
+    """
+
+    def __init__(self, settings: Dict[str, Any]):
+        config = {**CACHE_DEFAULTS, **(settings.get("cache") or {})}
+        self.enabled = config["enabled"]
+        self.settings = settings
+        self.store = DiskCache(os.path.join(config["dir"], "stages"), config["max_entries"])
+
+    def _stage_settings(self, stage: str) -> Dict[str, Any]:
+        """Настройки, влияющие на результат этапа."""
+        feedback = self.settings.get("feedback") or {}
+        pipeline = self.settings.get("pipeline") or {}
+        return {
+            "feedback": {k: v for k, v in feedback.items() if k != "agent_specific"},
+            "agent": (feedback.get("agent_specific") or {}).get(stage),
+            "rules": (self.settings.get("verification_rules") or {}).get(stage),
+            "stage": (pipeline.get("stages") or {}).get(stage),
+            "sections": {name: self.settings.get(name) for name in STAGE_SECTIONS.get(stage, ())},
+        }
+
+    def ancestors(self, stage: str) -> List[str]:
+        """Все этапы, от которых stage зависит транзитивно.
+
+        В ключ входят артефакты всех предков, а не только прямых needs: например,
+        codegen ждёт validator и consistency, но читает план decomposer.
+        """
+        stages = (self.settings.get("pipeline") or {}).get("stages") or DEFAULT_STAGES
+        found, pending = set(), list((stages.get(stage) or {}).get("needs", []))
+        while pending:
+            name = pending.pop()
+            if name not in found:
+                found.add(name)
+                pending.extend((stages.get(name) or {}).get("needs", []))
+        return sorted(found)
+
+    def key(self, stage: str, task: str, upstream: Dict[str, Any], prompt_version: str) -> str:
+        """Ключ этапа по его входам."""
+        return stable_hash({
+            "stage": stage,
+            "task": task,
+            "upstream": {name: stable_hash(artifact_of(result)) for name, result in sorted(upstream.items())},
+            "prompt_version": prompt_version,
+            "model": MODEL,
+            "settings": self._stage_settings(stage),
+        })
+
+    def load(self, stage: str, key: str) -> Optional[Dict[str, Any]]:
+        """Запись кэша этапа: {"result": ..., "files": {путь: содержимое}}."""
+        if not self.enabled:
+            return None
+        entry = self.store.get(key)
+        if entry and entry.get("stage") == stage:
+            return entry
+        return None
+
+    def save(self, stage: str, key: str, result: Any, artifacts: List[str]) -> None:
+        """Сохранение результата этапа и созданных им файлов."""
+        if not self.enabled:
+            return
+        files = {}
+        for path in artifacts:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    files[path] = f.read()
+        self.store.set(key, {"stage": stage, "result": result, "files": files})
@@ -0,0 +1,109 @@
+# chunking.py
+import re
+import ast
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, NamedTuple, Tuple
+from deadlines import propagate
+
+
+CHUNKING_DEFAULTS = {
+    "code_chars": 1500,
+    "docs_chars": 2000,
+    "max_workers": 4,
+}
+
+_HEADING = re.compile(r"^#{1,6}\s")
+
+
+class Chunk(NamedTuple):
+    """Фрагмент артефакта с положением в исходном тексте (строки с 1)."""
+    label: str
+    start: int
+    end: int
+    text: str
+
+    @property
+    def location(self) -> str:
+        return f"{self.label}, строки {self.start}-{self.end}"
+
+
+def _pack(parts: List[Tuple[str, int, int]], lines: List[str], max_chars: int) -> List[Chunk]:
+    """Жадная упаковка соседних частей (метка, начало, конец) во фрагменты до max_chars.
+
+    Часть длиннее max_chars становится отдельным фрагментом целиком: граница
+    фрагмента никогда не режет функцию или раздел посередине.
+    """
+    chunks: List[Chunk] = []
+    labels, start, end, size = [], None, None, 0
+    for label, part_start, part_end in parts:
+        part_size = sum(len(line) + 1 for line in lines[part_start - 1:part_end])
+        if labels and size + part_size > max_chars:
+            chunks.append(Chunk(", ".join(labels), start, end, "\n".join(lines[start - 1:end])))
+            labels, start, size = [], None, 0
+        labels.append(label)
+        start = part_start if start is None else start
+        end = part_end
+        size += part_size
+    if labels:
+        chunks.append(Chunk(", ".join(labels), start, end, "\n".join(lines[start - 1:end])))
+    return chunks
+
+
+def split_code(code: str, max_chars: int = 1500) -> List[Chunk]:
+    """Разбиение Python-кода по узлам верхнего уровня (функции, классы, блоки кода).
+
+    Импорты не попадают во фрагменты: их передают в каждый фрагмент как контекст
+    (см. code_imports).
+    """
+    lines = code.splitlines()
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return _pack([("код", 1, len(lines))], lines, max_chars) if lines else []
+
+    parts = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        label = getattr(node, "name", None) or type(node).__name__.lower()
+        parts.append((label, start, node.end_lineno))
+    return _pack(parts, lines, max_chars)
+
+
+def code_imports(code: str) -> str:
+    """Строки импортов модуля — общий контекст для всех фрагментов кода."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return ""
+    lines = code.splitlines()
+    return "\n".join(
+        "\n".join(lines[node.lineno - 1:node.end_lineno])
+        for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+def split_markdown(text: str, max_chars: int = 2000) -> List[Chunk]:
+    """Разбиение markdown по заголовкам; заголовки внутри блоков кода не учитываются."""
+    lines = text.splitlines()
+    parts, title, start, in_fence = [], "вступление", 1, False
+    for number, line in enumerate(lines, 1):
+        if line.strip().startswith("```"):
+            in_fence = not in_fence
+        if not in_fence and _HEADING.match(line) and number > start:
+            parts.append((title, start, number - 1))
+            title, start = line.lstrip("#").strip(), number
+        elif not in_fence and _HEADING.match(line):
+            title = line.lstrip("#").strip()
+    if lines:
+        parts.append((title, start, len(lines)))
+    return _pack(parts, lines, max_chars)
+
+
+def map_chunks(chunks: List[Chunk], check: Callable[[Chunk], Any], max_workers: int = 4) -> List[Tuple[Chunk, Any]]:
+    """Параллельная проверка фрагментов: время зависит от самого долгого фрагмента, а не от их числа."""
+    if len(chunks) <= 1:
+        return [(chunk, check(chunk)) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chunk") as pool:
+        return list(zip(chunks, pool.map(propagate(check), chunks)))
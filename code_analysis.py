@@ -0,0 +1,433 @@
+# code_analysis.py
+import re
+import ast
+from typing import Dict, Any, List, Optional, Set
+from code_repair import STDLIB_MODULES
+from dependencies import import_name
+
+
+# Атрибуты запроса, из которых обработчики читают параметры
+# (aiohttp: query, match_info; Flask: args, form, values; Starlette/FastAPI: query_params, path_params)
+PARAM_SOURCES = {"query", "args", "form", "values", "match_info", "query_params", "path_params", "rel_url"}
+
+# Функции, формирующие JSON-ответ
+RESPONSE_FUNCTIONS = {"json_response", "jsonify", "JSONResponse", "Response", "make_response"}
+
+HTTP_METHODS = {"get", "post", "put", "patch", "delete", "head", "options"}
+
+# Ключи входа модуля плана, описывающие маршрут, а не параметры
+PLAN_META_KEYS = {"routes", "route", "endpoint", "endpoints", "path", "method", "methods", "url", "format", "type"}
+
+# Ключи входа модуля плана, под которыми перечислены параметры запроса ({"parameters": {"a": "число"}})
+PARAM_WRAPPERS = {"params", "parameters", "query", "query_params"}
+
+# Ключи выхода модуля плана, под которыми перечислены поля ответа ({"response": {"result": ...}})
+RESPONSE_WRAPPERS = {"response", "body", "json", "fields"}
+
+_PLAN_ROUTE = re.compile(r"(?<![\w.:/])/[A-Za-z_][\w\-/{}<>:]*")
+
+
+def normalize_path(path: str) -> str:
+    """Путь маршрута без завершающего слэша, с единым видом параметров ({a}, <a>, <int:a> → {})."""
+    path = re.sub(r"<[^>]*>|\{[^}]*\}", "{}", path.strip())
+    return path.rstrip("/") or "/"
+
+
+def _attribute_chain(node: ast.AST) -> List[str]:
+    """Имена цепочки атрибутов: request.rel_url.query → ["request", "rel_url", "query"]."""
+    chain = []
+    while isinstance(node, ast.Attribute):
+        chain.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        chain.append(node.id)
+    return list(reversed(chain))
+
+
+def _constant_str(node: Optional[ast.AST]) -> Optional[str]:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def _keyword(call: ast.Call, name: str) -> Optional[ast.AST]:
+    for keyword in call.keywords:
+        if keyword.arg == name:
+            return keyword.value
+    return None
+
+
+class AppAnalyzer:
+    """Статический анализ веб-приложения aiohttp/Flask/FastAPI по AST.
+
+    Извлекает импорты, маршруты с методами и обработчиками, параметры,
+    которые обработчики читают из запроса, и ключи JSON-ответов.
+    """
+
+    def __init__(self, code: str):
+        self.tree = ast.parse(code)
+        self.functions: Dict[str, ast.AST] = {
+            node.name: node for node in ast.walk(self.tree)
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+        }
+
+    def imports(self) -> Set[str]:
+        """Импортированные модули верхнего уровня."""
+        names = set()
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Import):
+                names.update(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.add(node.module.split(".")[0])
+        return names
+
+    def framework(self) -> Optional[str]:
+        imports = self.imports()
+        for name in ("aiohttp", "flask", "fastapi"):
+            if name in imports:
+                return name
+        return None
+
+    def routes(self) -> List[Dict[str, Any]]:
+        """Маршруты приложения: [{"path", "methods", "handler", "params", "response_keys"}]."""
+        routes = []
+        for node in ast.walk(self.tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                for decorator in node.decorator_list:
+                    route = self._decorator_route(decorator)
+                    if route:
+                        routes.append(self._describe(route[0], route[1], node))
+            elif isinstance(node, ast.Call):
+                route = self._registration_route(node)
+                if route:
+                    path, methods, handler = route
+                    routes.append(self._describe(path, methods, self.functions.get(handler)))
+        return routes
+
+    def _decorator_route(self, decorator: ast.AST) -> Optional[tuple]:
+        """@app.route("/x", methods=[...]), @app.get("/x"), @routes.post("/x")."""
+        if not isinstance(decorator, ast.Call) or not isinstance(decorator.func, ast.Attribute):
+            return None
+        path = _constant_str(decorator.args[0]) if decorator.args else _constant_str(_keyword(decorator, "path"))
+        if path is None:
+            return None
+        name = decorator.func.attr
+        if name in HTTP_METHODS:
+            return path, [name.upper()]
+        if name in ("route", "api_route"):
+            methods = _keyword(decorator, "methods")
+            if isinstance(methods, (ast.List, ast.Tuple)):
+                return path, [m.upper() for m in map(_constant_str, methods.elts) if m]
+            return path, ["GET"]
+        return None
+
+    def _registration_route(self, call: ast.Call) -> Optional[tuple]:
+        """router.add_get("/x", handler), router.add_route("GET", "/x", handler), web.get("/x", handler)."""
+        if not isinstance(call.func, ast.Attribute):
+            return None
+        name = call.func.attr
+        args = call.args
+        chain = _attribute_chain(call.func)
+        if name.startswith("add_") and name[4:] in HTTP_METHODS and len(args) >= 2:
+            path, handler, methods = args[0], args[1], [name[4:].upper()]
+        elif name == "add_route" and len(args) >= 3:
+            path, handler, methods = args[1], args[2], [(_constant_str(args[0]) or "*").upper()]
+        elif name == "add_url_rule" and len(args) >= 1:
+            # Flask: app.add_url_rule("/x", view_func=handler)
+            path, handler = args[0], _keyword(call, "view_func") or (args[2] if len(args) >= 3 else None)
+            methods_node = _keyword(call, "methods")
+            methods = [m.upper() for m in map(_constant_str, getattr(methods_node, "elts", [])) if m] or ["GET"]
+        elif chain[:1] == ["web"] and name in HTTP_METHODS and len(args) >= 2:
+            path, handler, methods = args[0], args[1], [name.upper()]
+        else:
+            return None
+        path = _constant_str(path)
+        if path is None:
+            return None
+        handler_name = handler.id if isinstance(handler, ast.Name) else getattr(handler, "attr", None)
+        return path, methods, handler_name
+
+    def _describe(self, path: str, methods: List[str], handler: Optional[ast.AST]) -> Dict[str, Any]:
+        scope = handler if handler is not None else self.tree
+        params = self.params_read(scope)
+        # Параметры пути ({a}, <a>) и аргументы обработчика FastAPI тоже считаются прочитанными
+        params.update(re.findall(r"[{<](?:\w+:)?(\w+)[}>]", path))
+        if handler is not None and self.framework() == "fastapi":
+            params.update(arg.arg for arg in handler.args.args if arg.arg not in ("request", "self"))
+        return {
+            "path": path,
+            "methods": methods,
+            "handler": getattr(handler, "name", None),
+            "params": sorted(params),
+            "response_keys": sorted(self.response_keys(scope)),
+        }
+
+    def params_read(self, scope: ast.AST) -> Set[str]:
+        """Имена параметров, которые читаются из запроса: query["a"], args.get("a") и т.п."""
+        # Переменные с телом запроса: data = await request.json(), data = request.get_json()
+        bodies = set()
+        for node in ast.walk(scope):
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                value = node.value.value if isinstance(node.value, ast.Await) else node.value
+                source = value.func if isinstance(value, ast.Call) else value
+                chain = _attribute_chain(source)
+                if chain[:1] == ["request"] and chain[-1] in ("json", "get_json", "post", "form"):
+                    bodies.add(node.targets[0].id)
+
+        params = set()
+        for node in ast.walk(scope):
+            if isinstance(node, ast.Subscript):
+                source, key = node.value, _constant_str(node.slice)
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+                    and node.func.attr in ("get", "getone", "getall", "get_all") and node.args:
+                source, key = node.func.value, _constant_str(node.args[0])
+            else:
+                continue
+            chain = _attribute_chain(source)
+            from_request = PARAM_SOURCES.intersection(chain) or chain == ["request", "json"]
+            from_body = len(chain) == 1 and chain[0] in bodies
+            if key and (from_request or from_body):
+                params.add(key)
+        return params
+
+    def response_keys(self, scope: ast.AST) -> Set[str]:
+        """Ключи словарей, возвращаемых как JSON-ответ (литералом или через переменную)."""
+        keys = set()
+        # Словари, собранные в переменной перед ответом: data = {...}; return web.json_response(data)
+        assigned: Dict[str, List[ast.Dict]] = {}
+        for node in ast.walk(scope):
+            if isinstance(node, ast.Assign) and isinstance(node.value, ast.Dict):
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        assigned.setdefault(target.id, []).append(node.value)
+        for node in ast.walk(scope):
+            value = None
+            if isinstance(node, ast.Call):
+                func = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, "id", None)
+                if func in RESPONSE_FUNCTIONS and node.args:
+                    value = node.args[0]
+            elif isinstance(node, ast.Return):
+                value = node.value
+            for found in assigned.get(value.id, []) if isinstance(value, ast.Name) else [value]:
+                if isinstance(found, ast.Dict):
+                    keys.update(k for k in map(_constant_str, found.keys) if k)
+        return keys
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "framework": self.framework(),
+            "imports": sorted(self.imports()),
+            "routes": self.routes(),
+        }
+
+
+def plan_expectations(plan: Any) -> Dict[str, Set[str]]:
+    """Маршруты, параметры, поля ответа и зависимости, которые требует план decomposer."""
+    expected = {"routes": set(), "params": set(), "response_keys": set(), "external": set()}
+    modules = plan.get("modules", []) if isinstance(plan, dict) else []
+    for module in modules:
+        if not isinstance(module, dict):
+            continue
+        for dep in module.get("external") or []:
+            if isinstance(dep, str) and dep.strip():
+                expected["external"].add(import_name(dep))
+
+        inputs = module.get("input") if isinstance(module.get("input"), dict) else {}
+        for key in ("routes", "route", "endpoint", "endpoints", "path"):
+            for source in (inputs, module):
+                value = source.get(key)
+                for item in value if isinstance(value, list) else [value]:
+                    path = item.get("path") if isinstance(item, dict) else item
+                    if isinstance(path, str) and path.startswith("/"):
+                        expected["routes"].add(normalize_path(path))
+        for match in _PLAN_ROUTE.findall(str(module.get("logic", ""))):
+            expected["routes"].add(normalize_path(match))
+
+        for key, value in inputs.items():
+            if key in PARAM_WRAPPERS:
+                names = value.keys() if isinstance(value, dict) else value if isinstance(value, list) else []
+                expected["params"].update(n for n in names if isinstance(n, str))
+            elif key not in PLAN_META_KEYS:
+                expected["params"].add(key)
+
+        outputs = module.get("output") if isinstance(module.get("output"), dict) else {}
+        for key, value in outputs.items():
+            if key in RESPONSE_WRAPPERS and isinstance(value, dict):
+                expected["response_keys"].update(k for k in value if k not in PLAN_META_KEYS)
+            elif key not in PLAN_META_KEYS:
+                expected["response_keys"].add(key)
+    return expected
+
+
+def plan_requirements(plan: Any) -> List[str]:
+    """Проверяемые требования плана: логика модулей, маршруты, параметры и поля ответа."""
+    requirements = []
+    modules = plan.get("modules", []) if isinstance(plan, dict) else []
+    for module in modules:
+        if isinstance(module, dict) and module.get("logic"):
+            requirements.append(f"{module.get('name', 'модуль')}: {module['logic']}")
+    expected = plan_expectations(plan)
+    requirements.extend(f"маршрут {path}" for path in sorted(expected["routes"]))
+    requirements.extend(f"чтение параметра {name}" for name in sorted(expected["params"]))
+    requirements.extend(f"поле ответа {key}" for key in sorted(expected["response_keys"]))
+    return requirements
+
+
+def check_plan_conformance(code: str, plan: Any) -> Optional[List[str]]:
+    """Расхождения кода с планом; None, если код не удаётся проанализировать статически."""
+    try:
+        analyzer = AppAnalyzer(code)
+    except SyntaxError:
+        return None
+    if analyzer.framework() is None:
+        return None
+
+    expected = plan_expectations(plan)
+    routes = analyzer.routes()
+    issues = []
+
+    imports = {name.lower() for name in analyzer.imports()}
+    # Модули stdlib в external не обязательны к импорту, если код без них обходится
+    for dep in sorted(expected["external"] - imports - STDLIB_MODULES):
+        issues.append(f"Зависимость {dep} из плана не импортирована в коде")
+
+    implemented = {normalize_path(route["path"]) for route in routes}
+    for path in sorted(expected["routes"] - implemented):
+        issues.append(f"Маршрут {path} из плана не реализован в коде")
+
+    params = set().union(*(route["params"] for route in routes)) if routes else set()
+    for param in sorted(expected["params"] - params):
+        issues.append(f"Параметр {param} из плана не читается обработчиками")
+
+    # Поля ответа сверяются, только если ответы формируются словарями-литералами
+    response_keys = set().union(*(route["response_keys"] for route in routes)) if routes else set()
+    if response_keys:
+        for key in sorted(expected["response_keys"] - response_keys):
+            issues.append(f"Поле ответа {key} из плана не возвращается")
+    return issues
+
+
+# Порты по умолчанию для функций запуска сервера
+DEFAULT_PORTS = {"run_app": 8080, "uvicorn": 8000, "flask": 5000}
+
+
+def _is_main_guard(node: ast.AST) -> bool:
+    """if __name__ == "__main__":"""
+    if not isinstance(node, ast.If) or not isinstance(node.test, ast.Compare):
+        return False
+    values = [node.test.left, *node.test.comparators]
+    return any(isinstance(v, ast.Name) and v.id == "__name__" for v in values) \
+        and any(_constant_str(v) == "__main__" for v in values)
+
+
+def _has_break(loop: ast.AST) -> bool:
+    """break, относящийся к самому циклу (не к вложенным циклам)."""
+    pending = list(loop.body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, ast.Break):
+            return True
+        if not isinstance(node, (ast.For, ast.AsyncFor, ast.While, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            pending.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def detect_long_running(code: str) -> Dict[str, Any]:
+    """Статическое определение кода, который не завершается сам.
+
+    Возвращает {"kind": "server" | "loop" | None, "guarded": bool, "port": int | None,
+    "calls": [...]}: запуск сервера (web.run_app, app.run, uvicorn.run, serve_forever,
+    run_forever), бесконечный цикл без break и находится ли запуск под
+    if __name__ == "__main__".
+    """
+    tree = ast.parse(code)
+    guarded_nodes = set()
+    for node in ast.walk(tree):
+        if _is_main_guard(node):
+            guarded_nodes.update(id(child) for stmt in node.body for child in ast.walk(stmt))
+
+    framework = AppAnalyzer(code).framework() if code else None
+    result = {"kind": None, "guarded": False, "port": None, "calls": []}
+    for node in ast.walk(tree):
+        kind, port = None, None
+        if isinstance(node, ast.Call):
+            chain = _attribute_chain(node.func)
+            name = chain[-1] if chain else None
+            if name == "run_app":
+                kind, port = "server", DEFAULT_PORTS["run_app"]
+            elif chain[:1] == ["uvicorn"] and name == "run":
+                kind, port = "server", DEFAULT_PORTS["uvicorn"]
+            elif name == "run" and len(chain) == 2 and chain[0] != "asyncio" and framework in ("flask", "fastapi"):
+                kind, port = "server", DEFAULT_PORTS["flask"]
+            elif name in ("serve_forever", "run_forever"):
+                kind = "server"
+            if kind:
+                explicit = _keyword(node, "port")
+                if isinstance(explicit, ast.Constant) and isinstance(explicit.value, int):
+                    port = explicit.value
+        elif isinstance(node, ast.While) and isinstance(node.test, ast.Constant) and node.test.value \
+                and not _has_break(node):
+            kind = "loop"
+        if not kind:
+            continue
+        result["calls"].append(f"{kind}:{node.lineno}")
+        # Сервер важнее цикла: его готовность проверяется по порту
+        if result["kind"] != "server":
+            result["kind"] = kind
+            result["port"] = port
+            result["guarded"] = id(node) in guarded_nodes
+    return result
+
+
+def _sample_value(hint: Any) -> str:
+    """Значение параметра для проверочного запроса по описанию типа из плана."""
+    hint = str(hint).lower()
+    if any(word in hint for word in ("int", "float", "number", "decimal", "числ")):
+        return "2"
+    if "bool" in hint:
+        return "true"
+    return "test"
+
+
+def endpoint_checks(code: str, plan: Any = None, limit: int = 5) -> List[Dict[str, Any]]:
+    """Проверочные GET-запросы к маршрутам приложения (см. probes.run_checks).
+
+    Берутся маршруты без параметров пути; если план называет маршруты —
+    только они. Параметры заполняются значениями по типам из плана (тогда
+    ожидается успешный ответ); в ответе ожидаются поля плана, которые
+    обработчик возвращает словарём (ветки с ошибками дают другие ключи,
+    поэтому прочие не требуются).
+    """
+    try:
+        analyzer = AppAnalyzer(code)
+    except SyntaxError:
+        return []
+    expected = plan_expectations(plan)
+    hints = {}
+    for module in plan.get("modules", []) if isinstance(plan, dict) else []:
+        inputs = module.get("input") if isinstance(module, dict) and isinstance(module.get("input"), dict) else {}
+        for key, value in inputs.items():
+            if key in PARAM_WRAPPERS:
+                # Типы параметров под обёрткой: {"parameters": {"a": "число"}}
+                if isinstance(value, dict):
+                    hints.update(value)
+            elif key not in PLAN_META_KEYS:
+                hints[key] = value
+
+    checks = []
+    for route in analyzer.routes():
+        path = route["path"]
+        if "GET" not in route["methods"] or re.search(r"[{<]", path):
+            continue
+        if expected["routes"] and normalize_path(path) not in expected["routes"]:
+            continue
+        query = {name: _sample_value(hints.get(name, "")) for name in route["params"]}
+        checks.append({
+            "method": "GET",
+            "path": path,
+            "query": query,
+            # Значения по типам из плана должны пройти валидацию; без типов возможен ответ 4xx
+            "expect_ok": all(hints.get(name) for name in query),
+            "expect_keys": sorted(set(route["response_keys"]) & expected["response_keys"]),
+        })
+    return checks[:limit]
@@ -0,0 +1,69 @@
+# code_patch.py
+import re
+from typing import List, NamedTuple, Optional
+from code_repair import strip_fences
+
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@")
+
+
+class PatchError(ValueError):
+    """Diff не удалось разобрать или применить к исходному коду."""
+
+
+class Hunk(NamedTuple):
+    """Фрагмент unified diff: номер первой строки в исходнике, старые и новые строки."""
+    start: int
+    old: List[str]
+    new: List[str]
+
+
+def parse_unified_diff(diff: str) -> List[Hunk]:
+    """Разбор unified diff (допускаются markdown-обёртки и заголовки ---/+++)."""
+    hunks: List[Hunk] = []
+    current: Optional[Hunk] = None
+    for line in strip_fences(diff).splitlines():
+        header = _HUNK_HEADER.match(line)
+        if header:
+            current = Hunk(int(header.group(1)), [], [])
+            hunks.append(current)
+        elif current is None or line.startswith(("--- ", "+++ ", "\\")):
+            continue
+        elif line.startswith("-"):
+            current.old.append(line[1:])
+        elif line.startswith("+"):
+            current.new.append(line[1:])
+        else:
+            # Контекст; пустая строка — контекстная строка с потерянным пробелом
+            context = line[1:] if line.startswith(" ") else line
+            current.old.append(context)
+            current.new.append(context)
+    if not hunks:
+        raise PatchError("В ответе нет ни одного фрагмента @@")
+    return hunks
+
+
+def _locate(lines: List[str], old: List[str], expected: int) -> Optional[int]:
+    """Позиция old в lines, ближайшая к ожидаемой (номера строк в ответах LLM неточны)."""
+    if not old:
+        return min(max(expected, 0), len(lines))
+    target = [line.rstrip() for line in old]
+    stripped = [line.rstrip() for line in lines]
+    matches = [
+        i for i in range(len(lines) - len(old) + 1)
+        if stripped[i:i + len(old)] == target
+    ]
+    return min(matches, key=lambda i: abs(i - expected)) if matches else None
+
+
+def apply_unified_diff(original: str, diff: str) -> str:
+    """Применение unified diff к исходному коду. PatchError, если контекст не найден."""
+    lines = original.splitlines()
+    delta = 0
+    for number, hunk in enumerate(parse_unified_diff(diff), 1):
+        position = _locate(lines, hunk.old, hunk.start - 1 + delta)
+        if position is None:
+            raise PatchError(f"Фрагмент {number} (строка {hunk.start}) не совпадает с исходным кодом")
+        lines[position:position + len(hunk.old)] = hunk.new
+        delta = position - (hunk.start - 1) + len(hunk.new) - len(hunk.old)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,163 @@
+# code_repair.py
+import re
+import ast
+import sys
+import builtins
+import textwrap
+from typing import List, Optional, Set, NamedTuple
+from utils import logger
+
+
+# Имена, которые LLM часто использует без импорта, и соответствующий импорт
+KNOWN_IMPORTS = {
+    "web": "from aiohttp import web",
+    "aiohttp": "import aiohttp",
+    "Flask": "from flask import Flask",
+    "request": "from flask import request",
+    "jsonify": "from flask import jsonify",
+    "abort": "from flask import abort",
+    "FastAPI": "from fastapi import FastAPI",
+    "HTTPException": "from fastapi import HTTPException",
+    "Query": "from fastapi import Query",
+    "BaseModel": "from pydantic import BaseModel",
+    "uvicorn": "import uvicorn",
+    "requests": "import requests",
+    "pytest": "import pytest",
+    "Any": "from typing import Any",
+    "Dict": "from typing import Dict",
+    "List": "from typing import List",
+    "Optional": "from typing import Optional",
+    "Tuple": "from typing import Tuple",
+    "Union": "from typing import Union",
+    "dataclass": "from dataclasses import dataclass",
+    "field": "from dataclasses import field",
+    "defaultdict": "from collections import defaultdict",
+    "Counter": "from collections import Counter",
+    "Path": "from pathlib import Path",
+    "Decimal": "from decimal import Decimal",
+    "InvalidOperation": "from decimal import InvalidOperation",
+    "wraps": "from functools import wraps",
+}
+
+STDLIB_MODULES = set(getattr(sys, "stdlib_module_names", ())) or {
+    "asyncio", "collections", "datetime", "decimal", "functools", "hashlib", "itertools",
+    "json", "logging", "math", "os", "random", "re", "string", "sys", "time", "typing", "uuid",
+}
+
+_FENCE = re.compile(r"```[\w+-]*[ \t]*\n(.*?)```", re.DOTALL)
+
+
+class RepairResult(NamedTuple):
+    """Результат локального исправления: код и список применённых правок."""
+    code: str
+    fixes: List[str]
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.fixes)
+
+
+def parse_error(code: str) -> Optional[SyntaxError]:
+    """Синтаксическая ошибка кода или None."""
+    try:
+        ast.parse(code)
+        return None
+    except SyntaxError as e:
+        return e
+
+
+def strip_fences(code: str) -> str:
+    """Извлечение кода из markdown-блоков и удаление оставшихся маркеров ```."""
+    blocks = _FENCE.findall(code)
+    if blocks:
+        # Самый длинный блок — программа, остальные обычно примеры запуска
+        code = max(blocks, key=len)
+    lines = [line for line in code.splitlines() if not line.strip().startswith("```")]
+    return "\n".join(lines).strip() + "\n"
+
+
+def fix_indentation(code: str) -> str:
+    """Табуляции в пробелы, общий отступ всего файла и хвостовые пробелы."""
+    lines = [line.expandtabs(4).rstrip() for line in code.splitlines()]
+    return textwrap.dedent("\n".join(lines)).strip() + "\n"
+
+
+def undefined_names(tree: ast.AST) -> Set[str]:
+    """Имена, которые читаются, но нигде в модуле не связываются.
+
+    Анализ не учитывает области видимости: имя считается связанным, если
+    оно присваивается где угодно, поэтому импорты добавляются консервативно.
+    """
+    loaded, bound = set(), set(dir(builtins))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            (loaded if isinstance(node.ctx, ast.Load) else bound).add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                bound.add((alias.asname or alias.name).split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+    return loaded - bound
+
+
+def add_missing_imports(code: str) -> str:
+    """Добавление импортов для неопределённых имён из stdlib и KNOWN_IMPORTS."""
+    tree = ast.parse(code)
+    imports = []
+    for name in sorted(undefined_names(tree)):
+        if name in KNOWN_IMPORTS:
+            imports.append(KNOWN_IMPORTS[name])
+        elif name in STDLIB_MODULES:
+            imports.append(f"import {name}")
+    if not imports:
+        return code
+
+    # Импорты вставляются после docstring модуля и __future__-импортов
+    insert_at = 0
+    for node in tree.body:
+        is_docstring = isinstance(node, ast.Expr) and isinstance(getattr(node, "value", None), ast.Constant) \
+            and isinstance(node.value.value, str) and node is tree.body[0]
+        if is_docstring or (isinstance(node, ast.ImportFrom) and node.module == "__future__"):
+            insert_at = node.end_lineno
+        else:
+            break
+    lines = code.splitlines()
+    lines[insert_at:insert_at] = sorted(set(imports))
+    return "\n".join(lines) + "\n"
+
+
+def repair_code(code: str) -> RepairResult:
+    """Дешёвые детерминированные исправления сгенерированного кода.
+
+    Правка применяется, только если после неё код разбирается не хуже, чем до;
+    недостающие импорты добавляются лишь к синтаксически корректному коду.
+    """
+    fixes = []
+    for name, fix in (("markdown", strip_fences), ("отступы", fix_indentation)):
+        if parse_error(code) is None:
+            break
+        try:
+            candidate = fix(code)
+        except Exception as e:
+            logger.debug("Исправление %s не применено: %s", name, e)
+            continue
+        if candidate != code and (parse_error(candidate) is None or "```" in code):
+            code = candidate
+            fixes.append(name)
+
+    if parse_error(code) is None:
+        candidate = add_missing_imports(code)
+        if candidate != code:
+            added = len(candidate.splitlines()) - len(code.splitlines())
+            code = candidate
+            fixes.append(f"импорты (+{added})")
+
+    if fixes:
+        logger.info(f"Локальное исправление кода: {', '.join(fixes)}")
+    return RepairResult(code, fixes)
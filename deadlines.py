@@ -0,0 +1,274 @@
+# deadlines.py
+import os
+import time
+import threading
+import subprocess
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Callable, Iterator
+from utils import logger
+from resources import MeteredPopen, limit_preexec
+from logcapture import BoundedLog, pump, finish
+
+
+DEADLINE_DEFAULTS = {
+    "run": 1800,
+    "default_stage": 300,
+    "stages": {},
+}
+
+_local = threading.local()
+
+
+class DeadlineExceeded(TimeoutError):
+    """Операция отменена сторожем по истечении срока области."""
+
+    def __init__(self, scope: str):
+        super().__init__(f"Превышен срок выполнения: {scope}")
+        self.scope = scope
+
+
+class Deadline:
+    """Срок выполнения области (весь запуск или этап) с обработчиками отмены.
+
+    Отмена области отменяет и все вложенные области; обработчики отмены
+    прерывают зависшие операции (процессы, сборки, запросы).
+    """
+
+    def __init__(self, name: str, seconds: float, kind: str, parent: Optional["Deadline"] = None):
+        self.name = name
+        self.seconds = seconds
+        self.kind = kind
+        self.parent = parent
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds
+        self.cancelled = threading.Event()
+        self.children: List["Deadline"] = []
+        self._callbacks: Dict[int, tuple] = {}
+        self._next_handle = 0
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """Оставшееся время с учётом сроков всех объемлющих областей."""
+        remaining = self.expires_at - time.monotonic()
+        if self.parent:
+            remaining = min(remaining, self.parent.remaining())
+        return max(0.0, remaining)
+
+    def check(self) -> None:
+        """Исключение DeadlineExceeded, если область уже отменена."""
+        if self.cancelled.is_set() or self.remaining() <= 0:
+            raise DeadlineExceeded(self.name)
+
+    def on_cancel(self, callback: Callable[[], Any], label: str) -> int:
+        """Регистрация обработчика отмены; возвращает дескриптор для remove_callback."""
+        with self._lock:
+            handle = self._next_handle
+            self._next_handle += 1
+            self._callbacks[handle] = (callback, label)
+        if self.cancelled.is_set():
+            callback()
+        return handle
+
+    def remove_callback(self, handle: int) -> None:
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    def cancel(self) -> List[str]:
+        """Отмена области и вложенных областей. Возвращает список прерванных операций."""
+        if self.cancelled.is_set():
+            return []
+        self.cancelled.set()
+        with self._lock:
+            callbacks = list(self._callbacks.values())
+            children = list(self.children)
+        interrupted = []
+        for callback, label in callbacks:
+            try:
+                callback()
+                interrupted.append(f"{self.name}: {label}")
+            except Exception as e:
+                logger.error(f"Ошибка отмены '{label}' в области {self.name}: {str(e)}")
+        for child in children:
+            interrupted.extend(child.cancel())
+        return interrupted
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Срок области, в которой выполняется текущий поток."""
+    return getattr(_local, "deadline", None)
+
+
+class Watchdog:
+    """Сторож сроков: поток, отменяющий области по истечении их времени.
+
+    Каждая отмена записывается как структурированное событие timeout.
+    """
+
+    def __init__(self, on_event: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.on_event = on_event
+        self.events: List[Dict[str, Any]] = []
+        self._deadlines: List[Deadline] = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "Watchdog":
+        self._thread = threading.Thread(target=self._run, name="watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+
+    @contextmanager
+    def scope(self, name: str, seconds: float, kind: str = "stage", parent: Optional[Deadline] = None) -> Iterator[Deadline]:
+        """Область со сроком seconds; внутри неё current_deadline() возвращает её Deadline."""
+        parent = parent or current_deadline()
+        deadline = Deadline(name, seconds, kind, parent)
+        if parent:
+            with parent._lock:
+                parent.children.append(deadline)
+            if parent.cancelled.is_set():
+                deadline.cancelled.set()
+        with self._cond:
+            self._deadlines.append(deadline)
+            self._cond.notify()
+
+        previous = current_deadline()
+        _local.deadline = deadline
+        try:
+            yield deadline
+        finally:
+            _local.deadline = previous
+            with self._cond:
+                self._deadlines.remove(deadline)
+            if parent:
+                with parent._lock:
+                    parent.children.remove(deadline)
+
+    def _run(self) -> None:
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+                for deadline in list(self._deadlines):
+                    if deadline.expires_at <= now and not deadline.cancelled.is_set():
+                        self._expire(deadline, now)
+                waiting = [d.expires_at for d in self._deadlines if not d.cancelled.is_set()]
+                self._cond.wait(max(0.0, min(waiting) - now) if waiting else None)
+
+    def _expire(self, deadline: Deadline, now: float) -> None:
+        """Отмена просроченной области и запись события."""
+        interrupted = deadline.cancel()
+        event = {
+            "event": "timeout",
+            "scope": deadline.name,
+            "kind": deadline.kind,
+            "limit": deadline.seconds,
+            "elapsed": round(now - deadline.started_at, 3),
+            "interrupted": interrupted,
+            "ts": time.time()
+        }
+        self.events.append(event)
+        logger.warning(
+            f"Превышен срок {deadline.kind} {deadline.name} ({deadline.seconds} сек), "
+            f"прервано операций: {len(interrupted)}",
+            extra=event
+        )
+        if self.on_event:
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logger.error(f"Ошибка обработки события таймаута: {str(e)}")
+
+
+def stage_timeout(settings: Dict[str, Any], stage: str) -> float:
+    """Срок этапа из секции deadlines в settings.yml."""
+    config = {**DEADLINE_DEFAULTS, **(settings.get("deadlines") or {})}
+    return float((config.get("stages") or {}).get(stage, config["default_stage"]))
+
+
+def run_timeout(settings: Dict[str, Any]) -> float:
+    """Срок всего запуска из секции deadlines в settings.yml."""
+    config = {**DEADLINE_DEFAULTS, **(settings.get("deadlines") or {})}
+    return float(config["run"])
+
+
+def bounded_timeout(timeout: Optional[float]) -> Optional[float]:
+    """Таймаут операции, ограниченный оставшимся временем текущей области."""
+    deadline = current_deadline()
+    if deadline is None:
+        return timeout
+    deadline.check()
+    remaining = deadline.remaining()
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def run_process(cmd: List[str], timeout: Optional[float] = None, capture: bool = True,
+                limits: Optional[Dict[str, int]] = None, **kwargs) -> subprocess.CompletedProcess:
+    """Аналог subprocess.run, прерываемый сторожем при отмене текущей области.
+
+    limits — лимиты RLIMIT_* для дочернего процесса (см. resources.rlimits);
+    измеренное потребление возвращается в атрибуте usage результата.
+    Вывод читается потоком в BoundedLog: в stdout/stderr результата попадают
+    начало и конец вывода, полный вывод большого объёма — в файл (logcapture).
+    """
+    deadline = current_deadline()
+    timeout = bounded_timeout(timeout)
+    if capture:
+        kwargs.setdefault("stdout", subprocess.PIPE)
+        kwargs.setdefault("stderr", subprocess.PIPE)
+    # Pipe читается байтами, текст декодируется при сборке выдержки
+    for key in ("text", "universal_newlines", "encoding", "errors"):
+        kwargs.pop(key, None)
+    if limits:
+        kwargs["preexec_fn"] = limit_preexec(limits)
+
+    process = MeteredPopen(cmd, **kwargs)
+    label = os.path.basename(cmd[0])
+    logs = {name: BoundedLog(f"{label}.{name}") for name in ("stdout", "stderr") if getattr(process, name)}
+    pumps = [pump(getattr(process, name), log) for name, log in logs.items()]
+    handle = deadline.on_cancel(process.kill, f"процесс {' '.join(cmd[:3])}") if deadline else None
+
+    def output(name: str) -> Optional[str]:
+        return logs[name].text() if name in logs else None
+
+    try:
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            finish(pumps)
+            if deadline and deadline.remaining() <= 0:
+                raise DeadlineExceeded(deadline.name)
+            raise subprocess.TimeoutExpired(cmd, timeout, output=output("stdout"), stderr=output("stderr"))
+        finish(pumps)
+    finally:
+        if handle is not None:
+            deadline.remove_callback(handle)
+        for log in logs.values():
+            log.close()
+
+    if deadline and deadline.cancelled.is_set():
+        raise DeadlineExceeded(deadline.name)
+    result = subprocess.CompletedProcess(cmd, process.returncode, output("stdout"), output("stderr"))
+    result.usage = process.usage
+    return result
+
+
+def propagate(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Обёртка, переносящая срок текущей области в поток пула, где будет вызвана func."""
+    deadline = current_deadline()
+
+    def wrapper(*args, **kwargs):
+        previous = current_deadline()
+        _local.deadline = deadline
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.deadline = previous
+    return wrapper
@@ -0,0 +1,326 @@
+# dependencies.py
+import os
+import re
+import ast
+import sys
+import json
+import zipfile
+import importlib.metadata
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+from utils import logger
+from code_repair import STDLIB_MODULES
+from wheelhouse import Wheelhouse
+
+
+DEPENDENCY_DEFAULTS = {
+    "pin": True,               # Фиксировать версии по колёсам склада (если план не задал ограничение)
+    "keep_plan_only": False,   # Оставлять зависимости плана, которые код не импортирует
+    "mapping": {},             # Дополнительные соответствия: импорт → дистрибутив
+}
+
+# Импортируемый модуль → дистрибутив pip, где имена различаются
+MODULE_DISTRIBUTIONS = {
+    "sklearn": "scikit-learn",
+    "skimage": "scikit-image",
+    "yaml": "pyyaml",
+    "bs4": "beautifulsoup4",
+    "PIL": "pillow",
+    "dateutil": "python-dateutil",
+    "cv2": "opencv-python",
+    "dotenv": "python-dotenv",
+    "jwt": "pyjwt",
+    "jose": "python-jose",
+    "multipart": "python-multipart",
+    "socketio": "python-socketio",
+    "engineio": "python-engineio",
+    "telegram": "python-telegram-bot",
+    "docx": "python-docx",
+    "pptx": "python-pptx",
+    "magic": "python-magic",
+    "serial": "pyserial",
+    "usb": "pyusb",
+    "zmq": "pyzmq",
+    "fitz": "pymupdf",
+    "Crypto": "pycryptodome",
+    "OpenSSL": "pyopenssl",
+    "dns": "dnspython",
+    "git": "gitpython",
+    "attr": "attrs",
+    "bson": "pymongo",
+    "psycopg2": "psycopg2-binary",
+    "MySQLdb": "mysqlclient",
+    "google.protobuf": "protobuf",
+    "markdown": "markdown",
+    "slugify": "python-slugify",
+    "Levenshtein": "python-levenshtein",
+}
+
+_WHEEL_NAME = re.compile(r"^(?P<name>[^-]+)-(?P<version>[^-]+)(?:-\d[^-]*)?-(?P<python>[^-]+)-(?P<abi>[^-]+)-[^-]+\.whl$")
+_REQUIREMENT_NAME = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+_PRERELEASE = re.compile(r"(a|b|rc|dev)\d*", re.IGNORECASE)
+
+
+def canonical_name(name: str) -> str:
+    """Нормализованное имя дистрибутива (PEP 503): Flask_Login → flask-login."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def requirement_name(requirement: str) -> str:
+    match = _REQUIREMENT_NAME.match(requirement)
+    return canonical_name(match.group(1)) if match else ""
+
+
+def import_name(distribution: str) -> str:
+    """Модуль, который импортирует код для дистрибутива из плана (обратное MODULE_DISTRIBUTIONS)."""
+    name = requirement_name(distribution)
+    for module, dist in MODULE_DISTRIBUTIONS.items():
+        if dist == name:
+            return module.split(".")[0]
+    return name.replace("-", "_")
+
+
+def _optional(node: ast.Try) -> bool:
+    """try с обработчиком ImportError: импорт внутри — необязательная зависимость."""
+    for handler in node.handlers:
+        names = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+        if any(isinstance(name, ast.Name) and name.id in ("ImportError", "ModuleNotFoundError") for name in names):
+            return True
+    return False
+
+
+def imported_modules(code: str) -> Set[str]:
+    """Абсолютные импорты кода (с подмодулем для пространств имён вроде google.protobuf).
+
+    Не учитываются импорты под if TYPE_CHECKING и в try с обработкой
+    ImportError: без них код работает.
+    """
+    tree = ast.parse(code)
+    skipped = set()
+    for node in ast.walk(tree):
+        guarded = isinstance(node, ast.Try) and _optional(node)
+        type_checking = isinstance(node, ast.If) and "TYPE_CHECKING" in ast.dump(node.test)
+        if guarded or type_checking:
+            skipped.update(id(child) for stmt in node.body for child in ast.walk(stmt))
+
+    names = set()
+    for node in ast.walk(tree):
+        if id(node) in skipped:
+            continue
+        if isinstance(node, ast.Import):
+            names.update(".".join(alias.name.split(".")[:2]) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(".".join(node.module.split(".")[:2]))
+    return names
+
+
+def _version_key(version: str) -> Tuple:
+    return tuple(int(part) if part.isdigit() else -1 for part in re.split(r"[.+]", version))
+
+
+def _compatible(python_tag: str, abi_tag: str, version: Tuple[int, int]) -> bool:
+    """Подходит ли колесо интерпретатору version по тегам имени файла."""
+    current = f"{version[0]}{version[1]}"
+    for tag in python_tag.split("."):
+        if tag in ("py3", f"py{current}"):
+            return True
+        if tag.startswith("cp3") and tag[2:].isdigit():
+            if tag[2:] == current:
+                return True
+            if "abi3" in abi_tag.split(".") and (3, int(tag[3:])) <= version:
+                return True
+    return False
+
+
+def _requires_python(specifier: str, version: Tuple[int, int]) -> bool:
+    """Удовлетворяет ли версия X.Y ограничению Requires-Python (>=3.8, !=3.0.*, <4)."""
+    for clause in filter(None, (part.strip() for part in specifier.split(","))):
+        match = re.match(r"(~=|==|!=|>=|<=|>|<)\s*(\d+)(?:\.(\d+))?", clause)
+        if not match:
+            continue
+        operator, bound = match.group(1), (int(match.group(2)), int(match.group(3) or 0))
+        wildcard = clause.endswith(".*")
+        if operator == "==" and version != bound:
+            return False
+        if (operator == "!=" and version == bound and wildcard) or (operator == ">" and version <= bound) \
+                or (operator == ">=" and version < bound) or (operator == "~=" and version < bound) \
+                or (operator == "<" and version >= bound) or (operator == "<=" and version > bound):
+            return False
+    return True
+
+
+class DependencyResolver:
+    """Зависимости кода по его импортам: дистрибутивы pip с версиями из склада колёс.
+
+    Импорт сопоставляется дистрибутиву по кураторской таблице
+    MODULE_DISTRIBUTIONS, затем по модулям верхнего уровня колёс склада
+    (соответствия кэшируются в <склад>/modules.json по имени файла колеса),
+    затем по установленным пакетам; иначе имя импорта считается именем
+    дистрибутива. Зависимости плана дают ограничения версий и extras для
+    импортируемых пакетов.
+    """
+
+    def __init__(self, settings: Dict[str, Any], wheelhouse: Optional[Wheelhouse] = None):
+        self.settings = settings
+        self.wheelhouse = wheelhouse
+        self.mapping = {**MODULE_DISTRIBUTIONS, **(settings.get("mapping") or {})}
+        self._wheel_info: Optional[Dict[str, Dict[str, Any]]] = None
+        self._installed: Optional[Dict[str, List[str]]] = None
+
+    def _cache_path(self) -> Optional[str]:
+        return os.path.join(self.wheelhouse.root, "modules.json") if self.wheelhouse else None
+
+    def _wheels(self) -> List[str]:
+        if not self.wheelhouse or not os.path.isdir(self.wheelhouse.wheels):
+            return []
+        return [name for name in os.listdir(self.wheelhouse.wheels) if name.endswith(".whl")]
+
+    def wheel_info(self) -> Dict[str, Dict[str, Any]]:
+        """Модули верхнего уровня и Requires-Python каждого колеса склада; новые колёса читаются один раз."""
+        if self._wheel_info is None:
+            self._wheel_info = {}
+            path = self._cache_path()
+            if path and os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        cached = json.load(f)
+                    self._wheel_info = {name: info for name, info in cached.items() if isinstance(info, dict)}
+                except (OSError, ValueError, AttributeError):
+                    pass
+        missing = [name for name in self._wheels() if name not in self._wheel_info]
+        for name in missing:
+            self._wheel_info[name] = self._read_wheel(os.path.join(self.wheelhouse.wheels, name))
+        if missing:
+            try:
+                with open(self._cache_path(), "w", encoding="utf-8") as f:
+                    json.dump(self._wheel_info, f)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить кэш модулей колёс: {str(e)}")
+        return self._wheel_info
+
+    @staticmethod
+    def _read_wheel(path: str) -> Dict[str, Any]:
+        """Модули колеса (top_level.txt, а без него — корневые пакеты архива) и его Requires-Python."""
+        info = {"modules": [], "requires_python": ""}
+        try:
+            with zipfile.ZipFile(path) as wheel:
+                files = wheel.namelist()
+                metadata = [name for name in files if name.endswith(".dist-info/METADATA")]
+                if metadata:
+                    for line in wheel.read(metadata[0]).decode("utf-8").splitlines():
+                        if line.startswith("Requires-Python:"):
+                            info["requires_python"] = line.split(":", 1)[1].strip()
+                        elif not line.strip():
+                            break
+                top_level = [name for name in files if name.endswith(".dist-info/top_level.txt")]
+                if top_level:
+                    info["modules"] = sorted({line.strip() for line in wheel.read(top_level[0]).decode("utf-8").splitlines()
+                                              if line.strip()})
+                    return info
+        except (OSError, zipfile.BadZipFile, UnicodeDecodeError):
+            return info
+        modules = set()
+        for name in files:
+            root = name.split("/")[0]
+            if root.endswith((".dist-info", ".data")):
+                continue
+            if "/" in name or root.endswith(".py"):
+                modules.add(root[:-3] if root.endswith(".py") else root)
+        info["modules"] = sorted({module.split(".")[0] for module in modules})
+        return info
+
+    def distribution(self, module: str) -> str:
+        """Дистрибутив pip для импортированного модуля."""
+        top = module.split(".")[0]
+        if module in self.mapping or top in self.mapping:
+            return canonical_name(self.mapping.get(module) or self.mapping[top])
+        for wheel, info in self.wheel_info().items():
+            if top in info["modules"]:
+                match = _WHEEL_NAME.match(wheel)
+                if match:
+                    return canonical_name(match.group("name"))
+        if self._installed is None:
+            packages = getattr(importlib.metadata, "packages_distributions", None)
+            self._installed = packages() if packages else {}
+        if self._installed.get(top):
+            return canonical_name(self._installed[top][0])
+        return canonical_name(top)
+
+    def infer(self, sources: Iterable[str], plan: Any = None, local_modules: Set[str] = frozenset()) -> List[str]:
+        """Требования по импортам кода, объединённые с зависимостями плана decomposer."""
+        modules = set()
+        for code in sources:
+            if not code:
+                continue
+            try:
+                modules |= imported_modules(code)
+            except SyntaxError:
+                continue
+        external = {module for module in modules
+                    if module.split(".")[0] not in STDLIB_MODULES and module.split(".")[0] not in local_modules}
+        requirements = {}
+        for module in sorted(external):
+            name = self.distribution(module)
+            requirements.setdefault(name, name)
+
+        declared = self.plan_requirements(plan)
+        for name, requirement in declared.items():
+            if name in requirements:
+                # План уточняет версию или extras пакета, который код действительно импортирует
+                requirements[name] = requirement
+            elif self.settings["keep_plan_only"]:
+                requirements[name] = requirement
+        unused = sorted(set(declared) - set(requirements))
+        if unused:
+            logger.info(f"Зависимости плана не импортируются кодом и не устанавливаются: {', '.join(unused)}")
+        return [requirements[name] for name in sorted(requirements)]
+
+    def plan_requirements(self, plan: Any) -> Dict[str, str]:
+        """Зависимости всех модулей плана: дистрибутив → требование с ограничениями из плана.
+
+        План иногда называет модуль вместо дистрибутива (yaml, bs4) — имя заменяется по таблице.
+        """
+        declared = {}
+        modules = plan.get("modules", []) if isinstance(plan, dict) else []
+        for module in modules:
+            if not isinstance(module, dict):
+                continue
+            for dep in module.get("external") or []:
+                match = _REQUIREMENT_NAME.match(dep) if isinstance(dep, str) else None
+                if not match:
+                    continue
+                raw = match.group(1)
+                name = canonical_name(self.mapping[raw]) if raw in self.mapping else canonical_name(raw)
+                declared[name] = (self.mapping[raw] if raw in self.mapping else raw) + dep.strip()[len(raw):]
+        return declared
+
+    def pin(self, requirements: List[str], python_version: Optional[str] = None) -> List[str]:
+        """Фиксация версий требований без ограничений по самым новым колёсам склада.
+
+        python_version — версия Python образа; по умолчанию текущий интерпретатор.
+        Требования, для которых в складе нет подходящих колёс, остаются без версии.
+        """
+        if not self.settings["pin"]:
+            return list(requirements)
+        target = tuple(int(part) for part in python_version.split(".")[:2]) if python_version \
+            else sys.version_info[:2]
+        versions: Dict[str, List[str]] = {}
+        for wheel, info in self.wheel_info().items():
+            match = _WHEEL_NAME.match(wheel)
+            if match and not _PRERELEASE.search(match.group("version")) \
+                    and _compatible(match.group("python"), match.group("abi"), target) \
+                    and _requires_python(info.get("requires_python", ""), target):
+                versions.setdefault(canonical_name(match.group("name")), []).append(match.group("version"))
+        pinned = []
+        for requirement in requirements:
+            name = requirement_name(requirement)
+            bare = re.fullmatch(r"[A-Za-z0-9._-]+", requirement.strip()) is not None
+            if bare and versions.get(name):
+                requirement = f"{requirement.strip()}=={max(versions[name], key=_version_key)}"
+            pinned.append(requirement)
+        return pinned
+
+    def resolve(self, sources: Iterable[str], plan: Any = None, local_modules: Set[str] = frozenset(),
+                python_version: Optional[str] = None) -> List[str]:
+        """Требования кода с версиями из склада: infer, затем pin."""
+        return self.pin(self.infer(sources, plan, local_modules), python_version)
+
@@ -0,0 +1,286 @@
+# docker_images.py
+import os
+import re
+import shlex
+import shutil
+import hashlib
+import tempfile
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+import yaml
+import docker
+from utils import logger, log_payload, save_text
+from deadlines import run_process, current_deadline
+from wheelhouse import Wheelhouse, image_python_version
+from logcapture import BoundedLog
+from dependencies import DependencyResolver
+
+
+DOCKER_CACHE_DEFAULTS = {
+    "enabled": True,
+    "buildkit": True,        # Сборка через docker build с BuildKit (кэш слоёв и кэш pip)
+    "repository": "codecraft-base",
+    "max_bases": 10,         # Базовых образов; давно созданные удаляются
+    "build_timeout": 900,
+}
+
+BASE_LABEL = "codecraft.base"
+
+# Последних событий сборки, передаваемых в BuildError
+BUILD_ERROR_CHUNKS = 50
+
+# Опции pip install со значением отдельным аргументом
+_PIP_VALUE_OPTIONS = {"-r", "--requirement", "-c", "--constraint", "-i", "--index-url", "--extra-index-url",
+                      "-f", "--find-links", "--trusted-host", "-t", "--target"}
+
+_PIP_INSTALL = re.compile(r"^(?:python\d*(?:\.\d+)?\s+-m\s+)?pip3?\s+install\s+(.*)$")
+
+
+def normalize_requirements(requirements: List[str]) -> List[str]:
+    """Требования без комментариев, пустых строк и повторов, в каноническом виде и порядке."""
+    normalized = set()
+    for line in requirements:
+        line = line.split("#", 1)[0].strip()
+        if line:
+            name = re.split(r"[<>=!~\[; ]", line, 1)[0]
+            normalized.add(name.lower().replace("_", "-") + line[len(name):].replace(" ", ""))
+    return sorted(normalized)
+
+
+def base_tag(from_image: str, requirements: List[str], repository: str = "codecraft-base") -> str:
+    """Тег базового образа: хэш исходного образа и нормализованных требований."""
+    payload = "\n".join([from_image] + normalize_requirements(requirements))
+    return f"{repository}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]}"
+
+
+def dockerfile_lines(dockerfile: str) -> List[str]:
+    """Строки Dockerfile с объединёнными продолжениями (\\ в конце строки)."""
+    lines, current = [], ""
+    for raw in dockerfile.splitlines():
+        stripped = raw.rstrip()
+        if stripped.endswith("\\"):
+            current += stripped[:-1] + " "
+            continue
+        lines.append(current + raw)
+        current = ""
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _pip_packages(command: str) -> Optional[List[str]]:
+    """Пакеты из команды RUN, если она целиком состоит из pip install; иначе None."""
+    packages = []
+    for part in command.split("&&"):
+        match = _PIP_INSTALL.match(part.strip())
+        if not match:
+            return None
+        tokens = shlex.split(match.group(1))
+        for index, token in enumerate(tokens):
+            if token.startswith("-") or (index and tokens[index - 1] in _PIP_VALUE_OPTIONS):
+                continue
+            if token.lower() not in ("pip", "setuptools", "wheel"):
+                packages.append(token)
+    return packages
+
+
+def split_dockerfile(dockerfile: str) -> Optional[Dict[str, Any]]:
+    """Разделение Dockerfile на базу (FROM, установка зависимостей) и слой приложения.
+
+    Возвращает исходный образ, пакеты из RUN pip install и строки, которые
+    остаются поверх базового образа. None для многоэтапных Dockerfile и
+    Dockerfile без установки зависимостей — их собирают как есть.
+    """
+    from_image, packages, uses_requirements, rest = None, [], False, []
+    for line in dockerfile_lines(dockerfile):
+        instruction, _, argument = line.strip().partition(" ")
+        instruction = instruction.upper()
+        if instruction == "FROM":
+            if from_image is not None:
+                return None
+            from_image = argument.split(" AS ")[0].split(" as ")[0].strip()
+            continue
+        if instruction == "RUN":
+            pip = _pip_packages(argument.strip())
+            if pip is not None:
+                packages.extend(pip)
+                uses_requirements = uses_requirements or "requirements" in argument
+                continue
+        if instruction in ("COPY", "ADD") and "requirements" in argument and len(argument.split()) == 2:
+            continue
+        rest.append(line)
+    if not from_image or (not packages and not uses_requirements):
+        return None
+    return {"from": from_image, "packages": packages, "uses_requirements": uses_requirements, "rest": rest}
+
+
+def pin_compose_image(compose: str, tag: str) -> str:
+    """Сервис с build в docker-compose переводится на уже собранный образ, чтобы compose не собирал его повторно."""
+    try:
+        spec = yaml.safe_load(compose)
+    except yaml.YAMLError:
+        return compose
+    services = spec.get("services") if isinstance(spec, dict) else None
+    if not isinstance(services, dict):
+        return compose
+    built = [service for service in services.values() if isinstance(service, dict) and "build" in service]
+    if len(built) != 1:
+        return compose
+    built[0].pop("build")
+    built[0]["image"] = tag
+    return yaml.safe_dump(spec, sort_keys=False, allow_unicode=True)
+
+
+def compose_host_port(compose: str) -> Optional[int]:
+    """Первый опубликованный на хосте порт сервисов docker-compose ("5000:5000", "127.0.0.1:80:80", published)."""
+    try:
+        spec = yaml.safe_load(compose)
+    except yaml.YAMLError:
+        return None
+    services = spec.get("services") if isinstance(spec, dict) else None
+    for service in (services or {}).values():
+        for entry in (service.get("ports") or []) if isinstance(service, dict) else []:
+            if isinstance(entry, dict) and entry.get("published"):
+                return int(entry["published"])
+            parts = str(entry).split("/")[0].split(":")
+            if len(parts) >= 2 and parts[-2].isdigit():
+                return int(parts[-2])
+    return None
+
+
+class ImageCache:
+    """Кэш базовых Docker-образов с предустановленными зависимостями.
+
+    Сгенерированный Dockerfile переписывается на базовый образ с тегом по
+    хэшу исходного образа и требований; при повторных попытках с теми же
+    зависимостями пересобирается только слой с app.py.
+    """
+
+    def __init__(self, docker_client, settings: Dict[str, Any], wheelhouse: Optional[Wheelhouse] = None,
+                 dependencies: Optional[DependencyResolver] = None):
+        self.client = docker_client
+        self.settings = settings
+        self.wheelhouse = wheelhouse
+        self.dependencies = dependencies
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _buildkit(self) -> bool:
+        return bool(self.settings["buildkit"]) and shutil.which("docker") is not None
+
+    def build(self, context_dir: str, tag: str, dockerfile: str = "Dockerfile", labels: Optional[Dict[str, str]] = None) -> str:
+        """Сборка образа: BuildKit через docker build или потоковая сборка через API."""
+        if self._buildkit():
+            cmd = ["docker", "build", "-t", tag, "-f", dockerfile]
+            for key, value in (labels or {}).items():
+                cmd += ["--label", f"{key}={value}"]
+            result = run_process(cmd + ["."], cwd=context_dir, timeout=self.settings["build_timeout"],
+                                 env={**os.environ, "DOCKER_BUILDKIT": "1"})
+            logs = result.stdout + result.stderr
+            if result.returncode != 0:
+                raise docker.errors.BuildError(logs.strip()[-2000:] or "docker build failed", [])
+            return logs
+
+        # Поток сборки не накапливается: в памяти начало, конец и последние события для BuildError
+        deadline = current_deadline()
+        log = BoundedLog("docker-build")
+        recent = deque(maxlen=BUILD_ERROR_CHUNKS)
+        try:
+            for chunk in self.client.api.build(path=context_dir, dockerfile=dockerfile, tag=tag, rm=True,
+                                               labels=labels, decode=True):
+                if deadline:
+                    deadline.check()
+                recent.append(chunk)
+                if "stream" in chunk:
+                    log.write(chunk["stream"])
+                if "error" in chunk:
+                    raise docker.errors.BuildError(chunk["error"], list(recent))
+        finally:
+            log.close()
+        return log.text()
+
+    def _exists(self, tag: str) -> bool:
+        try:
+            self.client.images.get(tag)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+
+    def ensure_base(self, from_image: str, requirements: List[str]) -> Tuple[str, str]:
+        """Базовый образ для требований: существующий или собранный. Возвращает (тег, логи)."""
+        requirements = normalize_requirements(requirements)
+        tag = base_tag(from_image, requirements, self.settings["repository"])
+        if self._exists(tag):
+            self.stats["hits"] += 1
+            logger.info(f"Базовый образ {tag} взят из кэша ({', '.join(requirements)})")
+            return tag, ""
+
+        self.stats["misses"] += 1
+        logger.info(f"Сборка базового образа {tag} ({', '.join(requirements)})")
+        context_dir = tempfile.mkdtemp(prefix="docker_base_")
+        try:
+            save_text("\n".join(requirements) + "\n", os.path.join(context_dir, "requirements.txt"))
+            save_text(
+                f"FROM {from_image}\n"
+                f"COPY requirements.txt /tmp/requirements.txt\n"
+                f"{self._install_step(from_image, requirements, context_dir)}\n",
+                os.path.join(context_dir, "Dockerfile")
+            )
+            logs = self.build(context_dir, tag, labels={BASE_LABEL: "1"})
+        finally:
+            shutil.rmtree(context_dir, ignore_errors=True)
+        self._evict(keep=tag)
+        return tag, logs
+
+    def _install_step(self, from_image: str, requirements: List[str], context_dir: str) -> str:
+        """Установка требований в базовом образе: из колёс склада в контексте сборки или из индекса."""
+        wheelhouse = self.wheelhouse if self.wheelhouse and self.wheelhouse.enabled else None
+        version = image_python_version(from_image)
+        if wheelhouse and version and wheelhouse.ensure(requirements, version, dest=os.path.join(context_dir, "wheels")):
+            install = "pip install --no-index --find-links /tmp/wheels -r /tmp/requirements.txt"
+            if self._buildkit():
+                # Колёса монтируются только на время установки и не попадают в слои образа
+                return f"RUN --mount=type=bind,source=wheels,target=/tmp/wheels {install}"
+            return f"COPY wheels /tmp/wheels\nRUN {install} && rm -rf /tmp/wheels"
+        if wheelhouse and wheelhouse.settings["offline"]:
+            raise docker.errors.BuildError(
+                f"Нет колёс для {', '.join(requirements)} (образ {from_image}), а загрузка запрещена (offline)", []
+            )
+        cache_mount = "--mount=type=cache,target=/root/.cache/pip " if self._buildkit() else ""
+        return f"RUN {cache_mount}pip install -r /tmp/requirements.txt"
+
+    def _evict(self, keep: str) -> None:
+        """Удаление самых старых базовых образов сверх max_bases."""
+        try:
+            images = self.client.images.list(filters={"label": BASE_LABEL})
+            if len(images) <= self.settings["max_bases"]:
+                return
+            images.sort(key=lambda image: image.attrs.get("Created", ""))
+            for image in images[:len(images) - self.settings["max_bases"]]:
+                if keep in image.tags:
+                    continue
+                self.client.images.remove(image.id)
+                logger.info(f"Удалён базовый образ {', '.join(image.tags) or image.id}")
+        except docker.errors.APIError as e:
+            logger.warning(f"Не удалось очистить базовые образы: {str(e)}")
+
+    def prepare(self, dockerfile: str, external_deps: List[str]) -> Tuple[str, str]:
+        """Dockerfile поверх кэшированного базового образа. Возвращает (Dockerfile, логи сборки базы).
+
+        Если Dockerfile не удаётся разделить на базу и приложение, он
+        возвращается без изменений.
+        """
+        if not self.settings["enabled"]:
+            return dockerfile, ""
+        parts = split_dockerfile(dockerfile)
+        if parts is None:
+            return dockerfile, ""
+        requirements = parts["packages"] + (list(external_deps) if parts["uses_requirements"] else [])
+        if not normalize_requirements(requirements):
+            return dockerfile, ""
+        if self.dependencies:
+            # Версии фиксируются по колёсам под Python образа, а не текущего интерпретатора
+            requirements = self.dependencies.pin(requirements, image_python_version(parts["from"]))
+        tag, logs = self.ensure_base(parts["from"], requirements)
+        rewritten = "\n".join([f"FROM {tag}"] + parts["rest"]) + "\n"
+        log_payload("Dockerfile на базовом образе", "docker", rewritten)
+        return rewritten, logs
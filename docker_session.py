@@ -0,0 +1,208 @@
+# docker_session.py
+import io
+import os
+import shlex
+import tarfile
+import posixpath
+from typing import Dict, Any, List, Optional, Tuple
+import yaml
+import docker
+from utils import logger
+from cache import stable_hash
+from docker_images import dockerfile_lines, compose_host_port
+from probes import poll
+from logcapture import capture_settings
+
+
+DOCKER_SESSION_DEFAULTS = {
+    "enabled": True,
+    "stop_timeout": 3,      # Секунд на завершение приложения по SIGTERM перед SIGKILL
+}
+
+SESSION_LABEL = "codecraft.session"
+
+# Ключи сервиса compose, которые сессия воспроизводит; с остальными используется docker-compose
+_SUPPORTED_SERVICE_KEYS = {"build", "image", "ports", "environment", "command", "container_name", "restart", "working_dir"}
+
+
+def copy_instructions(dockerfile: str) -> Tuple[List[Tuple[List[str], str]], str, Optional[List[str]]]:
+    """COPY/ADD из контекста сборки с абсолютными путями назначения, итоговый WORKDIR и CMD."""
+    workdir, copies, entrypoint, cmd = "/", [], [], []
+    for line in dockerfile_lines(dockerfile):
+        instruction, _, argument = line.strip().partition(" ")
+        instruction = instruction.upper()
+        if instruction == "WORKDIR":
+            workdir = posixpath.join(workdir, argument.strip())
+        elif instruction in ("COPY", "ADD"):
+            args = [a for a in shlex.split(argument) if not a.startswith("--")]
+            if "--from" in argument or len(args) < 2:
+                continue
+            *sources, dest = args
+            absolute = posixpath.normpath(posixpath.join(workdir, dest))
+            copies.append((sources, absolute + ("/" if dest.endswith("/") or dest == "." else "")))
+        elif instruction in ("CMD", "ENTRYPOINT"):
+            argument = argument.strip()
+            parsed = yaml.safe_load(argument) if argument.startswith("[") else ["sh", "-c", argument]
+            if instruction == "CMD":
+                cmd = parsed
+            else:
+                entrypoint = parsed
+    return copies, workdir, (entrypoint + cmd) or None
+
+
+def session_compatible(compose: str) -> bool:
+    """Один сервис без томов, зависимостей и сетей — такой compose сессия воспроизводит сама."""
+    try:
+        spec = yaml.safe_load(compose)
+    except yaml.YAMLError:
+        return False
+    services = spec.get("services") if isinstance(spec, dict) else None
+    if not isinstance(services, dict) or len(services) != 1:
+        return False
+    service = next(iter(services.values()))
+    return isinstance(service, dict) and set(service) <= _SUPPORTED_SERVICE_KEYS
+
+
+class DockerSession:
+    """Долгоживущий контейнер песочницы на время запуска конвейера.
+
+    Контейнер создаётся из собранного образа один раз (с init и бездействующим
+    PID 1), а приложение запускается в нём через exec. Если между попытками
+    изменился только код, файлы копируются в работающий контейнер и
+    приложение перезапускается — без пересборки образа и docker-compose up/down.
+    Dockerfile, compose или зависимости меняют ключ сессии и пересоздают контейнер.
+    """
+
+    def __init__(self, docker_client, settings: Dict[str, Any], limits: Optional[Dict[str, Any]] = None):
+        self.client = docker_client
+        self.settings = settings
+        self.limits = limits or {}
+        self.container = None
+        self.key: Optional[str] = None
+        self.port: Optional[int] = None
+        self.copies: List[Tuple[List[str], str]] = []
+        self.workdir = "/"
+        self.command: Optional[List[str]] = None
+        self.environment: Dict[str, str] = {}
+        self.stats = {"containers": 0, "restarts": 0}
+
+    @staticmethod
+    def session_key(dockerfile: str, compose: str, external_deps: List[str]) -> str:
+        return stable_hash({"dockerfile": dockerfile, "compose": compose, "deps": sorted(external_deps)})
+
+    def matches(self, key: str) -> bool:
+        if self.container is None or self.key != key:
+            return False
+        try:
+            self.container.reload()
+        except docker.errors.NotFound:
+            self.container = None
+            return False
+        return self.container.status == "running"
+
+    def start(self, image: str, dockerfile: str, compose: str, key: str) -> None:
+        """Запуск контейнера сессии из образа; приложение стартует отдельно (restart_app)."""
+        self.close()
+        service = next(iter(yaml.safe_load(compose)["services"].values()))
+        self.copies, workdir, command = copy_instructions(dockerfile)
+        self.workdir = service.get("working_dir") or workdir
+        image_config = self.client.images.get(image).attrs.get("Config", {})
+        compose_command = service.get("command")
+        if isinstance(compose_command, str):
+            compose_command = ["sh", "-c", compose_command]
+        self.command = compose_command or command or (image_config.get("Entrypoint") or []) + (image_config.get("Cmd") or [])
+        environment = service.get("environment") or {}
+        if isinstance(environment, list):
+            environment = dict(item.split("=", 1) for item in environment if "=" in item)
+        self.environment = {str(k): str(v) for k, v in environment.items()}
+
+        self.port = compose_host_port(compose)
+        ports = {}
+        for entry in service.get("ports") or []:
+            if isinstance(entry, dict):
+                ports[f"{entry['target']}/tcp"] = int(entry.get("published") or entry["target"])
+                continue
+            parts = str(entry).split("/")[0].split(":")
+            if len(parts) >= 2:
+                ports[f"{parts[-1]}/tcp"] = int(parts[-2])
+
+        self.container = self.client.containers.run(
+            image, entrypoint=["sleep", "infinity"], command=[], detach=True, init=True,
+            ports=ports, environment=self.environment, working_dir=self.workdir,
+            labels={SESSION_LABEL: key}, **self.limits
+        )
+        self.key = key
+        self.stats["containers"] += 1
+        logger.info(f"Запущен контейнер сессии {self.container.short_id} (образ {image}, порт {self.port})")
+
+    def sync(self, context_dir: str) -> int:
+        """Копирование файлов COPY/ADD из контекста сборки в работающий контейнер."""
+        copied = 0
+        for sources, dest in self.copies:
+            directory_dest = dest.endswith("/") or len(sources) > 1 or any(
+                os.path.isdir(os.path.join(context_dir, source)) for source in sources
+            )
+            target = dest.rstrip("/") if directory_dest else posixpath.dirname(dest)
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode="w") as archive:
+                for source in sources:
+                    path = os.path.join(context_dir, source)
+                    if not os.path.exists(path):
+                        continue
+                    if os.path.isdir(path):
+                        for name in os.listdir(path):
+                            archive.add(os.path.join(path, name), arcname=name)
+                    else:
+                        archive.add(path, arcname=os.path.basename(path) if directory_dest else posixpath.basename(dest))
+                    copied += 1
+            self.container.exec_run(["mkdir", "-p", target or "/"])
+            self.container.put_archive(target or "/", buffer.getvalue())
+        return copied
+
+    def restart_app(self) -> None:
+        """Остановка предыдущего процесса приложения и запуск нового через exec."""
+        stop_timeout = int(self.settings["stop_timeout"])
+        self.container.exec_run(["sh", "-c", (
+            "pid=$(cat /tmp/app.pid 2>/dev/null) || exit 0; kill $pid 2>/dev/null; "
+            f"for i in $(seq {stop_timeout * 20}); do kill -0 $pid 2>/dev/null || exit 0; sleep 0.05; done; "
+            "kill -9 $pid 2>/dev/null"
+        )])
+        self.container.exec_run(["rm", "-f", "/tmp/app.pid"])
+        command = " ".join(shlex.quote(part) for part in self.command)
+        self.container.exec_run(
+            ["sh", "-c", f"echo $$ > /tmp/app.pid; exec {command} > /tmp/app.log 2>&1"],
+            detach=True, workdir=self.workdir, environment=self.environment
+        )
+        # exec с detach возвращается сразу; PID нужен до проверок готовности
+        poll(lambda: self.container.exec_run(["test", "-s", "/tmp/app.pid"]).exit_code == 0, 5)
+        self.stats["restarts"] += 1
+        logger.info(f"Приложение перезапущено в контейнере сессии {self.container.short_id}")
+
+    def app_alive(self) -> bool:
+        result = self.container.exec_run(["sh", "-c", "kill -0 $(cat /tmp/app.pid 2>/dev/null) 2>/dev/null"])
+        return result.exit_code == 0
+
+    def logs(self) -> str:
+        """Начало и конец лога приложения: файл целиком не копируется из контейнера."""
+        capture = capture_settings()
+        head, tail = int(capture["head_bytes"]), int(capture["tail_bytes"])
+        script = (
+            f"size=$(wc -c < /tmp/app.log); "
+            f"if [ \"$size\" -le {head + tail} ]; then cat /tmp/app.log; "
+            f"else head -c {head} /tmp/app.log; "
+            f"printf '\\n... пропущено %s байт ...\\n' $((size - {head + tail})); "
+            f"tail -c {tail} /tmp/app.log; fi"
+        )
+        result = self.container.exec_run(["sh", "-c", script])
+        return result.output.decode("utf-8", errors="replace")
+
+    def close(self) -> None:
+        if self.container is None:
+            return
+        try:
+            self.container.remove(force=True)
+            logger.info(f"Контейнер сессии {self.container.short_id} удалён")
+        except docker.errors.APIError as e:
+            logger.warning(f"Не удалось удалить контейнер сессии: {str(e)}")
+        self.container = None
+        self.key = None
@@ -1,15 +1,37 @@
 # execution_env.py
 import os
+import signal
+import logging
 import subprocess
 import tempfile
 import shutil
+import hashlib
 import docker
+from collections import OrderedDict
 from typing import Dict, Any, Optional
-from utils import logger, save_text, load_json
+from utils import logger, log_payload, save_text, load_json, read_settings_section
+from deadlines import run_process, DeadlineExceeded
 import time 
 
+from code_analysis import detect_long_running, endpoint_checks
+from dependencies import DependencyResolver, DEPENDENCY_DEFAULTS
+from supervisor import ServerProcess, PortBusy, supervise_long_running
+from sandbox_pool import SandboxPool, SANDBOX_POOL_DEFAULTS
+from wheelhouse import Wheelhouse, WHEELHOUSE_DEFAULTS
+from docker_images import ImageCache, DOCKER_CACHE_DEFAULTS, pin_compose_image, compose_host_port
+from docker_session import DockerSession, DOCKER_SESSION_DEFAULTS, session_compatible
+from resources import RESOURCE_DEFAULTS, UsageLog, rlimits, docker_limits, limit_container, container_usage, merge_usage, describe_exit
+from probes import poll, wait_for_port, wait_for_http, run_checks, PROBE_DEFAULTS
+from pytest_worker import PytestWorkers, WorkerUnavailable, PYTEST_WORKER_DEFAULTS, format_report
+from loadgen import run_load, PERFORMANCE_DEFAULTS
+from profiling import PROFILING_DEFAULTS, profile_command, profile_env, load_profile
+from logcapture import excerpt
 
-from utils import call_openrouter
+
+EXECUTION_DEFAULTS = {
+    "startup_timeout": 15,
+    "observe_seconds": 3,
+}
 
 
 class ExecutionEnvironment:
@@ -18,6 +40,24 @@ class ExecutionEnvironment:
         self.project_dir = project_dir
         self.docker_client = docker.from_env()
         self.temp_dir = None
+        self._executions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.settings = read_settings_section("execution", EXECUTION_DEFAULTS)
+        self.wheelhouse = Wheelhouse(read_settings_section("wheelhouse", WHEELHOUSE_DEFAULTS))
+        self.dependencies = DependencyResolver(read_settings_section("dependencies", DEPENDENCY_DEFAULTS), self.wheelhouse)
+        self.sandboxes = SandboxPool(read_settings_section("sandbox_pool", SANDBOX_POOL_DEFAULTS), self.wheelhouse)
+        if self.sandboxes.settings["enabled"] and self.sandboxes.settings["prewarm"]:
+            self.sandboxes.prewarm()
+        self.resources = read_settings_section("resources", RESOURCE_DEFAULTS)
+        self.limits = rlimits(self.resources)
+        self.usage = UsageLog()
+        self.session = DockerSession(self.docker_client, read_settings_section("docker_session", DOCKER_SESSION_DEFAULTS),
+                                     limits=docker_limits(self.resources))
+        self.probes = read_settings_section("probes", PROBE_DEFAULTS)
+        self.performance = read_settings_section("performance", PERFORMANCE_DEFAULTS)
+        self.profiling = read_settings_section("profiling", PROFILING_DEFAULTS)
+        self.images = ImageCache(self.docker_client, read_settings_section("docker_cache", DOCKER_CACHE_DEFAULTS),
+                                 self.wheelhouse, self.dependencies)
+        self.test_workers = PytestWorkers(read_settings_section("pytest_worker", PYTEST_WORKER_DEFAULTS))
 
     def setup_sandbox(self) -> str:
         """Создание временной песочницы для выполнения."""
@@ -35,10 +75,35 @@ class ExecutionEnvironment:
         self.temp_dir = None
 
     def execute_python_code(self, code: str, test_code: Optional[str] = None) -> Dict[str, Any]:
-        """Выполнение Python-кода в изолированной среде."""
-        sandbox_dir = self.setup_sandbox()
-        code_path = os.path.join(sandbox_dir, "app.py")
-        test_path = os.path.join(sandbox_dir, "test_app.py") if test_code else None
+        """Выполнение Python-кода с запоминанием результата для того же кода и тестов.
+
+        Один и тот же код проверяется и уровнем sandbox верификации, и этапом
+        конвейера; повторный прогон возвращает сохранённый результат.
+        """
+        key = hashlib.sha256(f"{code}\0{test_code or ''}".encode('utf-8')).hexdigest()
+        if key in self._executions:
+            logger.info("Результат выполнения кода взят из памяти (код не изменился)")
+            return self._executions[key]
+        result = self._execute_python_code(code, test_code)
+        self.usage.record("pytest" if test_code else "python", result)
+        # Таймауты и отмены зависят от обстоятельств, а не от кода, поэтому не запоминаются
+        if result.get("error") not in ("Timeout", "Deadline exceeded"):
+            self._executions[key] = result
+            while len(self._executions) > 32:
+                self._executions.popitem(last=False)
+        return result
+
+    def _execute_python_code(self, code: str, test_code: Optional[str] = None) -> Dict[str, Any]:
+        """Выполнение Python-кода в песочнице из пула с окружением под его зависимости."""
+        dependencies = self.dependencies.resolve([code, test_code or ""], local_modules={"app", "pytest"})
+        with self.sandboxes.lease(dependencies) as sandbox:
+            return self._run_in_sandbox(sandbox, code, test_code)
+
+    def _run_in_sandbox(self, sandbox, code: str, test_code: Optional[str] = None) -> Dict[str, Any]:
+        """Проверка синтаксиса, тесты или запуск кода в арендованной песочнице."""
+        code_path = os.path.join(sandbox.work, "app.py")
+        test_path = os.path.join(sandbox.work, "test_app.py") if test_code else None
+        python, env = sandbox.python, {**os.environ, **sandbox.env()}
 
         # Сохранение кода
         save_text(code, code_path)
@@ -47,78 +112,157 @@ class ExecutionEnvironment:
 
         try:
             # Проверка синтаксиса
-            result = subprocess.run(
-                ["python", "-m", "py_compile", code_path],
-                capture_output=True, text=True, timeout=10
-            )
+            result = run_process([python, "-m", "py_compile", code_path], timeout=10, env=env, limits=self.limits)
             if result.returncode != 0:
-                logger.error(f"Ошибка синтаксиса в коде: {result.stderr}")
-                return {"status": "failed", "logs": result.stderr, "error": "Syntax error"}
-
-            # Использование LLM для определения, запускает ли код бесконечный процесс
-            prompt = f"""
-    Проанализируй следующий Python-код и определи, будет ли он выполняться бесконечно (например, запускает веб-сервер без явного завершения):
-
-    {code}
-
-    Ответь только "да" или "нет".
-    Ответь "да", если код:
-    1. Запускает веб-сервер (Flask, aiohttp, FastAPI и т.д.)
-    2. Содержит бесконечный цикл (while True)
-    3. Запускает любой процесс, который не завершается сам по себе
-
-    Ответь "нет", если код:
-    1. Выполняет конечное число операций и завершается
-    2. Содержит только определения функций и классов без их вызова
-    3. Содержит веб-сервер, но его запуск обернут в условие if __name__ == "__main__" и не будет выполнен при импорте
-    """
-            
-            # Вызов LLM для анализа кода
-            infinite_execution = call_openrouter(prompt).strip().lower()
-            logger.info(f"LLM анализ кода: бесконечное выполнение = {infinite_execution}")
-            
-            if infinite_execution == "да":
-                logger.info(f"Код определен как запускающий бесконечный процесс, пропускаем фактическое выполнение")
-                return {"status": "success", "logs": "Код успешно скомпилирован. Выполнение пропущено, так как код запускает бесконечный процесс.", "warning": "infinite_execution"}
+                logger.error(f"Ошибка синтаксиса в коде: {excerpt(result.stderr)}")
+                return {"status": "failed", "logs": excerpt(result.stderr), "error": "Syntax error"}
+
+            # Статическое определение долгоживущего кода (сервер, бесконечный цикл)
+            long_running = detect_long_running(code)
+            if long_running["kind"]:
+                logger.info(
+                    f"Код долгоживущий ({long_running['kind']}, {', '.join(long_running['calls'])}, "
+                    f"под __main__: {long_running['guarded']}), запуск под надзором"
+                )
 
             # Выполнение тестов, если они есть
             if test_code:
-                result = subprocess.run(
-                    ["pytest", test_path, "-v"],
-                    capture_output=True, text=True, timeout=30
+                return self._run_tests(sandbox, test_path, env)
+            elif long_running["kind"]:
+                # Сервер запускается по-настоящему: проверяется готовность порта, затем остановка
+                result = supervise_long_running(
+                    code_path, long_running["port"],
+                    startup_timeout=self.settings["startup_timeout"],
+                    observe_seconds=self.settings["observe_seconds"],
+                    python=python, env=sandbox.env(), limits=self.limits
                 )
-                logs = result.stdout + result.stderr
-                if result.returncode != 0:
-                    logger.error(f"Тесты не пройдены: {logs}")
-                    return {"status": "failed", "logs": logs, "error": "Tests failed"}
-                logger.info(f"Тесты успешно пройдены: {logs}")
-                return {"status": "success", "logs": logs}
+                log_payload("Проверка долгоживущего кода", "supervisor", result["logs"],
+                            logging.INFO if result["status"] == "success" else logging.ERROR)
+                return {**result, "logs": excerpt(result["logs"])}
             else:
                 # Простая проверка выполнения
-                result = subprocess.run(
-                    ["python", code_path],
-                    capture_output=True, text=True, timeout=10
-                )
+                result = run_process([python, code_path], timeout=10, cwd=sandbox.work, env=env, limits=self.limits)
                 logs = result.stdout + result.stderr
                 if result.returncode != 0:
-                    logger.error(f"Ошибка выполнения кода: {logs}")
-                    return {"status": "failed", "logs": logs, "error": "Execution failed"}
-                logger.info(f"Код успешно выполнен: {logs}")
-                return {"status": "success", "logs": logs}
+                    reason = describe_exit(result.returncode)
+                    logs = f"{logs}\n{reason}" if reason else logs
+                    log_payload("Ошибка выполнения кода", "python", logs, logging.ERROR)
+                    return {"status": "failed", "logs": excerpt(logs), "error": "Execution failed", "usage": result.usage}
+                log_payload("Код успешно выполнен", "python", logs)
+                return {"status": "success", "logs": excerpt(logs), "usage": result.usage}
 
         except subprocess.TimeoutExpired as e:
             logger.error(f"Превышено время выполнения: {str(e)}")
             return {"status": "failed", "logs": str(e), "error": "Timeout"}
+        except DeadlineExceeded as e:
+            logger.error(f"Выполнение кода отменено: {str(e)}")
+            return {"status": "failed", "logs": str(e), "error": "Deadline exceeded"}
         except Exception as e:
             logger.error(f"Ошибка в песочнице: {str(e)}")
             return {"status": "failed", "logs": str(e), "error": "Execution error"}
-        finally:
-            self.cleanup_sandbox()
 
 
 
 
 
+    def _run_tests(self, sandbox, test_path: str, env: Dict[str, str]) -> Dict[str, Any]:
+        """Тесты через сервер pytest песочницы; без него — отдельным процессом pytest."""
+        report = None
+        if self.test_workers.settings["enabled"]:
+            try:
+                report = self.test_workers.run(sandbox.python, env, test_path, cwd=sandbox.work, timeout=30,
+                                               limits=self.limits)
+            except WorkerUnavailable as e:
+                logger.warning(f"Сервер pytest недоступен, запуск отдельным процессом: {str(e)}")
+        if report is not None:
+            logs = format_report(report)
+            failed = report["exitcode"] != 0
+            extra = {"tests": report["tests"], "summary": report["summary"], "usage": report.get("usage")}
+        else:
+            result = run_process([sandbox.python, "-m", "pytest", test_path, "-v"], timeout=30, cwd=sandbox.work,
+                                 env=env, limits=self.limits)
+            logs = result.stdout + result.stderr
+            failed = result.returncode != 0
+            extra = {"usage": result.usage}
+        if failed:
+            log_payload("Тесты не пройдены", "pytest", logs, logging.ERROR)
+            return {"status": "failed", "logs": excerpt(logs), "error": "Tests failed", **extra}
+        log_payload("Тесты успешно пройдены", "pytest", logs)
+        return {"status": "success", "logs": excerpt(logs), **extra}
+
+    def run_load(self, code: str, targets: list) -> Dict[str, Any]:
+        """Нагрузочный прогон сервера в песочнице: запуск под надзором, нагрузка, остановка.
+
+        Статус skipped — код не поднимает HTTP-сервер на известном порту.
+        """
+        result = self._serve_under_load(code, targets, self.performance)
+        self.usage.record("load", result)
+        return result
+
+    def profile_app(self, code: str, targets: list) -> Dict[str, Any]:
+        """Прогон сервера под cProfile и tracemalloc (profile_runner.py) с синтетической нагрузкой.
+
+        В результате, кроме метрик, — отчёт профилировщика: горячие функции
+        и места выделения памяти с начала нагрузки.
+        """
+        settings = {**self.performance, "duration": self.profiling["duration"],
+                    "concurrency": self.profiling["concurrency"], "warmup": 0}
+        result = self._serve_under_load(code, targets, settings, profile=True)
+        self.usage.record("profile", result)
+        return result
+
+    def _serve_under_load(self, code: str, targets: list, settings: Dict[str, Any],
+                          profile: bool = False) -> Dict[str, Any]:
+        long_running = detect_long_running(code)
+        if long_running["kind"] != "server" or not long_running["port"]:
+            return {"status": "skipped", "logs": "код не запускает HTTP-сервер на известном порту"}
+        port = long_running["port"]
+        # Контейнер сессии публикует тот же порт: без остановки нагрузка шла бы на него, а не на этот сервер
+        self.session.close()
+        dependencies = self.dependencies.resolve([code], local_modules={"app"})
+        report = None
+        try:
+            with self.sandboxes.lease(dependencies) as sandbox:
+                code_path = os.path.join(sandbox.work, "app.py")
+                report_path = os.path.join(sandbox.work, "profile.json")
+                save_text(code, code_path)
+                cmd, env = [sandbox.python, code_path], sandbox.env()
+                if profile:
+                    cmd, env = profile_command(sandbox.python, code_path, report_path), {**env, **profile_env(self.profiling)}
+                with ServerProcess(cmd, cwd=sandbox.work, env=env, limits=self.limits, port=port) as server:
+                    base_url = f"http://127.0.0.1:{port}"
+                    timeout = settings["startup_timeout"]
+                    ready = server.wait_ready(port, timeout) and wait_for_http(base_url, timeout, alive=server.alive)
+                    if ready and profile:
+                        # Отметка начала нагрузки: импорт и запуск не попадают в профиль
+                        server.process.send_signal(signal.SIGUSR1)
+                    metrics = run_load(port, targets, settings) if ready else None
+                    crashed = not server.alive()
+                    if profile:
+                        # Отчёт пишется после SIGTERM, на это нужно больше обычного времени остановки
+                        server.stop(grace=30)
+                        report = load_profile(report_path)
+                logs = server.logs()
+                usage = server.process.usage
+        except DeadlineExceeded as e:
+            logger.error(f"Нагрузочный прогон отменён: {str(e)}")
+            return {"status": "failed", "logs": str(e), "error": "Deadline exceeded"}
+        except PortBusy as e:
+            logger.error(f"Нагрузочный прогон не запущен: {str(e)}")
+            return {"status": "failed", "logs": str(e), "error": "Port busy"}
+
+        if metrics is None:
+            state = "сервер завершился" if crashed else f"порт {port} не ответил за {timeout} сек"
+            return {"status": "failed", "logs": excerpt(f"{state}\n{logs}"), "error": "Server not ready", "usage": usage}
+        if crashed:
+            reason = describe_exit(server.process.returncode)
+            return {"status": "failed", "logs": excerpt(f"сервер упал под нагрузкой {reason}\n{logs}"),
+                    "error": "Server crashed", "metrics": metrics, "usage": usage}
+        result = {"status": "success", "logs": excerpt(logs), "metrics": metrics, "usage": usage}
+        if profile:
+            result["profile"] = report
+        return result
+
     def execute_python_code_old(self, code: str, test_code: Optional[str] = None) -> Dict[str, Any]:
         """Выполнение Python-кода в изолированной среде."""
         sandbox_dir = self.setup_sandbox()
@@ -132,38 +276,29 @@ class ExecutionEnvironment:
 
         try:
             # Проверка синтаксиса
-            result = subprocess.run(
-                ["python", "-m", "py_compile", code_path],
-                capture_output=True, text=True, timeout=10
-            )
+            result = run_process(["python", "-m", "py_compile", code_path], timeout=10)
             if result.returncode != 0:
-                logger.error(f"Ошибка синтаксиса в коде: {result.stderr}")
-                return {"status": "failed", "logs": result.stderr, "error": "Syntax error"}
+                logger.error(f"Ошибка синтаксиса в коде: {excerpt(result.stderr)}")
+                return {"status": "failed", "logs": excerpt(result.stderr), "error": "Syntax error"}
 
             # Выполнение тестов, если они есть
             if test_code:
-                result = subprocess.run(
-                    ["pytest", test_path, "-v"],
-                    capture_output=True, text=True, timeout=30
-                )
+                result = run_process(["pytest", test_path, "-v"], timeout=30)
                 logs = result.stdout + result.stderr
                 if result.returncode != 0:
-                    logger.error(f"Тесты не пройдены: {logs}")
-                    return {"status": "failed", "logs": logs, "error": "Tests failed"}
-                logger.info(f"Тесты успешно пройдены: {logs}")
-                return {"status": "success", "logs": logs}
+                    log_payload("Тесты не пройдены", "pytest", logs, logging.ERROR)
+                    return {"status": "failed", "logs": excerpt(logs), "error": "Tests failed"}
+                log_payload("Тесты успешно пройдены", "pytest", logs)
+                return {"status": "success", "logs": excerpt(logs)}
             else:
                 # Простая проверка выполнения
-                result = subprocess.run(
-                    ["python", code_path],
-                    capture_output=True, text=True, timeout=10
-                )
+                result = run_process(["python", code_path], timeout=10)
                 logs = result.stdout + result.stderr
                 if result.returncode != 0:
-                    logger.error(f"Ошибка выполнения кода: {logs}")
-                    return {"status": "failed", "logs": logs, "error": "Execution failed"}
-                logger.info(f"Код успешно выполнен: {logs}")
-                return {"status": "success", "logs": logs}
+                    log_payload("Ошибка выполнения кода", "python", logs, logging.ERROR)
+                    return {"status": "failed", "logs": excerpt(logs), "error": "Execution failed"}
+                log_payload("Код успешно выполнен", "python", logs)
+                return {"status": "success", "logs": excerpt(logs)}
 
         except subprocess.TimeoutExpired as e:
             logger.error(f"Превышено время выполнения: {str(e)}")
@@ -177,102 +312,102 @@ class ExecutionEnvironment:
 
 
 
-    def execute_docker(self, dockerfile: str, compose: str, external_deps: list = []) -> Dict[str, Any]:
-        """Выполнение Docker-контейнеров в изолированной среде."""
-        import time
-        
-        sandbox_dir = self.setup_sandbox()
-        dockerfile_path = os.path.join(sandbox_dir, "Dockerfile")
-        compose_path = os.path.join(sandbox_dir, "docker-compose.yml")
+    def _compose_containers(self, compose_path: str, sandbox_dir: str) -> list:
+        result = run_process(["docker-compose", "-f", compose_path, "ps", "-q"], cwd=sandbox_dir, timeout=30)
+        return [self.docker_client.containers.get(cid) for cid in result.stdout.split()]
 
-        # Сохранение файлов
-        save_text(dockerfile, dockerfile_path)
-        save_text(compose, compose_path)
-        
-        # Создаем структуру директорий, аналогичную проекту
-        os.makedirs(os.path.join(sandbox_dir, "project"), exist_ok=True)
-        
-        # Копируем app.py из project в песочницу с сохранением структуры
+    @staticmethod
+    def _containers_running(containers: list) -> bool:
+        """Все контейнеры compose работают (вышедший контейнер обрывает ожидание готовности)."""
+        for container in containers:
+            container.reload()
+            if container.status != "running":
+                return False
+        return True
+
+    def _probe_service(self, port: Optional[int], alive, plan: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Ожидание готовности сервиса по порту и проверочные запросы к эндпоинтам."""
+        app_code = ""
         if os.path.exists("project/app.py"):
-            app_content = ""
             with open("project/app.py", "r") as f:
-                app_content = f.read()
-            save_text(app_content, os.path.join(sandbox_dir, "project", "app.py"))
-            logger.info(f"Скопирован app.py в контекст сборки с сохранением структуры")
-        
-        # Создаем requirements.txt, если он используется в Dockerfile
-        if "requirements.txt" in dockerfile:
-            # Создаем requirements.txt с указанными зависимостями
-            requirements_content = "\n".join(external_deps)
-            save_text(requirements_content, os.path.join(sandbox_dir, "requirements.txt"))
-            logger.info(f"Создан requirements.txt с зависимостями: {external_deps}")
-
+                app_code = f.read()
+
+        if port is None:
+            # Порт не опубликован: достаточно, что контейнеры не упали за время наблюдения
+            observe = self.probes["startup_timeout"] / 3
+            ready = alive() and not poll(lambda: not alive(), observe, max_interval=self.probes["max_interval"])
+            return {"ready": ready, "issues": [], "logs": "контейнеры работают (порт не опубликован, эндпоинты не проверялись)"}
+
+        started = time.monotonic()
+        base_url = f"http://127.0.0.1:{port}"
+        timeout, interval = self.probes["startup_timeout"], self.probes["max_interval"]
+        ready = wait_for_port(port, timeout, alive=alive, max_interval=interval) \
+            and wait_for_http(base_url, timeout, alive=alive, max_interval=interval)
+        if not ready:
+            state = "контейнер завершился" if not alive() else f"порт {port} не ответил за {timeout} сек"
+            return {"ready": False, "issues": [], "logs": state}
+        logger.info(f"Сервис готов на порту {port} через {time.monotonic() - started:.2f} сек")
+
+        issues, lines = run_checks(base_url, endpoint_checks(app_code, plan), self.probes["request_timeout"])
+        return {"ready": True, "issues": issues, "logs": "\n".join([f"Сервис готов на порту {port}"] + lines)}
+
+    def _execute_in_session(self, dockerfile: str, compose: str, external_deps: list,
+                            plan: Optional[Dict[str, Any]], sandbox_dir: str) -> Dict[str, Any]:
+        """Проверка в долгоживущем контейнере: пересборка только при смене Dockerfile, compose или зависимостей."""
+        key = DockerSession.session_key(dockerfile, compose, external_deps)
+        build_logs = ""
         try:
-            # Сборка Docker-образа
-            logger.info("Сборка Docker-образа...")
-            image, build_logs = self.docker_client.images.build(
-                path=sandbox_dir,
-                dockerfile="Dockerfile",
-                tag="sandbox_app:latest",
-                rm=True
-            )
-            build_logs_str = "\n".join([log.get("stream", "") for log in build_logs if "stream" in log])
-            logger.info(f"Логи сборки: {build_logs_str}")
-
-            # Запуск контейнера через docker-compose
-            logger.info("Запуск docker-compose...")
-            result = subprocess.run(
-                ["docker-compose", "-f", compose_path, "up", "-d"],
-                capture_output=True, text=True, cwd=sandbox_dir, timeout=60
-            )
-            if result.returncode != 0:
-                logger.error(f"Ошибка запуска docker-compose: {result.stderr}")
-                return {"status": "failed", "logs": result.stderr, "error": "Docker compose failed"}
-
-            # Проверка, что контейнеры запущены
-            time.sleep(2)  # Даем небольшую задержку
-            container_check = subprocess.run(
-                ["docker-compose", "-f", compose_path, "ps"],
-                capture_output=True, text=True, cwd=sandbox_dir, timeout=10
-            )
-            
-            # Анализируем вывод, чтобы определить, работают ли контейнеры
-            if "Up" in container_check.stdout:
-                logger.info("Docker-контейнеры успешно запущены")
-                return {"status": "success", "logs": build_logs_str + "\n" + container_check.stdout}
+            if self.session.matches(key):
+                copied = self.session.sync(sandbox_dir)
+                logger.info(f"Контейнер сессии переиспользован, синхронизировано файлов: {copied}")
             else:
-                logger.error(f"Контейнеры не запущены: {container_check.stdout}")
-                return {"status": "failed", "logs": container_check.stdout, "error": "Containers not running"}
-
-        except docker.errors.BuildError as e:
-            logger.error(f"Ошибка сборки Docker: {str(e)}")
-            return {"status": "failed", "logs": str(e), "error": "Build error"}
-        except subprocess.TimeoutExpired as e:
-            logger.error(f"Превышено время выполнения Docker: {str(e)}")
-            return {"status": "failed", "logs": str(e), "error": "Timeout"}
-        except Exception as e:
-            logger.error(f"Ошибка выполнения Docker: {str(e)}")
-            return {"status": "failed", "logs": str(e), "error": "Docker error"}
-        finally:
-            # Остановка и удаление контейнеров
-            subprocess.run(["docker-compose", "-f", compose_path, "down"], cwd=sandbox_dir)
-            self.cleanup_sandbox()
-
-
-    def _test_api_endpoint(self) -> Dict[str, Any]:
-        """Простая проверка запуска контейнера без тестирования эндпоинтов."""
-        # Проверяем, что контейнер запущен
-        return {"status": "success", "logs": "Container started successfully"}
-
-    def execute_docker(self, dockerfile: str, compose: str, external_deps: list = []) -> Dict[str, Any]:
+                dockerfile, base_logs = self.images.prepare(dockerfile, external_deps)
+                save_text(dockerfile, os.path.join(sandbox_dir, "Dockerfile"))
+                logger.info("Сборка Docker-образа...")
+                build_logs = base_logs + self.images.build(sandbox_dir, "sandbox_app:latest")
+                log_payload("Логи сборки", "docker", build_logs)
+                self.session.start("sandbox_app:latest", dockerfile, compose, key)
+            started, before = time.monotonic(), container_usage(self.session.container, time.monotonic())
+            self.session.restart_app()
+            probe = self._probe_service(self.session.port, self.session.app_alive, plan)
+            # Контейнер сессии живёт между попытками, поэтому CPU считается как прирост за попытку
+            usage = container_usage(self.session.container, started)
+            usage["cpu_seconds"] = round(usage["cpu_seconds"] - before["cpu_seconds"], 3)
+        except docker.errors.APIError:
+            # Состояние контейнера неизвестно — следующая попытка создаст новый
+            self.session.close()
+            raise
+
+        if not probe["ready"] or probe["issues"]:
+            logs = "\n".join([probe["logs"], *probe["issues"], self.session.logs()])
+            log_payload("Проверка контейнера сессии не пройдена", "docker", logs, logging.ERROR)
+            error = "Container not ready" if not probe["ready"] else "Endpoint check failed"
+            return {"status": "failed", "logs": excerpt(logs), "error": error, "issues": probe["issues"], "usage": usage}
+        logger.info("Приложение в контейнере сессии запущено и проверено")
+        return {"status": "success", "logs": excerpt(build_logs + "\n" + probe["logs"]), "usage": usage}
+
+    def close(self) -> None:
+        """Остановка долгоживущих ресурсов запуска: контейнера сессии и серверов pytest."""
+        self.session.close()
+        self.test_workers.close()
+
+    def execute_docker(self, dockerfile: str, compose: str, external_deps: list = [],
+                       plan: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Выполнение Docker-контейнеров с учётом потребления ресурсов."""
+        result = self._execute_docker(dockerfile, compose, external_deps, plan)
+        self.usage.record("docker", result)
+        return result
+
+    def _execute_docker(self, dockerfile: str, compose: str, external_deps: list = [],
+                        plan: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Выполнение Docker-контейнеров в изолированной среде."""
         sandbox_dir = self.setup_sandbox()
         dockerfile_path = os.path.join(sandbox_dir, "Dockerfile")
         compose_path = os.path.join(sandbox_dir, "docker-compose.yml")
 
-        # Сохранение файлов
+        # Сохранение файлов; compose запускает уже собранный образ, а не собирает свой
         save_text(dockerfile, dockerfile_path)
-        save_text(compose, compose_path)
+        save_text(pin_compose_image(compose, "sandbox_app:latest"), compose_path)
         
         # Создаем структуру директорий, аналогичную проекту
         os.makedirs(os.path.join(sandbox_dir, "project"), exist_ok=True)
@@ -292,52 +427,66 @@ class ExecutionEnvironment:
             save_text(requirements_content, os.path.join(sandbox_dir, "requirements.txt"))
             logger.info(f"Создан requirements.txt с зависимостями: {external_deps}")
 
+        in_session = self.session.settings["enabled"] and session_compatible(compose)
         try:
+            if in_session:
+                return self._execute_in_session(dockerfile, compose, external_deps, plan, sandbox_dir)
+
             # Сборка Docker-образа
+            # Зависимости ставятся в кэшируемый базовый образ, поверх него собирается только приложение
+            dockerfile, base_logs = self.images.prepare(dockerfile, external_deps)
+            save_text(dockerfile, dockerfile_path)
             logger.info("Сборка Docker-образа...")
-            image, build_logs = self.docker_client.images.build(
-                path=sandbox_dir,
-                dockerfile="Dockerfile",
-                tag="sandbox_app:latest",
-                rm=True
-            )
-            build_logs_str = "\n".join([log.get("stream", "") for log in build_logs if "stream" in log])
-            logger.info(f"Логи сборки: {build_logs_str}")
+            build_logs_str = base_logs + self.images.build(sandbox_dir, "sandbox_app:latest")
+            log_payload("Логи сборки", "docker", build_logs_str)
 
             # Запуск контейнера через docker-compose
             logger.info("Запуск docker-compose...")
-            result = subprocess.run(
-                ["docker-compose", "-f", compose_path, "up", "-d"],
-                capture_output=True, text=True, cwd=sandbox_dir, timeout=60
-            )
+            result = run_process(["docker-compose", "-f", compose_path, "up", "-d"], cwd=sandbox_dir, timeout=60)
             if result.returncode != 0:
-                logger.error(f"Ошибка запуска docker-compose: {result.stderr}")
-                return {"status": "failed", "logs": result.stderr, "error": "Docker compose failed"}
-
-            # Проверка работоспособности (пример для API)
-            time.sleep(5)  # Ожидание запуска
-            test_result = self._test_api_endpoint()#
-            logger.info(f"Статус контейнера: {test_result['logs']}")
-
-            if test_result["status"] != "success":
-                logger.error(f"API не работает: {test_result['logs']}")
-                return test_result
+                logger.error(f"Ошибка запуска docker-compose: {excerpt(result.stderr)}")
+                return {"status": "failed", "logs": excerpt(result.stderr), "error": "Docker compose failed"}
+
+            # Проверка готовности и ответов эндпоинтов вместо фиксированной паузы
+            started = time.monotonic()
+            containers = self._compose_containers(compose_path, sandbox_dir)
+            for container in containers:
+                limit_container(container, self.resources)
+            probe = self._probe_service(compose_host_port(compose), lambda: self._containers_running(containers), plan)
+            usage = merge_usage([container_usage(container, started) for container in containers])
+            if not probe["ready"] or probe["issues"]:
+                container_logs = run_process(["docker-compose", "-f", compose_path, "logs", "--no-color"],
+                                             cwd=sandbox_dir, timeout=30)
+                logs = "\n".join([probe["logs"], *probe["issues"], container_logs.stdout + container_logs.stderr])
+                log_payload("Проверка контейнеров не пройдена", "docker", logs, logging.ERROR)
+                error = "Container not ready" if not probe["ready"] else "Endpoint check failed"
+                return {"status": "failed", "logs": excerpt(logs), "error": error, "issues": probe["issues"], "usage": usage}
 
             logger.info("Docker-контейнеры успешно запущены и проверены")
-            return {"status": "success", "logs": build_logs_str + "\n" + test_result["logs"]}
+            return {"status": "success", "logs": excerpt(build_logs_str + "\n" + probe["logs"]), "usage": usage}
 
         except docker.errors.BuildError as e:
             logger.error(f"Ошибка сборки Docker: {str(e)}")
             return {"status": "failed", "logs": str(e), "error": "Build error"}
         except subprocess.TimeoutExpired as e:
             logger.error(f"Превышено время выполнения Docker: {str(e)}")
-            return {"status": "failed", "logs": str(e), "error": "Timeout"}
+            return {"status": "failed", "logs": str(e), "error": "Timeout", "transient": True}
+        except DeadlineExceeded as e:
+            logger.error(f"Запуск Docker отменён: {str(e)}")
+            return {"status": "failed", "logs": str(e), "error": "Deadline exceeded"}
+        except docker.errors.APIError as e:
+            # Сбой демона Docker, а не ошибка в сгенерированных файлах
+            logger.error(f"Ошибка API Docker: {str(e)}")
+            return {"status": "failed", "logs": str(e), "error": "Docker API error", "transient": True}
         except Exception as e:
             logger.error(f"Ошибка выполнения Docker: {str(e)}")
             return {"status": "failed", "logs": str(e), "error": "Docker error"}
         finally:
             # Остановка и удаление контейнеров
-            subprocess.run(["docker-compose", "-f", compose_path, "down"], cwd=sandbox_dir)
+            # Очистка выполняется и после отмены этапа, поэтому без учёта его срока
+            # (контейнер сессии остаётся работать до следующей попытки)
+            if not in_session:
+                subprocess.run(["docker-compose", "-f", compose_path, "down"], cwd=sandbox_dir, timeout=60)
             self.cleanup_sandbox()
 
 
@@ -1,12 +1,17 @@
 # feedback_loop.py
 import json
-import time
 import os
+import threading
 from typing import Dict, Any, Optional, List
 from verification import VerificationAgent
 from utils import logger, load_json, save_json
 from agents import initialize_agents  # Предполагается, что agents.py обновлен
-from utils import logger, load_json, save_json, load_yaml
+from deadlines import current_deadline
+from transitions import TransitionEngine
+from code_repair import repair_code
+from dependencies import DependencyResolver, DEPENDENCY_DEFAULTS
+from wheelhouse import Wheelhouse, WHEELHOUSE_DEFAULTS
+from utils import logger, load_json, save_json, save_text, load_yaml, read_settings_section
 
 
 
@@ -20,9 +25,16 @@ class FeedbackLoop:
         self.config = settings.get('feedback', {})
         self.verification_rules = settings.get('verification_rules', {})
         self.verifier = VerificationAgent(rules_path)
+        self.transitions = TransitionEngine.from_settings(config_path)
 
         self.agents = initialize_agents()
+        self.dependencies = DependencyResolver(
+            read_settings_section("dependencies", DEPENDENCY_DEFAULTS),
+            Wheelhouse(read_settings_section("wheelhouse", WHEELHOUSE_DEFAULTS))
+        )
         self.previous_results = {}  # Хранение результатов предыдущих агентов
+        # Этапы конвейера выполняются параллельно и разделяют один state
+        self.state_lock = threading.RLock()
         
         # Загрузка сохраненных результатов для восстановления контекста
         self._load_previous_results()
@@ -38,13 +50,17 @@ class FeedbackLoop:
                 self.previous_results = state["previous_results"]
                 logger.info(f"Загружены предыдущие результаты из {state_path}")
 
+    def save_state(self, state: Dict[str, Any], state_path: str = "project/state.json") -> None:
+        """Потокобезопасное сохранение состояния."""
+        with self.state_lock:
+            save_json(state, state_path)
+
     def get_agent_config(self, agent_name: str) -> Dict[str, Any]:
         """Получение специфической конфигурации для агента."""
         # Получаем базовую конфигурацию
         base_config = {
             "max_iterations": self.config.get("max_iterations", 3),
-            "confidence_threshold": self.config.get("confidence_threshold", 0.7),
-            "retry_delay": self.config.get("retry_delay", 2)
+            "confidence_threshold": self.config.get("confidence_threshold", 0.7)
         }
         
         # Переопределяем специфичными настройками для агента, если они есть
@@ -62,9 +78,17 @@ class FeedbackLoop:
         iterations = 0
         max_iterations = agent_config["max_iterations"]
         confidence_threshold = agent_config["confidence_threshold"]
-        retry_delay = agent_config["retry_delay"]
+
+        patch_mode = agent_name == "codegen" and agent_config.get("patch_mode", False)
+        pending_patch = None
+        deadline = current_deadline()
 
         while iterations < max_iterations:
+            # Сторож отменил этап: новые итерации бессмысленны
+            if deadline and deadline.cancelled.is_set():
+                logger.error(f"Агент {agent_name} остановлен: превышен срок этапа {deadline.name}")
+                return {"error": f"Deadline exceeded: {deadline.name}", "source": agent_name, "type": "timeout"}
+
             logger.info(f"Запуск агента {agent_name}, итерация {iterations + 1}/{max_iterations}")
             
             # Проверка существования агента
@@ -91,9 +115,18 @@ class FeedbackLoop:
                     # Кодогенератор должен получать данные из decomposer
                     decomposer_data = self.previous_results.get("decomposer", {})
                     if isinstance(decomposer_data, dict) and "data" in decomposer_data:
-                        result = agent.run(decomposer_data["data"])
+                        plan = decomposer_data["data"]
                     else:
-                        result = agent.run(processed_input)
+                        plan = processed_input
+                    result = None
+                    if pending_patch:
+                        # Повтор в режиме патча: модель присылает только diff к текущему коду
+                        result = agent.run_patch(plan, *pending_patch)
+                        pending_patch = None
+                        if isinstance(result.get("data"), dict) and "error" in result["data"]:
+                            result = None
+                    if result is None:
+                        result = agent.run(plan)
                 elif agent_name == "extractor":
                     # Экстрактор получает код из codegen
                     if isinstance(processed_input, dict) and "data" in processed_input:
@@ -103,13 +136,19 @@ class FeedbackLoop:
                 elif agent_name == "docker":
                     # Docker получает путь к файлу и зависимости
                     file_path = processed_input.get("file_path", "project/app.py") if isinstance(processed_input, dict) else "project/app.py"
-                    external = self._get_external_dependencies()
+                    external = processed_input.get("external") if isinstance(processed_input, dict) else None
+                    if external is None:
+                        external = self._get_external_dependencies(file_path)
                     result = agent.run(file_path, external)
                 elif agent_name == "tester":
                     # Тестер получает код и план
                     codegen_result = self.previous_results.get("codegen", {})
                     plan = self.previous_results.get("decomposer", {})
                     result = agent.run(plan, codegen_result)
+                elif agent_name == "performance":
+                    # Нагрузка строится по маршрутам плана для сохранённого кода
+                    plan = self.previous_results.get("decomposer", {})
+                    result = agent.run(plan, self.previous_results.get("codegen", {}))
                 elif agent_name == "docs":
                     # Документатор получает план и код
                     plan = self.previous_results.get("decomposer", {})
@@ -138,6 +177,9 @@ class FeedbackLoop:
 
             # Верификация результата
             verification = self.verifier.verify(agent_name, result, task, self.previous_results)
+            # Быстрый путь для кода: локальные исправления и повторная верификация до нового вызова LLM
+            if agent_name == "codegen" and verification["status"] != "passed":
+                result, verification = self._repair_codegen(result, task, verification)
             confidence = verification["confidence"]
             issues = verification["issues"]
 
@@ -145,9 +187,10 @@ class FeedbackLoop:
             self.previous_results[agent_name] = result
             # Обновляем состояние только если результат прошел верификацию
             if verification["status"] == "passed":
-                state["data"] = result
-                state["verification"] = verification
-                save_json(state, "project/state.json")
+                with self.state_lock:
+                    state["data"] = result
+                    state["verification"] = verification
+                    self.save_state(state)
 
             # Проверка уверенности и проблем
             if verification["status"] == "passed" and confidence >= confidence_threshold:
@@ -157,12 +200,15 @@ class FeedbackLoop:
                 logger.warning(f"Агент {agent_name} не прошёл верификацию: confidence={confidence}, issues={issues}")
                 iterations += 1
                 if iterations < max_iterations:
-                    logger.info(f"Повторная попытка для агента {agent_name} после задержки {retry_delay} сек")
-                    time.sleep(retry_delay)
+                    # Непрошедшая верификация — не временная ошибка, повтор сразу;
+                    # задержка применяется только к сбоям сети в call_openrouter
+                    logger.info(f"Повторная попытка для агента {agent_name}")
                     
                     # Уточнение входных данных на основе проблем
                     if issues and agent_name == "decomposer":
                         input_data = f"{task}. Уточнение: {', '.join(issues)}"
+                    elif issues and patch_mode and isinstance(result, dict) and isinstance(result.get("data"), str):
+                        pending_patch = (result["data"], issues)
                     elif issues and agent_name == "codegen":
                         # Для кодогенератора добавляем информацию о проблемах
                         decomposer_data = self.previous_results.get("decomposer", {})
@@ -176,6 +222,26 @@ class FeedbackLoop:
         # Если не удалось достичь порога уверенности
         return self._handle_failure(agent_name, result, verification)
 
+    def _repair_codegen(self, result: Any, task: str, verification: Dict[str, Any]) -> tuple:
+        """Детерминированное исправление кода и повторная верификация без регенерации."""
+        code = result.get("data") if isinstance(result, dict) else None
+        if not isinstance(code, str):
+            return result, verification
+
+        repaired = repair_code(code)
+        if not repaired.changed:
+            return result, verification
+
+        repaired_result = {**result, "data": repaired.code, "repairs": repaired.fixes}
+        repaired_verification = self.verifier.verify("codegen", repaired_result, task, self.previous_results)
+        if repaired_verification["confidence"] < verification["confidence"]:
+            logger.info("Исправленный код проверен хуже исходного, используется исходный")
+            return result, verification
+
+        save_text(repaired.code, "project/app.py")
+        logger.info(f"Код исправлен локально ({', '.join(repaired.fixes)}): статус {repaired_verification['status']}")
+        return repaired_result, repaired_verification
+
     def _prepare_input_data(self, agent_name: str, input_data: Any) -> Any:
         """Подготовка входных данных для агента с учетом предыдущих результатов."""
         if agent_name == "decomposer":
@@ -222,23 +288,22 @@ class FeedbackLoop:
         # Для других агентов возвращаем входные данные без изменений
         return input_data
 
-    def _get_external_dependencies(self) -> List[str]:
-        """Получение внешних зависимостей из результатов decomposer."""
-        external = []
+    def _get_external_dependencies(self, file_path: str = "project/app.py") -> List[str]:
+        """Внешние зависимости по импортам кода, уточнённые зависимостями плана decomposer."""
+        code = ""
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                code = f.read()
+        else:
+            codegen_result = self.previous_results.get("codegen")
+            if isinstance(codegen_result, dict) and isinstance(codegen_result.get("data"), str):
+                code = codegen_result["data"]
+
+        plan = None
         decomposer_result = self.previous_results.get("decomposer")
-        
-        if decomposer_result:
-            if isinstance(decomposer_result, dict):
-                if "data" in decomposer_result and isinstance(decomposer_result["data"], dict):
-                    modules = decomposer_result["data"].get("modules", [])
-                    if modules and len(modules) > 0:
-                        external = modules[0].get("external", [])
-                        
-        # Добавляем Flask, если он не указан
-        if "Flask" not in external:
-            external.append("Flask")
-            
-        return external
+        if isinstance(decomposer_result, dict) and isinstance(decomposer_result.get("data"), dict):
+            plan = decomposer_result["data"]
+        return self.dependencies.infer([code], plan, local_modules={"app"})
 
     def _handle_failure(self, agent_name: str, result: Any, verification: Dict[str, Any]) -> Dict[str, Any]:
         """Обработка неудачного выполнения агента."""
@@ -255,6 +320,14 @@ class FeedbackLoop:
                 "confidence": 0.5
             }
         
+        if agent_name == "performance":
+            # Пороги нагрузки не исправляются повтором плана: этап просто не пройден
+            return {
+                "error": "Performance thresholds not met",
+                "issues": verification["issues"],
+                "confidence": 0.0
+            }
+
         fallback_agent = self.config["fallback_agent"]
         if agent_name != fallback_agent:
             logger.info(f"Возврат к предыдущему этапу: {fallback_agent}")
@@ -275,56 +348,7 @@ class FeedbackLoop:
 
     def determine_next_agent(self, current_agent: str, result: Any, verification: Dict[str, Any]) -> str:
         """Определение следующего агента с учётом верификации."""
-        expected_flow = {
-            "decomposer": "validator",
-            "validator": "consistency",
-            "consistency": "codegen",
-            "codegen": "extractor",
-            "extractor": "docker",
-            "docker": "tester",
-            "tester": "docs",
-            "docs": None
-        }
-
-        # Проверка наличия информации о переходе в результате ошибки
-        if isinstance(result, dict) and "error" in result and "next_agent" in result:
-            return result["next_agent"]
-
-        # Особая обработка для координатора
-        if current_agent == "coordinator":
-            # Coordinator возвращает имя агента напрямую
-            if isinstance(result, str) and result in expected_flow:
-                return result
-            else:
-                logger.warning(f"Координатор вернул недопустимого агента: {result}, используется decomposer")
-                return "decomposer"
-        
-        # Особая обработка для монитора
-        elif current_agent == "monitor":
-            if isinstance(result, dict) and "command" in result:
-                command = result["command"]
-                if command != "none" and "Перезапустить" in command:
-                    # Извлекаем имя агента из команды
-                    parts = command.split(" ")
-                    if len(parts) > 1 and parts[1] in expected_flow:
-                        return parts[1]
-                elif command == "Принудительный переход к consistency":
-                    return "consistency"
-            # По умолчанию продолжаем нормальный поток
-            return "coordinator"
-
-        # Стандартный поток для других агентов
-        next_agent = expected_flow.get(current_agent, "coordinator")
-        if not next_agent:
-            logger.info("Все агенты завершены")
-            return None
-            
-        # Проверка верификации
-        if verification and verification["status"] == "failed" and verification["confidence"] < 0.5:
-            logger.warning(f"Верификация не прошла для {current_agent}, возврат к decomposer")
-            return "decomposer"
-            
-        return next_agent
+        return self.transitions.decide(current_agent, result, verification)
 
 if __name__ == "__main__":
     # Пример использования
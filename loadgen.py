@@ -0,0 +1,213 @@
+# loadgen.py
+import time
+import asyncio
+import urllib.parse
+from typing import Dict, Any, List, Optional, Tuple
+from utils import logger, percentile
+from deadlines import current_deadline
+
+
+PERFORMANCE_DEFAULTS = {
+    "enabled": True,
+    "concurrency": 16,        # Одновременных соединений keep-alive
+    "duration": 5.0,          # Секунд измерения
+    "warmup": 1.0,            # Секунд прогрева, результаты которого отбрасываются
+    "request_timeout": 5.0,
+    "startup_timeout": 15,
+    "max_targets": 5,         # Маршрутов из плана под нагрузкой
+    # Пороги прохождения этапа (нулевые min_rps и max_p*_ms не проверяются)
+    "min_rps": 50,
+    "max_p95_ms": 250,
+    "max_p99_ms": 1000,
+    "max_error_rate": 0.01,
+}
+
+
+def targets_from_checks(checks: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Цели нагрузки из проверочных запросов (code_analysis.endpoint_checks): метод и путь с запросом."""
+    targets = []
+    for check in checks:
+        query = urllib.parse.urlencode(check.get("query") or {})
+        targets.append({"method": check["method"], "path": check["path"] + (f"?{query}" if query else "")})
+    return targets
+
+
+class _Connection:
+    """Соединение HTTP/1.1 keep-alive; после ошибки, Connection: close или ответа HTTP/1.0 открывается заново."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            f"Accept: */*\r\nConnection: keep-alive\r\n\r\n".encode("latin-1")
+        )
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("соединение закрыто сервером")
+        version, status = status_line.split()[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if "chunked" in headers.get("transfer-encoding", ""):
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif status >= 200 and status not in (204, 304):
+            # Тело до закрытия соединения
+            await self.reader.read()
+            self.close()
+        # HTTP/1.0 закрывает соединение после ответа, если сервер явно не оставил его открытым
+        persistent = headers.get("connection") == "keep-alive" if version == b"HTTP/1.0" \
+            else headers.get("connection") != "close"
+        if not persistent:
+            self.close()
+        return status
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def _worker(index: int, host: str, port: int, targets: List[Dict[str, str]], until: float,
+                  timeout: float, samples: List[Tuple[int, float, int]], deadline) -> None:
+    """Цикл запросов одного соединения: цели по кругу со сдвигом на номер соединения."""
+    connection = _Connection(host, port)
+    sent = index
+    try:
+        while time.monotonic() < until and not (deadline and deadline.cancelled.is_set()):
+            target_index = sent % len(targets)
+            target = targets[target_index]
+            sent += 1
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(connection.request(target["method"], target["path"]), timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                connection.close()
+                status = 0
+            samples.append((target_index, time.perf_counter() - started, status))
+    finally:
+        connection.close()
+
+
+async def _phase(host: str, port: int, targets: List[Dict[str, str]], concurrency: int, seconds: float,
+                 timeout: float, deadline) -> Tuple[List[Tuple[int, float, int]], float]:
+    samples: List[Tuple[int, float, int]] = []
+    started = time.monotonic()
+    until = started + seconds
+    await asyncio.gather(*(
+        _worker(index, host, port, targets, until, timeout, samples, deadline) for index in range(concurrency)
+    ))
+    return samples, time.monotonic() - started
+
+
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latency * 1000 for latency in latencies)
+    return {
+        "p50": round(percentile(ordered, 50), 2),
+        "p95": round(percentile(ordered, 95), 2),
+        "p99": round(percentile(ordered, 99), 2),
+        "max": round(ordered[-1], 2) if ordered else 0.0,
+        "mean": round(sum(ordered) / len(ordered), 2) if ordered else 0.0,
+    }
+
+
+def run_load(port: int, targets: List[Dict[str, str]], settings: Dict[str, Any],
+             host: str = "127.0.0.1") -> Dict[str, Any]:
+    """Нагрузка на запущенный сервис замкнутым циклом: concurrency соединений, duration секунд.
+
+    Каждое соединение отправляет следующий запрос сразу после ответа на
+    предыдущий. Ответы 5xx, таймауты и обрывы соединения считаются ошибками;
+    задержка учитывается для всех запросов. Прогрев не входит в метрики.
+    """
+    if not targets:
+        targets = [{"method": "GET", "path": "/"}]
+    concurrency = max(1, int(settings["concurrency"]))
+    timeout = float(settings["request_timeout"])
+    deadline = current_deadline()
+
+    async def measure():
+        if settings["warmup"]:
+            await _phase(host, port, targets, concurrency, float(settings["warmup"]), timeout, deadline)
+        return await _phase(host, port, targets, concurrency, float(settings["duration"]), timeout, deadline)
+
+    samples, elapsed = asyncio.run(measure())
+    if deadline:
+        deadline.check()
+
+    errors = [sample for sample in samples if sample[2] == 0 or sample[2] >= 500]
+    status_codes: Dict[str, int] = {}
+    for _, _, status in samples:
+        key = str(status) if status else "error"
+        status_codes[key] = status_codes.get(key, 0) + 1
+    per_target = {}
+    for index, target in enumerate(targets):
+        latencies = [latency for target_index, latency, _ in samples if target_index == index]
+        per_target[f"{target['method']} {target['path']}"] = {
+            "requests": len(latencies), "p95_ms": _latency_summary(latencies)["p95"],
+        }
+
+    metrics = {
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 1.0,
+        "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": _latency_summary([latency for _, latency, _ in samples]),
+        "status_codes": status_codes,
+        "targets": per_target,
+        "concurrency": concurrency,
+        "duration": round(elapsed, 3),
+    }
+    logger.info(
+        f"Нагрузка на порт {port}: {metrics['requests']} запросов за {metrics['duration']} сек, "
+        f"{metrics['rps']} RPS, p50/p95/p99 = {metrics['latency_ms']['p50']}/{metrics['latency_ms']['p95']}/"
+        f"{metrics['latency_ms']['p99']} мс, ошибок {metrics['errors']}"
+    )
+    return metrics
+
+
+def evaluate(metrics: Dict[str, Any], settings: Dict[str, Any]) -> List[str]:
+    """Нарушения порогов из секции performance; пустой список — нагрузка выдержана."""
+    violations = []
+    latency = metrics["latency_ms"]
+    if settings["min_rps"] and metrics["rps"] < settings["min_rps"]:
+        violations.append(f"пропускная способность {metrics['rps']} RPS ниже порога {settings['min_rps']}")
+    if settings["max_p95_ms"] and latency["p95"] > settings["max_p95_ms"]:
+        violations.append(f"p95 задержки {latency['p95']} мс выше порога {settings['max_p95_ms']} мс")
+    if settings["max_p99_ms"] and latency["p99"] > settings["max_p99_ms"]:
+        violations.append(f"p99 задержки {latency['p99']} мс выше порога {settings['max_p99_ms']} мс")
+    if metrics["error_rate"] > settings["max_error_rate"]:
+        violations.append(f"доля ошибок {metrics['error_rate']} выше порога {settings['max_error_rate']}")
+    return violations
+
+
+def improved(before: Dict[str, Any], after: Dict[str, Any], min_gain: float) -> bool:
+    """Замер after лучше before: RPS выше или p95 ниже хотя бы на min_gain.
+
+    Вторая метрика при этом не должна ухудшиться больше чем на min_gain, а доля ошибок — вырасти.
+    """
+    if after["error_rate"] > before["error_rate"]:
+        return False
+    rps_gain = after["rps"] / before["rps"] - 1 if before["rps"] else 1.0
+    p95_before, p95_after = before["latency_ms"]["p95"], after["latency_ms"]["p95"]
+    p95_gain = 1 - p95_after / p95_before if p95_before else 0.0
+    return max(rps_gain, p95_gain) >= min_gain and min(rps_gain, p95_gain) > -min_gain
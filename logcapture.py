@@ -0,0 +1,184 @@
+# logcapture.py
+import os
+import time
+import threading
+from typing import Dict, Any, IO, List, Optional, Union
+from utils import read_settings_section
+
+
+LOG_CAPTURE_DEFAULTS = {
+    "head_bytes": 16384,       # Начало вывода, которое сохраняется всегда
+    "tail_bytes": 65536,       # Конец вывода (кольцевой буфер): там обычно ошибка
+    "spill": True,             # Полный вывод сверх буферов пишется в файл
+    "spill_dir": "logs/captures",
+    "max_spill_files": 200,    # Старые файлы полного вывода удаляются
+    "excerpt_chars": 8000,     # Размер выдержки в результатах, промптах и строках лога
+}
+
+_settings: Optional[Dict[str, Any]] = None
+_spill_lock = threading.Lock()
+
+
+def capture_settings() -> Dict[str, Any]:
+    """Секция log_capture из settings.yml (читается один раз на процесс)."""
+    global _settings
+    if _settings is None:
+        _settings = read_settings_section("log_capture", LOG_CAPTURE_DEFAULTS)
+    return _settings
+
+
+def _omitted(skipped: int, path: Optional[str]) -> str:
+    where = f" (полный лог: {path})" if path else ""
+    return f"\n... пропущено {skipped} байт{where} ...\n"
+
+
+class BoundedLog:
+    """Потоковый захват вывода с ограниченной памятью.
+
+    Хранит начало вывода (head_bytes) и кольцевой буфер конца (tail_bytes).
+    Когда вывод перестаёт помещаться в буферы, всё полученное до этого и
+    весь дальнейший поток записываются в файл spill_dir, путь к которому
+    указывается в тексте на месте пропуска.
+    """
+
+    def __init__(self, label: str, settings: Optional[Dict[str, Any]] = None):
+        self.label = label
+        self.settings = settings or capture_settings()
+        self.head_limit = int(self.settings["head_bytes"])
+        self.tail_limit = int(self.settings["tail_bytes"])
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.spill_path: Optional[str] = None
+        self._spill: Optional[IO[bytes]] = None
+        self._lock = threading.Lock()
+
+    def write(self, data: Union[bytes, str]) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        if not data:
+            return
+        with self._lock:
+            if self.total + len(data) > self.head_limit + self.tail_limit and self._spill is None:
+                self._open_spill()
+            self.total += len(data)
+            if self._spill is not None:
+                self._spill.write(data)
+            room = self.head_limit - len(self.head)
+            if room > 0:
+                self.head += data[:room]
+                data = data[room:]
+            self.tail += data
+            # Обрезка с запасом: буфер не сдвигается на каждой записи
+            if len(self.tail) > 2 * self.tail_limit:
+                del self.tail[:len(self.tail) - self.tail_limit]
+
+    def _open_spill(self) -> None:
+        if not self.settings["spill"]:
+            return
+        directory = self.settings["spill_dir"]
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with _spill_lock:
+                _prune(directory, int(self.settings["max_spill_files"]) - 1)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(self):x}-{self.label}.log"
+            self.spill_path = os.path.abspath(os.path.join(directory, name))
+            self._spill = open(self.spill_path, "wb")
+            self._spill.write(bytes(self.head) + bytes(self.tail))
+        except OSError:
+            self._spill = None
+            self.spill_path = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + min(len(self.tail), self.tail_limit)
+
+    def text(self) -> str:
+        """Начало и конец вывода с пометкой о пропуске и ссылкой на полный лог."""
+        with self._lock:
+            head = bytes(self.head)
+            tail = bytes(self.tail[-self.tail_limit:]) if self.tail_limit else b""
+            skipped = self.total - len(head) - len(tail)
+        if skipped <= 0:
+            return (head + tail).decode("utf-8", errors="replace")
+        return (head.decode("utf-8", errors="replace") + _omitted(skipped, self.spill_path)
+                + tail.decode("utf-8", errors="replace"))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+
+
+def _prune(directory: str, keep: int) -> None:
+    """Удаление самых старых файлов полного вывода сверх keep."""
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".log")]
+        paths.sort(key=lambda path: os.path.getmtime(path))
+        for path in paths[:max(0, len(paths) - keep)]:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def pump(stream: IO[bytes], log: BoundedLog) -> threading.Thread:
+    """Поток, читающий pipe в BoundedLog до конца вывода."""
+    def run():
+        try:
+            while True:
+                data = os.read(stream.fileno(), 65536)
+                if not data:
+                    break
+                log.write(data)
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=run, name=f"pump-{log.label}", daemon=True)
+    thread.start()
+    return thread
+
+
+def finish(threads: List[threading.Thread], timeout: float = 5.0) -> None:
+    """Ожидание насосов после завершения процесса.
+
+    Потомок, унаследовавший pipe, может держать его открытым и после выхода
+    процесса; такой насос не ждём дольше timeout — вывод уже в буферах.
+    """
+    until = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0.0, until - time.monotonic()))
+
+
+def read_bounded(path: str, settings: Optional[Dict[str, Any]] = None) -> str:
+    """Начало и конец файла лога без чтения его целиком."""
+    settings = settings or capture_settings()
+    head_limit, tail_limit = int(settings["head_bytes"]), int(settings["tail_bytes"])
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= head_limit + tail_limit:
+                return f.read().decode("utf-8", errors="replace")
+            head = f.read(head_limit)
+            f.seek(size - tail_limit)
+            tail = f.read(tail_limit)
+    except OSError:
+        return ""
+    return (head.decode("utf-8", errors="replace") + _omitted(size - head_limit - tail_limit, path)
+            + tail.decode("utf-8", errors="replace"))
+
+
+def excerpt(text: Any, limit: Optional[int] = None) -> str:
+    """Выдержка для результатов и промптов: четверть из начала, остальное из конца."""
+    text = text if isinstance(text, str) else str(text)
+    limit = int(limit or capture_settings()["excerpt_chars"])
+    if len(text) <= limit:
+        return text
+    head = limit // 4
+    tail = limit - head
+    return f"{text[:head]}\n... пропущено {len(text) - limit} символов ...\n{text[-tail:]}"
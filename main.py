@@ -1,13 +1,19 @@
 # main.py
 import os
+import sys
 import json
 import time
 import shutil
 from feedback_loop import FeedbackLoop
 from execution_env import ExecutionEnvironment
-from utils import logger, save_json, load_json, save_text
-import shutil
-import os
+from scheduler import PipelineScheduler
+from cache import StageCache
+from deadlines import Watchdog, stage_timeout, run_timeout
+from code_repair import repair_code
+from loadgen import evaluate, improved
+from profiling import format_profile
+from logcapture import excerpt
+from utils import logger, log_payload, save_json, save_text, save_yaml, load_yaml, setup_logging, backoff_delay, read_settings_section, RETRY_DEFAULTS
 
 
 def initialize_config_files():
@@ -22,13 +28,13 @@ def initialize_config_files():
             'feedback': {
                 "max_iterations": 3,
                 "confidence_threshold": 0.7,
-                "retry_delay": 2,
                 "fallback_agent": "decomposer",
                 "agent_specific": {
                     "decomposer": {"max_iterations": 5, "confidence_threshold": 0.8},
                     "validator": {"max_iterations": 4, "confidence_threshold": 0.75},
                     "codegen": {"max_iterations": 3, "confidence_threshold": 0.85},
-                    "docker": {"max_iterations": 2, "confidence_threshold": 0.9}
+                    "docker": {"max_iterations": 2, "confidence_threshold": 0.9},
+                    "performance": {"max_iterations": 1, "confidence_threshold": 0.7}
                 }
             },
             'verification_rules': {
@@ -101,6 +107,13 @@ def initialize_config_files():
                     "error_patterns": ["missing usage", "no documentation"],
                     "success_criteria": "README.md contains interfaces and usage instructions",
                     "priority": 11
+                },
+                "performance": {
+                    "required_fields": ["status"],
+                    "valid_statuses": ["passed", "failed", "skipped"],
+                    "error_patterns": [],
+                    "success_criteria": "load test meets RPS, latency and error rate thresholds",
+                    "priority": 12
                 }
             }
         }
@@ -161,16 +174,18 @@ def handle_docker_setup(state, feedback_loop, execution_env, max_retries=3):
             logger.error("Отсутствуют результаты codegen и файл app.py")
             return False
     
-    # Получаем зависимости из плана декомпозиции
-    external_deps = []
+    # Зависимости — по импортам app.py; план уточняет их версии и extras
+    plan = None
     decomposer_result = state["previous_results"].get("decomposer")
     if decomposer_result and isinstance(decomposer_result, dict) and "data" in decomposer_result:
-        modules = decomposer_result["data"].get("modules", [])
-        if modules and isinstance(modules, list) and len(modules) > 0:
-            external_deps = modules[0].get("external", [])
+        plan = decomposer_result["data"]
+    with open("project/app.py", "r", encoding="utf-8") as f:
+        external_deps = execution_env.dependencies.infer([f.read()], plan, local_modules={"app"})
+    logger.info(f"Зависимости приложения: {', '.join(external_deps) or 'нет'}")
     
     # Запускаем Docker с проверкой ошибок
     for attempt in range(max_retries):
+        transient = False
         result = feedback_loop.run_agent_with_feedback(
             "docker",
             {"file_path": "project/app.py", "external": external_deps},
@@ -222,13 +237,18 @@ def handle_docker_setup(state, feedback_loop, execution_env, max_retries=3):
                 docker_verification = execution_env.execute_docker(
                     dockerfile,
                     compose,
-                    external_deps
+                    external_deps,
+                    plan
                 )
                 
                 if docker_verification["status"] == "success":
-                    state["data"] = result
-                    state["previous_results"]["docker"] = result
+                    with feedback_loop.state_lock:
+                        state["data"] = result
+                        state["previous_results"]["docker"] = result
                     return True
+
+                # Ожидание перед повтором имеет смысл только при сбое демона Docker
+                transient = docker_verification.get("transient", False)
                     
             except json.JSONDecodeError:
                 logger.error(f"Не удалось распарсить JSON из ответа LLM: {llm_response}")
@@ -236,12 +256,104 @@ def handle_docker_setup(state, feedback_loop, execution_env, max_retries=3):
                 logger.error(f"Ошибка при обработке результата Docker: {str(e)}")
         
         logger.warning(f"Попытка настройки Docker {attempt+1}/{max_retries} не удалась")
-        time.sleep(2)
+        if transient and attempt + 1 < max_retries:
+            delay = backoff_delay(attempt, read_settings_section("retry", RETRY_DEFAULTS))
+            logger.info(f"Временная ошибка Docker, повтор через {delay:.1f} сек")
+            time.sleep(delay)
     
     logger.error("Все попытки настройки Docker не удались")
     return False
 
 
+def optimize_performance(state, feedback_loop, execution_env):
+    """Оптимизация кода по профилю после провала порогов нагрузки.
+
+    Приложение профилируется под синтетической нагрузкой, отчёт передаётся
+    генератору кода в режиме оптимизации. Вариант принимается, только если
+    проходит тесты и повторный замер лучше текущего; после принятых
+    изменений нагрузочная проверка выполняется заново. Возвращает её
+    результат или None, если код не изменился.
+    """
+    settings = execution_env.profiling
+    report = (feedback_loop.previous_results.get("performance") or {}).get("data")
+    if not settings["enabled"] or not isinstance(report, dict) or not report.get("metrics"):
+        return None
+    if not os.path.exists("project/app.py"):
+        return None
+
+    with open("project/app.py", "r") as f:
+        code = f.read()
+    tests = None
+    if os.path.exists("project/test_app.py"):
+        with open("project/test_app.py", "r") as f:
+            tests = f.read()
+    plan = state["previous_results"].get("decomposer", {})
+    plan = plan.get("data", plan) if isinstance(plan, dict) else plan
+    thresholds = feedback_loop.agents["performance"].settings
+    metrics, violations, targets = report["metrics"], report["violations"], report["targets"]
+    dependencies = execution_env.dependencies.infer([code], plan, local_modules={"app"})
+    adopted = 0
+
+    for round_number in range(1, int(settings["max_rounds"]) + 1):
+        profiled = execution_env.profile_app(code, targets)
+        if profiled["status"] != "success" or not profiled.get("profile"):
+            logger.warning(f"Профилирование не удалось: {profiled.get('error', 'нет отчёта')}")
+            break
+        profile_report = format_profile(profiled["profile"], metrics, violations)
+        log_payload("Профиль под нагрузкой", "profiling", profile_report)
+
+        candidate = feedback_loop.agents["codegen"].run_optimize(plan, code, profile_report)
+        if not isinstance(candidate.get("data"), str):
+            continue
+        # Образ Docker и его требования уже собраны под текущий код: новые зависимости он не получит
+        if execution_env.dependencies.infer([candidate["data"]], plan, local_modules={"app"}) != dependencies:
+            logger.warning("Оптимизированный код отклонён: меняет внешние зависимости приложения")
+            continue
+        check = execution_env.execute_python_code(candidate["data"], tests)
+        if check["status"] != "success":
+            logger.warning(f"Оптимизированный код отклонён: не прошёл проверку ({check.get('error')})")
+            continue
+        measured = execution_env.run_load(candidate["data"], targets)
+        if measured["status"] != "success":
+            logger.warning(f"Оптимизированный код отклонён: замер не удался ({measured.get('error')})")
+            continue
+        if not improved(metrics, measured["metrics"], settings["min_gain"]):
+            logger.info(
+                f"Оптимизированный код отклонён: {measured['metrics']['rps']} RPS, p95 {measured['metrics']['latency_ms']['p95']} мс "
+                f"против {metrics['rps']} RPS, p95 {metrics['latency_ms']['p95']} мс"
+            )
+            continue
+
+        logger.info(
+            f"Раунд оптимизации {round_number}: {metrics['rps']} -> {measured['metrics']['rps']} RPS, "
+            f"p95 {metrics['latency_ms']['p95']} -> {measured['metrics']['latency_ms']['p95']} мс, код принят"
+        )
+        code, metrics = candidate["data"], measured["metrics"]
+        violations = evaluate(metrics, thresholds)
+        adopted += 1
+        adopt_optimized_code(code, state, feedback_loop)
+        if not violations:
+            break
+
+    if not adopted:
+        return None
+    result = feedback_loop.run_agent_with_feedback("performance", code, state["task"], state)
+    if isinstance(result, dict):
+        # Отметка для кэша этапов: при повторе из кэша принятый код восстанавливается вместе с отчётом
+        result["optimized"] = True
+    return result
+
+
+def adopt_optimized_code(code, state, feedback_loop):
+    """Принятый оптимизированный код становится кодом проекта и результатом codegen."""
+    save_text(code, "project/app.py")
+    with feedback_loop.state_lock:
+        codegen_result = {**(state["previous_results"].get("codegen") or {}), "data": code, "optimized": True}
+        state["previous_results"]["codegen"] = codegen_result
+        feedback_loop.previous_results["codegen"] = codegen_result
+        feedback_loop.save_state(state)
+
+
 def clear_dir(project_dir):
     # Очистка директории проекта перед началом работы
 
@@ -257,12 +369,197 @@ def clear_dir(project_dir):
     logger.info(f"Создана новая директория {project_dir}")
 
 
-def main():
+def prepare_stage_input(stage, state):
+    """Подготовка входных данных этапа из результатов вышестоящих этапов."""
+    previous_results = state["previous_results"]
+
+    if stage == "decomposer":
+        return state["task"]
+    if stage in ("validator", "consistency", "codegen"):
+        if "decomposer" not in previous_results:
+            logger.error(f"Отсутствуют результаты decomposer для {stage}")
+            return None
+        return previous_results["decomposer"]
+    if stage == "extractor":
+        if "codegen" not in previous_results:
+            logger.error("Отсутствуют результаты codegen для extractor")
+            return None
+        return previous_results["codegen"]
+    if stage == "tester":
+        # Для тестера нужен код приложения
+        if os.path.exists("project/app.py"):
+            with open("project/app.py", "r") as f:
+                return f.read()
+        logger.error("Отсутствует файл app.py для tester")
+        # Восстанавливаем из предыдущих результатов
+        code_result = previous_results.get("codegen")
+        if code_result and save_code_safely(code_result, "project/app.py"):
+            return code_result
+        return None
+    if stage == "performance":
+        # Нагрузочной проверке нужен код приложения; план берётся агентом из результатов decomposer
+        if os.path.exists("project/app.py"):
+            with open("project/app.py", "r") as f:
+                return f.read()
+        logger.error("Отсутствует файл app.py для performance")
+        return None
+    if stage == "docs":
+        # Для документации нужен весь план и код
+        return {
+            "plan": previous_results.get("decomposer", {}),
+            "code": open("project/app.py", "r").read() if os.path.exists("project/app.py") else "# Код не доступен"
+        }
+    # Для остальных агентов используем последние данные
+    return state["data"] if state["data"] else state["task"]
 
-    clear_dir("project")
 
-    # Задаем задачу
-    task = "Создать API-сервер, роут /sum, на вход два гет параметра a и b, цифры, возвращает сумму a и b. Использовать aiohttp"
+def process_stage_result(stage, result, state, execution_env):
+    """Проверка результата этапа выполнением. Возвращает False, если этап нужно повторить."""
+    if stage == "codegen":
+        # Сохраняем код в файл
+        if not save_code_safely(result, "project/app.py"):
+            logger.error("Не удалось сохранить код в project/app.py")
+            return False
+        # Проверяем код выполнением
+        code = result if isinstance(result, str) else result.get("data", "")
+        execution_result = execution_env.execute_python_code(code)
+        if execution_result["status"] != "success" and isinstance(result, dict):
+            # Недостающие импорты и отступы исправляются локально, без регенерации через LLM
+            repaired = repair_code(code)
+            if repaired.changed:
+                execution_result = execution_env.execute_python_code(repaired.code)
+                if execution_result["status"] == "success":
+                    result["data"] = repaired.code
+                    result["repairs"] = repaired.fixes
+                    save_text(repaired.code, "project/app.py")
+                    logger.info(f"Код исправлен локально после выполнения: {', '.join(repaired.fixes)}")
+        if execution_result["status"] != "success":
+            logger.warning(f"Код не прошёл проверку выполнения: {excerpt(execution_result['logs'])}")
+            return False
+    elif stage == "extractor":
+        # Проверка корректности экстракции
+        file_path = result.get("file_path") if isinstance(result, dict) else None
+        if file_path and not os.path.exists(file_path):
+            # Если файл не существует, пытаемся создать его
+            code_data = state["previous_results"].get("codegen")
+            if code_data and save_code_safely(code_data, file_path):
+                logger.info(f"Создан файл {file_path} из результатов codegen")
+            else:
+                logger.error(f"Не удалось создать файл {file_path}")
+                return False
+    elif stage == "tester":
+        # Запуск тестов
+        if os.path.exists("project/app.py"):
+            with open("project/app.py", "r") as f:
+                code = f.read()
+        else:
+            code = state["previous_results"].get("codegen", {}).get("data", "")
+
+        if code and isinstance(result, dict) and "tests" in result:
+            execution_result = execution_env.execute_python_code(code, result["tests"])
+            if execution_result["status"] != "success":
+                logger.warning(f"Тесты не пройдены: {excerpt(execution_result['logs'])}")
+                return False
+    return True
+
+
+def run_stage(stage, state, feedback_loop, execution_env, pipeline_settings, stage_cache=None):
+    """Выполнение этапа с пропуском, если его входы не изменились с прошлого запуска."""
+    stage_spec = (pipeline_settings.get("stages") or {}).get(stage, {})
+    key = None
+    if stage_cache and stage_cache.enabled:
+        upstream = {dep: state["previous_results"].get(dep) for dep in stage_cache.ancestors(stage)}
+        agent = feedback_loop.agents.get(stage)
+        key = stage_cache.key(stage, state["task"], upstream, getattr(agent, "prompt_version", "1"))
+        entry = stage_cache.load(stage, key)
+        if entry:
+            for path, content in entry["files"].items():
+                save_text(content, path)
+            with feedback_loop.state_lock:
+                state["data"] = entry["result"]
+                state["previous_results"][stage] = entry["result"]
+                feedback_loop.previous_results[stage] = entry["result"]
+                feedback_loop.save_state(state)
+            if isinstance(entry["result"], dict) and entry["result"].get("optimized") and "project/app.py" in entry["files"]:
+                # Кэш codegen восстановил исходный код; оптимизированный — из артефактов этапа performance
+                adopt_optimized_code(entry["files"]["project/app.py"], state, feedback_loop)
+            logger.info(f"Этап {stage} пропущен: входы не изменились (ключ {key[:12]})")
+            return True
+
+    ok = execute_stage(stage, state, feedback_loop, execution_env, pipeline_settings)
+    if ok and key:
+        stage_cache.save(stage, key, state["previous_results"].get(stage), stage_spec.get("artifacts", []))
+    return ok
+
+
+def execute_stage(stage, state, feedback_loop, execution_env, pipeline_settings):
+    """Выполнение одного этапа конвейера. Возвращает True при успехе."""
+    if stage == "docker":
+        # Специальная обработка Docker
+        return handle_docker_setup(state, feedback_loop, execution_env)
+
+    if stage == "docs":
+        # Отслеживаем количество попыток docs
+        with feedback_loop.state_lock:
+            state["docs_retry_count"] = state.get("docs_retry_count", 0) + 1
+            docs_retry_count = state["docs_retry_count"]
+        # Если это 3-я или более попытка, принудительно считаем docs успешным
+        if docs_retry_count >= 3:
+            logger.warning("Принудительное завершение документации после многократных попыток")
+            result = {"success": True, "message": "Документация принята принудительно"}
+            with feedback_loop.state_lock:
+                state["data"] = result
+                state["previous_results"]["docs"] = result
+                feedback_loop.save_state(state)
+            return True
+
+    agent_input = prepare_stage_input(stage, state)
+    if agent_input is None:
+        return False
+
+    # Запуск агента с подготовленными входными данными
+    result = feedback_loop.run_agent_with_feedback(stage, agent_input, state["task"], state)
+
+    if stage == "performance" and not is_valid_result(result):
+        # Пороги нагрузки не выдержаны: оптимизация кода по профилю с повторным замером
+        result = optimize_performance(state, feedback_loop, execution_env) or result
+
+    if not is_valid_result(result):
+        logger.error(f"Агент {stage} вернул невалидный результат")
+        return False
+
+    if not process_stage_result(stage, result, state, execution_env):
+        return False
+
+    # Проверяющий этап (gate) пропускает конвейер дальше только при одобрении плана
+    stage_spec = (pipeline_settings.get("stages") or {}).get(stage, {})
+    if pipeline_settings.get("enforce_gates", False) and stage_spec.get("gate"):
+        data = result.get("data") if isinstance(result, dict) else None
+        if isinstance(data, dict) and data.get("status") == "rejected":
+            logger.warning(f"Этап {stage} отклонил план: {data}")
+            return False
+
+    # Обновление состояния
+    with feedback_loop.state_lock:
+        state["data"] = result
+        state["previous_results"][stage] = result
+        state["step"] += 1
+        feedback_loop.save_state(state)
+    return True
+
+
+DEFAULT_TASK = "Создать API-сервер, роут /sum, на вход два гет параметра a и b, цифры, возвращает сумму a и b. Использовать aiohttp"
+
+
+def run_pipeline(task):
+    """Полный прогон конвейера для одной задачи в текущей директории.
+
+    Возвращает сводку: статусы этапов, число шагов и длительность.
+    """
+    started = time.monotonic()
+    clear_dir("project")
+    # Файл лога переоткрывается в только что пересозданной директории project
+    setup_logging()
     
     # Инициализация конфигурационных файлов
     initialize_config_files()
@@ -277,242 +574,93 @@ def main():
         "verification": None,
         "previous_results": {},
         "max_steps": 50,  # Предотвращение бесконечных циклов
-        "docker_retry_count": 0  # Счетчик попыток для docker
+        "stages": {},
+        "timeouts": [],
+        "stage_started": {},
+        "consecutive_runs": {}
     }
     save_json(state, "project/state.json")
     
     # Инициализация компонентов
     feedback_loop = FeedbackLoop()
     execution_env = ExecutionEnvironment()
+    settings = load_yaml("settings.yml") or {}
+    pipeline_settings = settings.get("pipeline", {}) or {}
+    stage_cache = StageCache(settings)
+
+    def codegen_sandbox_check(code):
+        # Уровень sandbox верификации: LLM-проверка плана запускается только для исполнимого кода
+        if not isinstance(code, str):
+            return []
+        execution = execution_env.execute_python_code(code)
+        if execution["status"] == "success":
+            return []
+        return [f"Код не прошёл выполнение в песочнице: {execution.get('error', 'unknown')}"]
+
+    feedback_loop.verifier.register_sandbox_check("codegen", codegen_sandbox_check)
+    feedback_loop.agents["performance"].register_runner(execution_env.run_load)
+
+    def on_update(statuses):
+        with feedback_loop.state_lock:
+            state["stages"] = statuses
+            running = [name for name, status in statuses.items() if status == "running"]
+            state["current_agent"] = running[0] if running else None
+            feedback_loop.save_state(state)
+
+    def on_timeout(event):
+        with feedback_loop.state_lock:
+            state["timeouts"].append(event)
+            feedback_loop.save_state(state)
+
+    # Сторож отменяет этап (и весь запуск) по истечении сроков из секции deadlines
+    watchdog = Watchdog(on_event=on_timeout).start()
+
+    def stage_runner(stage):
+        # Время запуска и число попыток подряд — входы правил монитора (transitions)
+        with feedback_loop.state_lock:
+            state["stage_started"][stage] = time.time()
+            state["consecutive_runs"][stage] = scheduler.attempts[stage]
+            state["validator_consecutive_runs"] = state["consecutive_runs"].get("validator", 0)
+        with watchdog.scope(stage, stage_timeout(settings, stage), parent=run_deadline):
+            return run_stage(stage, state, feedback_loop, execution_env, pipeline_settings, stage_cache)
+
+    # Этапы выполняются по графу зависимостей из settings.yml
+    scheduler = PipelineScheduler.from_settings(
+        pipeline_settings,
+        stage_runner,
+        max_steps=state["max_steps"],
+        on_update=on_update
+    )
+    try:
+        with watchdog.scope("run", run_timeout(settings), kind="run") as run_deadline:
+            run_deadline.on_cancel(scheduler.cancel, "планировщик этапов")
+            scheduler.run()
+    finally:
+        watchdog.stop()
+        execution_env.close()
+
+    success = scheduler.succeeded()
+    if success:
+        logger.info("Все этапы завершены успешно!")
+    else:
+        logger.warning(f"Конвейер завершён с ошибками: {scheduler.status}")
+
+    return {
+        "task": task,
+        "success": success,
+        "stages": dict(scheduler.status),
+        "steps": scheduler.steps,
+        "timeouts": watchdog.events,
+        "resources": execution_env.usage.summary(),
+        "wheelhouse": execution_env.wheelhouse.report(),
+        "duration": time.monotonic() - started
+    }
 
-    # Ожидаемая последовательность агентов
-    expected_flow = [
-        "decomposer", "validator", "consistency", "codegen", 
-        "extractor", "docker", "tester", "docs"
-    ]
-    
-    # Основной цикл выполнения
-    while state["step"] < state["max_steps"]:
-        state = load_json("project/state.json")
-        current_agent = state["current_agent"]
-        logger.info(f"Текущий шаг: {state['step']}, текущий агент: {current_agent}")
-
-        if not current_agent:
-            logger.info("Все этапы завершены успешно!")
-            break
-            
-        # Проверка на превышение лимита попыток для docker
-        if current_agent == "docker" and state.get("docker_retry_count", 0) > 5:
-            logger.warning("Превышен лимит попыток для Docker, переход к следующему этапу")
-            state["current_agent"] = "tester"
-            save_json(state, "project/state.json")
-            continue
-
-        # Сначала определяем входные данные для текущего агента
-        agent_input = None
-
-        if current_agent == "decomposer":
-            agent_input = state["task"]
-        elif current_agent == "validator":
-            if "decomposer" in state["previous_results"]:
-                agent_input = state["previous_results"]["decomposer"]
-            else:
-                logger.error("Отсутствуют результаты decomposer для validator")
-                state["current_agent"] = "decomposer"
-                save_json(state, "project/state.json")
-                continue
-        elif current_agent == "consistency":
-            if "decomposer" in state["previous_results"]:
-                agent_input = state["previous_results"]["decomposer"]
-            else:
-                logger.error("Отсутствуют результаты decomposer для consistency")
-                state["current_agent"] = "decomposer"
-                save_json(state, "project/state.json")
-                continue
-        elif current_agent == "codegen":
-            if "consistency" in state["previous_results"]:
-                # Используем результаты decomposer и consistency для генерации кода
-                agent_input = state["previous_results"]["decomposer"]
-            else:
-                logger.error("Отсутствуют результаты consistency для codegen")
-                state["current_agent"] = "consistency"
-                save_json(state, "project/state.json")
-                continue
-        elif current_agent == "extractor":
-            if "codegen" in state["previous_results"]:
-                agent_input = state["previous_results"]["codegen"]
-            else:
-                logger.error("Отсутствуют результаты codegen для extractor")
-                state["current_agent"] = "codegen"
-                save_json(state, "project/state.json")
-                continue
-        elif current_agent == "docker":
-            # Специальная обработка Docker
-            success = handle_docker_setup(state, feedback_loop, execution_env)
-            if success:
-                state["current_agent"] = "tester"
-            else:
-                state["docker_retry_count"] = state.get("docker_retry_count", 0) + 1
-                if state["docker_retry_count"] > 5:
-                    state["current_agent"] = "tester"
-                    logger.warning("Пропуск Docker после множественных попыток")
-            save_json(state, "project/state.json")
-            continue
-        elif current_agent == "tester":
-            # Для тестера нужен код приложения
-            if os.path.exists("project/app.py"):
-                with open("project/app.py", "r") as f:
-                    app_code = f.read()
-                agent_input = app_code
-            else:
-                logger.error("Отсутствует файл app.py для tester")
-                # Восстанавливаем из предыдущих результатов
-                if "codegen" in state["previous_results"]:
-                    code_result = state["previous_results"]["codegen"]
-                    if save_code_safely(code_result, "project/app.py"):
-                        agent_input = code_result
-                    else:
-                        # Если не удалось восстановить, возвращаемся к codegen
-                        state["current_agent"] = "codegen"
-                        save_json(state, "project/state.json")
-                        continue
-                else:
-                    state["current_agent"] = "codegen"
-                    save_json(state, "project/state.json")
-                    continue
-        elif current_agent == "docs":
-            # Для документации нужен весь план и код
-            doc_input = {
-                "plan": state["previous_results"].get("decomposer", {}),
-                "code": open("project/app.py", "r").read() if os.path.exists("project/app.py") else "# Код не доступен"
-            }
-            agent_input = doc_input
-            
-            # Отслеживаем количество попыток docs
-            if "docs_retry_count" not in state:
-                state["docs_retry_count"] = 0
-            state["docs_retry_count"] += 1
-            
-            # Если это 3-я или более попытка, принудительно считаем docs успешным
-            if state["docs_retry_count"] >= 3:
-                logger.warning("Принудительное завершение процесса после многократных попыток документации")
-                # Мы можем либо считать docs успешным...
-                result = {"success": True, "message": "Документация принудительно принята"}
-                state["data"] = result
-                state["previous_results"]["docs"] = result
-                state["current_agent"] = None  # Завершение процесса
-                save_json(state, "project/state.json")
-                continue
-
-
-
-        else:
-            # Для остальных агентов используем последние данные
-            agent_input = state["data"] if state["data"] else state["task"]
-
-        # Выполнение агента
-        try:
-            # Запуск агента с подготовленными входными данными
-            result = feedback_loop.run_agent_with_feedback(
-                current_agent,
-                agent_input,
-                state["task"],
-                state
-            )
-            
-            # Проверка результата
-            if not is_valid_result(result):
-                logger.error(f"Агент {current_agent} вернул невалидный результат")
-                # Повторяем этот шаг или возвращаемся на предыдущий
-                if current_agent == expected_flow[0]:
-                    # Для decomposer просто повторяем
-                    continue
-                else:
-                    # Для других возвращаемся на шаг назад
-                    idx = expected_flow.index(current_agent)
-                    state["current_agent"] = expected_flow[idx-1]
-                    save_json(state, "project/state.json")
-                    continue
-            
-            # Обработка результата в зависимости от текущего агента
-            if current_agent == "codegen":
-                # Сохраняем код в файл
-                if not save_code_safely(result, "project/app.py"):
-                    logger.error("Не удалось сохранить код в project/app.py")
-                    # Повторяем генерацию кода
-                    continue
-                else:
-                    # Проверяем код выполнением
-                    execution_result = execution_env.execute_python_code(result if isinstance(result, str) else result.get("data", ""))
-                    if execution_result["status"] != "success":
-                        logger.warning(f"Код не прошёл проверку выполнения: {execution_result['logs']}")
-                        state["data"] = {"error": "Code execution failed", "logs": execution_result['logs']}
-                        continue
-            elif current_agent == "extractor":
-                # Проверка корректности экстракции
-                file_path = result.get("file_path") if isinstance(result, dict) else None
-                if file_path and not os.path.exists(file_path):
-                    # Если файл не существует, пытаемся создать его
-                    code_data = state["previous_results"].get("codegen")
-                    if code_data and save_code_safely(code_data, file_path):
-                        logger.info(f"Создан файл {file_path} из результатов codegen")
-                    else:
-                        logger.error(f"Не удалось создать файл {file_path}")
-                        continue
-            elif current_agent == "tester":
-                # Запуск тестов
-                code = None
-                if os.path.exists("project/app.py"):
-                    with open("project/app.py", "r") as f:
-                        code = f.read()
-                else:
-                    code = state["previous_results"].get("codegen", {}).get("data", "")
-                
-                if code and isinstance(result, dict) and "tests" in result:
-                    execution_result = execution_env.execute_python_code(code, result["tests"])
-                    if execution_result["status"] != "success":
-                        logger.warning(f"Тесты не пройдены: {execution_result['logs']}")
-                        state["data"] = {"error": "Tests failed", "logs": execution_result['logs']}
-                        continue
-
-            # Обновление состояния
-            state["data"] = result
-            state["previous_results"][current_agent] = result
-            state["step"] += 1
-
-            # Определение следующего агента
-            verification = state.get("verification", {"status": "passed", "confidence": 1.0, "issues": []})
-            
-            # Если текущий агент в ожидаемом потоке, берем следующий из списка
-            if current_agent in expected_flow:
-                idx = expected_flow.index(current_agent)
-                if idx < len(expected_flow) - 1:
-                    next_agent = expected_flow[idx + 1]
-                else:
-                    next_agent = None  # Завершение процесса
-            else:
-                # В противном случае используем FeedbackLoop для определения
-                next_agent = feedback_loop.determine_next_agent(current_agent, result, verification)
-            
-            state["current_agent"] = next_agent
-            save_json(state, "project/state.json")
-
-        except Exception as e:
-            logger.error(f"Исключение при выполнении агента {current_agent}: {str(e)}")
-            # Возвращаемся к предыдущему шагу в случае исключения
-            if current_agent in expected_flow:
-                idx = expected_flow.index(current_agent)
-                if idx > 0:
-                    state["current_agent"] = expected_flow[idx - 1]
-                save_json(state, "project/state.json")
-            time.sleep(1)
-            continue
 
-        # Задержка между шагами
-        time.sleep(1)
-    
-    if state["step"] >= state["max_steps"]:
-        logger.warning(f"Превышено максимальное количество шагов ({state['max_steps']}), выполнение остановлено")
+def main():
+    # Задача передаётся первым аргументом командной строки или берётся по умолчанию
+    task = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TASK
+    run_pipeline(task)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,164 @@
+# probes.py
+import os
+import json
+import time
+import socket
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, Any, Callable, List, Optional, Set, Tuple
+from utils import logger
+from deadlines import current_deadline
+
+
+PROBE_DEFAULTS = {
+    "startup_timeout": 30,   # Ожидание готовности порта
+    "request_timeout": 5,    # Таймаут одного проверочного запроса
+    "max_interval": 1.0,     # Потолок интервала опроса
+}
+
+
+def poll(check: Callable[[], bool], timeout: float, alive: Optional[Callable[[], bool]] = None,
+         initial: float = 0.05, max_interval: float = 1.0) -> bool:
+    """Опрос check с экспоненциально растущим интервалом до успеха или timeout.
+
+    Быстрый старт замечается за миллисекунды, а медленный не нагружает цикл.
+    False сразу, если alive сообщает, что проверяемый процесс завершился.
+    Ожидание прерывается отменой текущего этапа.
+    """
+    deadline = current_deadline()
+    until = time.monotonic() + timeout
+    interval = initial
+    while True:
+        if deadline:
+            deadline.check()
+        if alive is not None and not alive():
+            return False
+        if check():
+            return True
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            return False
+        delay = min(interval, remaining)
+        if deadline:
+            deadline.cancelled.wait(delay)
+        else:
+            time.sleep(delay)
+        interval = min(interval * 2, max_interval)
+
+
+def port_open(host: str, port: int) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+def _listening_inodes(port: int) -> Set[str]:
+    """Inode сокетов, слушающих port (состояние LISTEN в /proc/net/tcp и tcp6)."""
+    inodes = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table, encoding="ascii") as f:
+                next(f, None)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 9 and fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    return inodes
+
+
+def group_listens(pgid: int, port: int) -> Optional[bool]:
+    """Слушает ли port процесс из группы pgid.
+
+    None, если /proc недоступен и принадлежность проверить нельзя.
+    """
+    if not os.path.isdir("/proc/net"):
+        return None
+    inodes = _listening_inodes(port)
+    if not inodes:
+        return False
+    sockets = {f"socket:[{inode}]" for inode in inodes}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", encoding="ascii", errors="replace") as f:
+                # Имя процесса в скобках может содержать пробелы: поля считаются после него
+                if int(f.read().rsplit(")", 1)[1].split()[2]) != pgid:
+                    continue
+            fd_dir = f"/proc/{pid}/fd"
+            for fd in os.listdir(fd_dir):
+                if os.readlink(os.path.join(fd_dir, fd)) in sockets:
+                    return True
+        except (OSError, ValueError, IndexError):
+            continue
+    return False
+
+
+def wait_for_port(port: int, timeout: float, host: str = "127.0.0.1",
+                  alive: Optional[Callable[[], bool]] = None, max_interval: float = 1.0) -> bool:
+    """Ожидание, пока на порту начнут принимать соединения."""
+    return poll(lambda: port_open(host, port), timeout, alive=alive, max_interval=max_interval)
+
+
+def http_request(url: str, method: str = "GET", timeout: float = 5) -> Tuple[int, str]:
+    """HTTP-запрос без исключений на коды ошибок: (статус, тело)."""
+    request = urllib.request.Request(url, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read().decode("utf-8", errors="replace")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8", errors="replace")
+
+
+def wait_for_http(url: str, timeout: float, alive: Optional[Callable[[], bool]] = None,
+                  max_interval: float = 1.0) -> bool:
+    """Ожидание первого HTTP-ответа (любого статуса): порт может открыться раньше, чем приложение."""
+    def answered() -> bool:
+        try:
+            http_request(url, timeout=1)
+            return True
+        except (OSError, ValueError):
+            return False
+    return poll(answered, timeout, alive=alive, max_interval=max_interval)
+
+
+def run_checks(base_url: str, checks: List[Dict[str, Any]], timeout: float = 5) -> Tuple[List[str], List[str]]:
+    """Запросы к эндпоинтам с проверкой ответа. Возвращает (проблемы, строки лога).
+
+    Проверка: {"method", "path", "query", "expect_ok", "expect_keys"}. Ответ
+    5xx — всегда ошибка; при expect_ok нужен 2xx, а при expect_keys — JSON с
+    этими ключами.
+    """
+    issues, lines = [], []
+    for check in checks:
+        query = urllib.parse.urlencode(check.get("query") or {})
+        url = f"{base_url}{check['path']}" + (f"?{query}" if query else "")
+        label = f"{check['method']} {check['path']}" + (f"?{query}" if query else "")
+        try:
+            status, body = http_request(url, check["method"], timeout)
+        except (OSError, ValueError) as e:
+            issues.append(f"{label}: нет ответа ({str(e)})")
+            lines.append(f"{label} -> ошибка соединения")
+            continue
+        lines.append(f"{label} -> {status} {body[:200]}")
+        if status >= 500:
+            issues.append(f"{label}: ошибка сервера {status}: {body[:300]}")
+        elif check.get("expect_ok") and not 200 <= status < 300:
+            issues.append(f"{label}: ожидался успешный ответ, получен {status}: {body[:300]}")
+        elif check.get("expect_keys") and 200 <= status < 300:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                issues.append(f"{label}: ответ не JSON: {body[:300]}")
+                continue
+            missing = [key for key in check["expect_keys"] if not isinstance(payload, dict) or key not in payload]
+            if missing:
+                issues.append(f"{label}: в ответе нет полей {', '.join(missing)}")
+    if checks:
+        logger.info(f"Проверено эндпоинтов: {len(checks)}, проблем: {len(issues)}")
+    return issues, lines
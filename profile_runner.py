@@ -0,0 +1,172 @@
+# profile_runner.py
+"""Запуск приложения под cProfile и tracemalloc.
+
+Запускается интерпретатором песочницы: python profile_runner.py <отчёт.json> <app.py>.
+Приложение выполняется как __main__; SIGUSR1 отмечает начало нагрузки
+(профиль и снимок памяти до него отбрасываются, чтобы импорт и запуск не
+заслоняли обработку запросов), SIGTERM отмечает конец нагрузки и завершает
+приложение, после чего в отчёт записываются горячие функции и места выделения памяти.
+
+Потоки, созданные после отметки (обработчики запросов многопоточных серверов),
+профилируются отдельно и объединяются с основным потоком.
+
+Модуль работает в чужом окружении, поэтому использует только stdlib.
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import pstats
+import signal
+import cProfile
+import threading
+import tracemalloc
+
+if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+    sys.path.pop(0)
+
+TOP = int(os.environ.get("PROFILE_TOP", "10"))
+FRAMES = int(os.environ.get("PROFILE_FRAMES", "1"))
+
+# Ожидание ввода-вывода в цикле событий и пуле потоков — не работа приложения
+_IDLE = ("poll", "select", "epoll", "kqueue", "sleep", "accept", "acquire", "wait", "recv_into", "readinto")
+
+
+class _State:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.threads = []
+        self.first_thread = 0
+        self.baseline = None
+        self.marked = None
+        self.ended = None
+
+
+state = _State()
+
+
+def _thread_profiler(frame, event, arg):
+    # Вызывается первым событием нового потока: дальше поток профилирует свой cProfile
+    sys.setprofile(None)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        return
+    state.threads.append(profile)
+
+
+def _mark(signum, frame):
+    """Начало нагрузки: профиль и память считаются с этого момента."""
+    state.profile.disable()
+    state.profile = cProfile.Profile()
+    state.first_thread = len(state.threads)
+    state.baseline = tracemalloc.take_snapshot()
+    state.marked = time.time()
+    state.profile.enable()
+
+
+def _terminate(signum, frame):
+    # Конец нагрузки: время разбора профиля и записи отчёта в profiled_seconds не входит
+    state.ended = time.time()
+    raise SystemExit(0)
+
+
+def _location(filename):
+    return os.path.relpath(filename) if filename.startswith(os.getcwd()) else filename
+
+
+def _hotspots(stats, app_path):
+    rows = []
+    for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        if filename == "~" and any(word in function for word in _IDLE):
+            continue
+        if filename == __file__ or function in ("<built-in method builtins.exec>", "run_path"):
+            continue
+        rows.append({
+            "function": function,
+            "file": _location(filename),
+            "line": line,
+            "calls": calls,
+            "tottime_ms": round(tottime * 1000, 2),
+            "cumtime_ms": round(cumtime * 1000, 2),
+            "in_app": os.path.abspath(filename) == app_path,
+        })
+    top = sorted(rows, key=lambda row: row["tottime_ms"], reverse=True)[:TOP]
+    app = sorted((row for row in rows if row["in_app"]), key=lambda row: row["cumtime_ms"], reverse=True)[:TOP]
+    return top, app
+
+
+def _allocations(app_path):
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+    statistics = snapshot.compare_to(state.baseline, "lineno") if state.baseline else snapshot.statistics("lineno")
+    rows = []
+    for stat in statistics:
+        size = getattr(stat, "size_diff", stat.size)
+        if size <= 0:
+            continue
+        frame = stat.traceback[0]
+        rows.append({
+            "file": _location(frame.filename),
+            "line": frame.lineno,
+            "size_kb": round(size / 1024, 1),
+            "count": getattr(stat, "count_diff", stat.count),
+            "in_app": os.path.abspath(frame.filename) == app_path,
+        })
+        if len(rows) >= TOP:
+            break
+    return rows
+
+
+def _dump(output, app_path, started):
+    state.profile.disable()
+    threading.setprofile(None)
+    # Снимок памяти до разбора профиля: иначе в нём окажутся структуры pstats
+    allocations = _allocations(app_path)
+    stats = pstats.Stats(state.profile)
+    for profile in state.threads[state.first_thread:]:
+        try:
+            stats.add(profile)
+        except (TypeError, ValueError):
+            pass
+    hotspots, app_functions = _hotspots(stats, app_path)
+    _, peak = tracemalloc.get_traced_memory()
+    report = {
+        "hotspots": hotspots,
+        "app_functions": app_functions,
+        "allocations": allocations,
+        "peak_memory_kb": round(peak / 1024, 1),
+        "profiled_seconds": round((state.ended or time.time()) - (state.marked or started), 3),
+        "threads": len(state.threads) - state.first_thread,
+        "marked": state.marked is not None,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False)
+
+
+def main(output, app):
+    app_path = os.path.abspath(app)
+    sys.argv = [app]
+    sys.path.insert(0, os.path.dirname(app_path))
+    signal.signal(signal.SIGUSR1, _mark)
+    signal.signal(signal.SIGTERM, _terminate)
+    started = time.time()
+    tracemalloc.start(FRAMES)
+    threading.setprofile(_thread_profiler)
+    state.profile.enable()
+    try:
+        runpy.run_path(app_path, run_name="__main__")
+    except (SystemExit, KeyboardInterrupt):
+        pass
+    finally:
+        _dump(output, app_path, started)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,69 @@
+# profiling.py
+import os
+import json
+from typing import Dict, Any, List, Optional
+
+
+PROFILING_DEFAULTS = {
+    "enabled": True,
+    "duration": 3.0,          # Секунд нагрузки под профилировщиком
+    "concurrency": 4,         # Профилировщик замедляет сервер, поэтому нагрузка легче замера
+    "top": 10,                # Строк в каждом разделе отчёта
+    "traceback_frames": 1,    # Глубина стека tracemalloc для мест выделения памяти
+    "max_rounds": 2,          # Попыток оптимизации кода после провала порогов
+    "min_gain": 0.1,          # Минимальное улучшение RPS или p95, при котором код принимается
+}
+
+RUNNER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profile_runner.py")
+
+
+def profile_command(python: str, code_path: str, report_path: str) -> List[str]:
+    """Команда запуска приложения под профилировщиком (profile_runner.py)."""
+    return [python, RUNNER_PATH, report_path, code_path]
+
+
+def profile_env(settings: Dict[str, Any]) -> Dict[str, str]:
+    return {"PROFILE_TOP": str(settings["top"]), "PROFILE_FRAMES": str(settings["traceback_frames"])}
+
+
+def load_profile(report_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(report_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def format_profile(profile: Dict[str, Any], metrics: Optional[Dict[str, Any]] = None,
+                   violations: Optional[List[str]] = None, limit: int = 8) -> str:
+    """Компактный текстовый отчёт для промпта: нарушения, метрики, функции приложения, узкие места, память."""
+    lines = []
+    if violations:
+        lines.append("Нарушенные пороги: " + "; ".join(violations))
+    if metrics:
+        latency = metrics["latency_ms"]
+        lines.append(
+            f"Замер: {metrics['rps']} RPS при {metrics['concurrency']} соединениях, "
+            f"p50/p95/p99 = {latency['p50']}/{latency['p95']}/{latency['p99']} мс, ошибок {metrics['error_rate']:.2%}"
+        )
+    lines.append(f"Профиль за {profile.get('profiled_seconds', 0)} сек нагрузки:")
+    if profile.get("app_functions"):
+        lines.append("Функции app.py (накопленное время, вызовы):")
+        lines.extend(
+            f"  app.py:{row['line']} {row['function']} — {row['cumtime_ms']} мс, {row['calls']} вызовов"
+            for row in profile["app_functions"][:limit]
+        )
+    lines.append("Самые затратные функции (собственное время):")
+    lines.extend(
+        f"  {row['file']}:{row['line']} {row['function']} — {row['tottime_ms']} мс, {row['calls']} вызовов"
+        + (" [app.py]" if row["in_app"] else "")
+        for row in profile.get("hotspots", [])[:limit]
+    )
+    if profile.get("allocations"):
+        lines.append(f"Выделения памяти под нагрузкой (пик {profile.get('peak_memory_kb', 0)} КБ):")
+        lines.extend(
+            f"  {row['file']}:{row['line']} — {row['size_kb']} КБ, {row['count']} блоков"
+            + (" [app.py]" if row["in_app"] else "")
+            for row in profile["allocations"][:limit]
+        )
+    return "\n".join(lines)
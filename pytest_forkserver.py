@@ -0,0 +1,241 @@
+# pytest_forkserver.py
+"""Сервер запуска pytest с предзагрузкой фреймворков (forkserver).
+
+Запускается интерпретатором песочницы: python pytest_forkserver.py [модули...].
+Один раз импортирует pytest и перечисленные модули, затем на каждую сессию
+тестов делает fork: дочерний процесс получает уже загруженные модули и
+запускает pytest.main, а родитель остаётся чистым для следующей сессии.
+
+Протокол — JSON по строкам. Запрос в stdin:
+    {"id": ..., "path": ..., "cwd": ..., "workers": 1, "args": [...], "limits": {"RLIMIT_AS": ...},
+     "output_head": ..., "output_tail": ...}
+Ответы в stdout: {"event": "ready"} при старте, затем для каждого запроса
+события {"event": "test", ...} по мере выполнения тестов и итоговое
+{"event": "done", ...}.
+
+Модуль работает в чужом окружении, поэтому использует только stdlib и pytest.
+"""
+import os
+import sys
+import json
+import time
+import select
+import resource
+import traceback
+import importlib
+
+# Каталог сервера не должен попадать в sys.path тестов: иначе код песочницы
+# импортировал бы модули конвейера вместо своих
+if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+    sys.path.pop(0)
+
+import pytest  # noqa: E402
+
+
+def _emit(stream, payload) -> None:
+    stream.write(json.dumps(payload, ensure_ascii=False, default=str) + "\n")
+    stream.flush()
+
+
+class _Reporter:
+    """Плагин pytest: каждое завершённое действие теста — отдельное JSON-событие."""
+
+    def __init__(self, out):
+        self.out = out
+
+    def pytest_runtest_logreport(self, report):
+        if report.when == "call" or report.outcome != "passed":
+            outcome = report.outcome
+            if report.when != "call" and outcome == "failed":
+                outcome = "error"
+            _emit(self.out, {
+                "event": "test",
+                "nodeid": report.nodeid,
+                "when": report.when,
+                "outcome": outcome,
+                "duration": round(report.duration, 4),
+                "longrepr": str(report.longrepr) if report.longrepr else "",
+            })
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            _emit(self.out, {"event": "collect_error", "nodeid": report.nodeid, "longrepr": str(report.longrepr)})
+
+
+class _Collector:
+    """Плагин pytest: список собранных тестов для распределения между процессами."""
+
+    def __init__(self, out):
+        self.out = out
+
+    def pytest_collection_finish(self, session):
+        _emit(self.out, {"event": "collected", "nodeids": [item.nodeid for item in session.items]})
+
+
+def _apply_limits(limits) -> None:
+    """Лимиты RLIMIT_* сессии (как resources.apply_limits; модули конвейера здесь недоступны)."""
+    for name, value in (limits or {}).items():
+        kind = getattr(resource, name, None)
+        if kind is None:
+            continue
+        try:
+            _, hard = resource.getrlimit(kind)
+            value = value if hard == resource.RLIM_INFINITY else min(value, hard)
+            resource.setrlimit(kind, (value, value))
+        except (ValueError, OSError):
+            pass
+
+
+def _fork(args, cwd, plugin, log_path, limits=None):
+    """pytest.main в дочернем процессе; события идут в pipe, вывод pytest — в файл."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 3
+        try:
+            os.close(read_fd)
+            _apply_limits(limits)
+            os.chdir(cwd)
+            sys.path.insert(0, cwd)
+            log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.dup2(log_fd, 1)
+            os.dup2(log_fd, 2)
+            with os.fdopen(write_fd, "w", encoding="utf-8") as out:
+                code = int(pytest.main(args, plugins=[plugin(out)]))
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except BaseException:
+            traceback.print_exc()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+    os.close(write_fd)
+    return pid, read_fd
+
+
+def _stream(children, handle):
+    """Чтение строк событий из всех дочерних процессов по мере поступления."""
+    buffers = {fd: b"" for _, fd in children}
+    while buffers:
+        ready, _, _ = select.select(list(buffers), [], [])
+        for fd in ready:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                if buffers[fd].strip():
+                    handle(json.loads(buffers[fd]))
+                del buffers[fd]
+                os.close(fd)
+                continue
+            lines = (buffers[fd] + chunk).split(b"\n")
+            buffers[fd] = lines.pop()
+            for line in lines:
+                if line.strip():
+                    handle(json.loads(line))
+    codes, usages = [], []
+    for pid, _ in children:
+        _, status, usage = os.wait4(pid, 0)
+        codes.append(os.waitstatus_to_exitcode(status))
+        usages.append(usage)
+    return codes, usages
+
+
+def _read_log(path, head, tail):
+    """Начало и конец лога дочернего процесса без чтения файла целиком."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= head + tail:
+            return f.read().decode("utf-8", errors="replace")
+        start = f.read(head)
+        f.seek(size - tail)
+        end = f.read(tail)
+    return (start.decode("utf-8", errors="replace") + f"\n... пропущено {size - head - tail} байт ...\n"
+            + end.decode("utf-8", errors="replace"))
+
+
+def _combine(codes):
+    """Общий код завершения: первая ошибка, иначе 5 («нет тестов»), если тестов не было нигде."""
+    failures = [code for code in codes if code not in (0, 5)]
+    if failures:
+        return failures[0]
+    return 5 if codes and all(code == 5 for code in codes) else 0
+
+
+def run_session(request, out) -> None:
+    started = time.time()
+    cwd, path = request["cwd"], request["path"]
+    args = list(request.get("args") or ["-v"]) + ["-p", "no:cacheprovider"]
+    workers = max(1, int(request.get("workers") or 1))
+    groups = [[path]]
+    if workers > 1:
+        nodeids = []
+        collector = _fork([path, "--collect-only", "-q", "-p", "no:cacheprovider"], cwd, _Collector,
+                          os.path.join(cwd, ".pytest_collect.log"), request.get("limits"))
+        _stream([collector], lambda event: nodeids.extend(event.get("nodeids", [])))
+        if len(nodeids) > 1:
+            groups = [nodeids[i::workers] for i in range(min(workers, len(nodeids)))]
+
+    summary = {}
+    tests = []
+
+    def handle(event):
+        event["id"] = request["id"]
+        if event["event"] == "test":
+            summary[event["outcome"]] = summary.get(event["outcome"], 0) + 1
+            tests.append(event)
+        elif event["event"] == "collect_error":
+            summary["error"] = summary.get("error", 0) + 1
+        _emit(out, event)
+
+    logs = [os.path.join(cwd, f".pytest_{index}.log") for index in range(len(groups))]
+    limits = request.get("limits")
+    children = [_fork(group + args, cwd, _Reporter, log, limits) for group, log in zip(groups, logs)]
+    codes, usages = _stream(children, handle)
+
+    head, tail = int(request.get("output_head") or 16384), int(request.get("output_tail") or 65536)
+    output = []
+    for log in logs:
+        try:
+            output.append(_read_log(log, head, tail))
+            os.remove(log)
+        except OSError:
+            pass
+    _emit(out, {
+        "id": request["id"],
+        "event": "done",
+        "exitcode": _combine(codes),
+        "summary": summary,
+        "workers": len(groups),
+        "duration": round(time.time() - started, 3),
+        "output": "\n".join(output),
+        # CPU суммируется по процессам сессии, память — пик самого большого (ru_maxrss в КБ)
+        "usage": {
+            "wall_seconds": round(time.time() - started, 3),
+            "cpu_seconds": round(sum(u.ru_utime + u.ru_stime for u in usages), 3),
+            "peak_rss_mb": round(max(u.ru_maxrss for u in usages) / 1024, 1),
+        },
+    })
+
+
+def main(preload) -> None:
+    loaded = []
+    for name in preload:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception:
+            pass
+    out = sys.stdout
+    _emit(out, {"event": "ready", "pid": os.getpid(), "preloaded": loaded})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        try:
+            run_session(request, out)
+        except Exception:
+            _emit(out, {"id": request.get("id"), "event": "done", "exitcode": 3, "summary": {},
+                        "output": traceback.format_exc()})
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
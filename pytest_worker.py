@@ -0,0 +1,208 @@
+# pytest_worker.py
+import os
+import json
+import time
+import select
+import signal
+import tempfile
+import itertools
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import Dict, Any, Callable, List, Optional
+from utils import logger
+from deadlines import bounded_timeout, current_deadline, DeadlineExceeded
+from logcapture import capture_settings
+
+
+PYTEST_WORKER_DEFAULTS = {
+    "enabled": True,
+    "workers": 1,          # >1 — тесты распределяются по процессам (как pytest-xdist)
+    "max_servers": 4,      # Серверов на разные интерпретаторы песочниц
+    "startup_timeout": 60,
+    "preload": ["aiohttp", "aiohttp.web", "aiohttp.test_utils", "flask", "fastapi", "fastapi.testclient", "requests"],
+}
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_forkserver.py")
+
+
+class WorkerUnavailable(RuntimeError):
+    """Сервер pytest не запустился (например, в окружении нет pytest)."""
+
+
+class PytestWorker:
+    """Клиент долгоживущего сервера pytest (pytest_forkserver.py) для одного интерпретатора.
+
+    Сервер один раз импортирует pytest и фреймворки, а каждую сессию тестов
+    выполняет в fork-процессе, поэтому повторные прогоны тестера не платят
+    за запуск интерпретатора и импорты. Результаты приходят JSON-событиями.
+    """
+
+    def __init__(self, python: str, preload: List[str], env: Optional[Dict[str, str]] = None,
+                 startup_timeout: float = 60):
+        self.python = python
+        self.preload = preload
+        self.env = env
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.preloaded: List[str] = []
+        self._buffer = b""
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        self._stderr = tempfile.TemporaryFile()
+        self._buffer = b""
+        self.process = subprocess.Popen(
+            [self.python, SERVER_PATH, *self.preload],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._stderr,
+            env=self.env, start_new_session=True
+        )
+        try:
+            ready = self._read_event(time.monotonic() + self.startup_timeout)
+        except (subprocess.TimeoutExpired, WorkerUnavailable) as e:
+            self.stop()
+            raise WorkerUnavailable(f"Сервер pytest для {self.python} не запустился: {str(e)}")
+        self.preloaded = ready.get("preloaded", [])
+        logger.info(f"Запущен сервер pytest для {self.python} (pid {self.process.pid}), "
+                    f"предзагружено: {', '.join(self.preloaded) or 'только pytest'}")
+
+    def _kill(self) -> None:
+        """Остановка из потока сторожа: читающий поток получит EOF и сам освободит ресурсы."""
+        if self.alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        self._kill()
+        self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout, self._stderr):
+            stream.close()
+        self.process = None
+
+    def _stderr_text(self) -> str:
+        try:
+            # Только конец файла: сервер мог написать в stderr много
+            self._stderr.seek(max(0, os.fstat(self._stderr.fileno()).st_size - 8192))
+            return self._stderr.read().decode("utf-8", errors="replace").strip()[-2000:]
+        except (OSError, ValueError):
+            return ""
+
+    def _read_event(self, until: float) -> Dict[str, Any]:
+        """Следующее JSON-событие сервера; TimeoutExpired, если оно не пришло к моменту until."""
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self._buffer:
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.process.args, self.startup_timeout)
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise WorkerUnavailable(self._stderr_text() or "сервер pytest завершился")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def run(self, test_path: str, cwd: str, timeout: float = 30, workers: int = 1, args: Optional[List[str]] = None,
+            on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+            limits: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """Запуск тестов файла; события тестов передаются в on_event по мере выполнения.
+
+        При превышении timeout или отмене этапа сервер останавливается вместе с
+        сессией (следующий запуск поднимет его заново).
+        """
+        with self._lock:
+            if not self.alive():
+                self.start()
+            timeout = bounded_timeout(timeout)
+            deadline = current_deadline()
+            handle = deadline.on_cancel(self._kill, "сервер pytest") if deadline else None
+            request_id = next(self._ids)
+            tests = []
+            try:
+                capture = capture_settings()
+                request = {"id": request_id, "path": test_path, "cwd": cwd, "workers": workers, "args": args or ["-v"],
+                           "limits": limits or {}, "output_head": capture["head_bytes"],
+                           "output_tail": capture["tail_bytes"]}
+                self.process.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+                self.process.stdin.flush()
+                until = time.monotonic() + timeout
+                while True:
+                    event = self._read_event(until)
+                    if event.get("id") != request_id:
+                        continue
+                    if event["event"] == "done":
+                        event["tests"] = tests
+                        return event
+                    if event["event"] == "test":
+                        tests.append(event)
+                    if on_event:
+                        on_event(event)
+            except subprocess.TimeoutExpired:
+                self.stop()
+                raise subprocess.TimeoutExpired([self.python, "-m", "pytest", test_path], timeout)
+            except (OSError, ValueError, WorkerUnavailable, AttributeError) as e:
+                # Сервер упал или был остановлен сторожем во время сессии
+                self.stop()
+                if deadline and deadline.cancelled.is_set():
+                    raise DeadlineExceeded(deadline.name)
+                raise WorkerUnavailable(str(e))
+            finally:
+                if handle is not None:
+                    deadline.remove_callback(handle)
+
+
+class PytestWorkers:
+    """Серверы pytest по интерпретаторам песочниц; давно не использованные останавливаются."""
+
+    def __init__(self, settings: Dict[str, Any]):
+        self.settings = settings
+        self._workers: "OrderedDict[str, PytestWorker]" = OrderedDict()
+        self._unavailable: set = set()
+        self._lock = threading.Lock()
+
+    def get(self, python: str, env: Optional[Dict[str, str]] = None) -> PytestWorker:
+        with self._lock:
+            worker = self._workers.pop(python, None)
+            if worker is None:
+                worker = PytestWorker(python, self.settings["preload"], env, self.settings["startup_timeout"])
+            self._workers[python] = worker
+            while len(self._workers) > self.settings["max_servers"]:
+                _, stale = self._workers.popitem(last=False)
+                stale.stop()
+            return worker
+
+    def run(self, python: str, env: Optional[Dict[str, str]], test_path: str, cwd: str,
+            timeout: float = 30, limits: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        # Интерпретатор, для которого сервер не запустился, повторно не пробуется
+        if python in self._unavailable:
+            raise WorkerUnavailable(f"сервер pytest для {python} не запускается")
+        worker = self.get(python, env)
+        if not worker.alive():
+            try:
+                worker.start()
+            except WorkerUnavailable:
+                self._unavailable.add(python)
+                raise
+        return worker.run(test_path, cwd, timeout=timeout, workers=self.settings["workers"], limits=limits)
+
+    def close(self) -> None:
+        with self._lock:
+            for worker in self._workers.values():
+                worker.stop()
+            self._workers.clear()
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Текст для логов и обратной связи: вывод pytest и итог по событиям."""
+    summary = ", ".join(f"{count} {outcome}" for outcome, count in sorted(report.get("summary", {}).items()))
+    return f"{report.get('output', '')}\nИтог: {summary or 'тесты не найдены'} за {report.get('duration', 0)} сек"
@@ -0,0 +1,170 @@
+# resources.py
+import os
+import time
+import signal
+import resource
+import threading
+import subprocess
+from typing import Dict, Any, Callable, List, Optional
+
+
+RESOURCE_DEFAULTS = {
+    "enabled": True,
+    "cpu_seconds": 60,         # RLIMIT_CPU: процесс получает SIGXCPU
+    "memory_mb": 2048,         # RLIMIT_AS: виртуальная память (потоки резервируют её с запасом)
+    "processes": 512,          # RLIMIT_NPROC: считается по пользователю, а не по процессу
+    "file_size_mb": 256,       # RLIMIT_FSIZE
+    "open_files": 1024,        # RLIMIT_NOFILE
+    "docker_memory_mb": 1024,
+    "docker_cpus": 1.0,
+    "docker_pids": 256,
+}
+
+_MB = 1024 * 1024
+
+
+def rlimits(settings: Dict[str, Any]) -> Dict[str, int]:
+    """Лимиты процесса песочницы по именам RLIMIT_* (сериализуемы в JSON для сервера pytest)."""
+    if not settings.get("enabled", True):
+        return {}
+    return {
+        "RLIMIT_CPU": int(settings["cpu_seconds"]),
+        "RLIMIT_AS": int(settings["memory_mb"]) * _MB,
+        "RLIMIT_NPROC": int(settings["processes"]),
+        "RLIMIT_FSIZE": int(settings["file_size_mb"]) * _MB,
+        "RLIMIT_NOFILE": int(settings["open_files"]),
+    }
+
+
+def apply_limits(limits: Dict[str, int]) -> None:
+    """Установка лимитов в текущем процессе (вызывается в дочернем процессе до exec).
+
+    Лимит не поднимается выше жёсткого лимита родителя; неподдерживаемые
+    платформой лимиты пропускаются.
+    """
+    for name, value in limits.items():
+        kind = getattr(resource, name, None)
+        if kind is None:
+            continue
+        try:
+            _, hard = resource.getrlimit(kind)
+            value = value if hard == resource.RLIM_INFINITY else min(value, hard)
+            resource.setrlimit(kind, (value, value))
+        except (ValueError, OSError):
+            pass
+
+
+def limit_preexec(limits: Optional[Dict[str, int]]) -> Optional[Callable[[], None]]:
+    return (lambda: apply_limits(limits)) if limits else None
+
+
+def rusage_usage(rusage, wall_seconds: float) -> Dict[str, float]:
+    """Потребление по rusage: CPU (user + system), пиковый RSS (ru_maxrss в КБ на Linux) и время."""
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+    }
+
+
+class MeteredPopen(subprocess.Popen):
+    """Popen, который забирает статус дочернего процесса через wait4 и сохраняет его rusage.
+
+    Учитывается сам процесс и дождавшиеся его потомки. Время считается от
+    запуска до получения статуса.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.started = time.monotonic()
+        self.usage: Optional[Dict[str, float]] = None
+        super().__init__(*args, **kwargs)
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, status, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return self.pid, 0
+        if pid == self.pid:
+            self.usage = rusage_usage(rusage, time.monotonic() - self.started)
+        return pid, status
+
+
+def describe_exit(returncode: Optional[int]) -> str:
+    """Пояснение к завершению сигналом, которым ядро сообщает о превышении лимита."""
+    if returncode == -signal.SIGXCPU:
+        return "превышен лимит процессорного времени"
+    if returncode == -signal.SIGXFSZ:
+        return "превышен лимит размера файла"
+    if returncode == -signal.SIGKILL:
+        return "процесс принудительно завершён (память или таймаут)"
+    return ""
+
+
+def docker_limits(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Лимиты контейнера в аргументах docker SDK (containers.run)."""
+    if not settings.get("enabled", True):
+        return {}
+    memory = f"{int(settings['docker_memory_mb'])}m"
+    return {
+        "mem_limit": memory,
+        "memswap_limit": memory,  # Без подкачки: лимит памяти действительно ограничивает
+        "nano_cpus": int(float(settings["docker_cpus"]) * 1e9),
+        "pids_limit": int(settings["docker_pids"]),
+    }
+
+
+def limit_container(container, settings: Dict[str, Any]) -> None:
+    """Лимиты для уже запущенного контейнера (docker-compose создаёт их сам)."""
+    if not settings.get("enabled", True):
+        return
+    memory = f"{int(settings['docker_memory_mb'])}m"
+    period = 100000
+    container.update(mem_limit=memory, memswap_limit=memory, cpu_period=period,
+                     cpu_quota=int(float(settings["docker_cpus"]) * period))
+
+
+def container_usage(container, started: float) -> Dict[str, float]:
+    """Потребление контейнера по docker stats: CPU за всё время, пик (или текущая) память."""
+    stats = container.stats(stream=False)
+    memory = stats.get("memory_stats", {})
+    peak = memory.get("max_usage") or memory.get("usage") or 0
+    cpu = stats.get("cpu_stats", {}).get("cpu_usage", {}).get("total_usage", 0)
+    return {
+        "wall_seconds": round(time.monotonic() - started, 3),
+        "cpu_seconds": round(cpu / 1e9, 3),
+        "peak_rss_mb": round(peak / _MB, 1),
+    }
+
+
+def merge_usage(usages: List[Dict[str, float]]) -> Dict[str, float]:
+    """Суммарное CPU и время, максимальная память."""
+    usages = [u for u in usages if u]
+    if not usages:
+        return {}
+    return {
+        "wall_seconds": round(sum(u.get("wall_seconds", 0) for u in usages), 3),
+        "cpu_seconds": round(sum(u.get("cpu_seconds", 0) for u in usages), 3),
+        "peak_rss_mb": max(u.get("peak_rss_mb", 0) for u in usages),
+    }
+
+
+class UsageLog:
+    """Журнал потребления ресурсов выполнениями за запуск конвейера."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records: List[Dict[str, Any]] = []
+
+    def record(self, kind: str, result: Dict[str, Any]) -> None:
+        if result.get("usage"):
+            with self._lock:
+                self.records.append({"kind": kind, "status": result.get("status"), **result["usage"]})
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            records = list(self.records)
+        by_kind = {}
+        for kind in sorted({r["kind"] for r in records}):
+            subset = [r for r in records if r["kind"] == kind]
+            by_kind[kind] = {"executions": len(subset), **merge_usage(subset)}
+        return {"executions": len(records), **merge_usage(records), "by_kind": by_kind}
@@ -0,0 +1,332 @@
+# sandbox_pool.py
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+from utils import logger, repo_path
+from deadlines import run_process
+from wheelhouse import Wheelhouse
+
+
+SANDBOX_POOL_DEFAULTS = {
+    "enabled": True,
+    "dir": ".sandboxes",
+    "max_envs": 4,
+    "idle_per_env": 2,
+    "base_packages": ["pytest"],
+    "install_timeout": 300,
+    "prewarm": True,
+}
+
+
+def env_key(packages: List[str]) -> str:
+    """Ключ окружения: набор устанавливаемых пакетов и версия интерпретатора."""
+    spec = {"python": sys.version.split()[0], "packages": sorted({p.strip().lower() for p in packages if p.strip()})}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def _copy_tree(source: str, target: str) -> None:
+    """Копия каталога с copy-on-write (reflink) там, где её поддерживает файловая система."""
+    try:
+        subprocess.run(["cp", "-a", "--reflink=auto", source, target], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+    except (OSError, subprocess.SubprocessError):
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target, symlinks=True)
+
+
+def _fingerprint(venv_dir: str) -> List[str]:
+    """Список установленных пакетов окружения — по нему замечается, что код что-то доустановил."""
+    lib = os.path.join(venv_dir, "lib")
+    names = []
+    for root, dirs, _ in os.walk(lib):
+        if os.path.basename(root) == "site-packages":
+            names.extend(dirs)
+            dirs.clear()
+    return sorted(names)
+
+
+class Sandbox:
+    """Арендованная песочница: рабочий каталог и интерпретатор окружения."""
+
+    def __init__(self, path: str, work: str, python: str, venv: Optional[str] = None):
+        self.path = path
+        self.work = work
+        self.python = python
+        self.venv = venv
+        self._lock_file = None
+
+    def env(self) -> Dict[str, str]:
+        """Переменные окружения процесса, запускаемого в песочнице."""
+        if not self.venv:
+            return {}
+        bin_dir = os.path.dirname(self.python)
+        return {"VIRTUAL_ENV": self.venv, "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"}
+
+
+class SandboxPool:
+    """Пул прогретых песочниц с виртуальными окружениями по набору зависимостей.
+
+    Для каждого набора зависимостей один раз создаётся эталонное окружение
+    (<dir>/<ключ>/base); песочницы получают его копию (copy-on-write, где
+    возможно) и переиспользуются между запусками. При возврате в пул рабочий
+    каталог очищается, а окружение, в которое код доустановил пакеты,
+    восстанавливается из эталона. Каталоги сохраняются на диске, поэтому
+    прогрев переживает перезапуск конвейера.
+    """
+
+    def __init__(self, settings: Dict[str, Any], wheelhouse: Optional[Wheelhouse] = None):
+        self.settings = settings
+        self.wheelhouse = wheelhouse
+        self.root = repo_path(settings["dir"])
+        self._lock = threading.Lock()
+        self._env_locks: Dict[str, threading.Lock] = {}
+        self._idle: Dict[str, List[Sandbox]] = {}
+        self._in_use: Dict[str, int] = {}
+        self._failed: set = set()
+        self.stats = {"leases": 0, "warm": 0, "provisioned": 0, "restored": 0}
+        os.makedirs(self.root, exist_ok=True)
+
+    def prewarm(self, dependencies: Optional[List[str]] = None) -> threading.Thread:
+        """Создание окружения в фоне, чтобы первый запуск не ждал установки пакетов."""
+        thread = threading.Thread(
+            target=self._ensure_env, args=(dependencies or [],), name="sandbox-prewarm", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _key(self, dependencies: List[str]) -> str:
+        return env_key(list(self.settings["base_packages"]) + list(dependencies))
+
+    def _env_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._env_locks.setdefault(key, threading.Lock())
+
+    def _ensure_env(self, dependencies: List[str]) -> Optional[str]:
+        """Эталонное окружение для набора зависимостей; None, если его не удалось создать."""
+        key = self._key(dependencies)
+        base = os.path.join(self.root, key, "base")
+        marker = os.path.join(self.root, key, "ready.json")
+        with self._env_lock(key):
+            if os.path.exists(marker):
+                os.utime(marker)  # Отметка об использовании для вытеснения
+                return base
+            if key in self._failed:
+                return None
+            packages = list(self.settings["base_packages"]) + sorted(set(dependencies))
+            started = time.time()
+            try:
+                shutil.rmtree(base, ignore_errors=True)
+                run_process([sys.executable, "-m", "venv", base], timeout=120).check_returncode()
+                if packages:
+                    python = os.path.join(base, "bin", "python")
+                    cmd, env = [python, "-m", "pip", "install", "--disable-pip-version-check", "-q"], None
+                    if self.wheelhouse and self.wheelhouse.enabled:
+                        # Установка из склада колёс; без него — из индекса через общий кэш pip
+                        env = self.wheelhouse.pip_env()
+                        if self.wheelhouse.ensure(packages):
+                            cmd += self.wheelhouse.install_args()
+                        elif self.wheelhouse.settings["offline"]:
+                            raise RuntimeError("пакетов нет в складе колёс, а загрузка запрещена (offline)")
+                    result = run_process(cmd + packages, timeout=self.settings["install_timeout"], env=env)
+                    if result.returncode != 0:
+                        raise RuntimeError(result.stderr.strip()[-2000:])
+            except Exception as e:
+                logger.warning(f"Не удалось подготовить окружение {key} ({', '.join(packages)}): {str(e)}")
+                shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+                self._failed.add(key)
+                return None
+            with open(marker, "w", encoding="utf-8") as f:
+                json.dump({"packages": packages, "fingerprint": _fingerprint(base)}, f, ensure_ascii=False)
+            self.stats["provisioned"] += 1
+            logger.info(f"Подготовлено окружение {key} ({', '.join(packages) or 'без пакетов'}) за {time.time() - started:.1f} сек")
+        self._evict_envs(keep=key)
+        return base
+
+    def _lock_env(self, key: str, exclusive: bool):
+        """Межпроцессная блокировка окружения: аренда держит разделяемую, удаление — исключительную.
+
+        Файл блокировки лежит рядом с каталогом окружения и не удаляется вместе с ним.
+        Возвращает открытый файл или None, если блокировку взять нельзя.
+        """
+        try:
+            handle = open(os.path.join(self.root, f"{key}.lock"), "a")
+        except OSError:
+            return None
+        try:
+            if exclusive:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                fcntl.flock(handle, fcntl.LOCK_SH)
+        except OSError:
+            handle.close()
+            return None
+        return handle
+
+    def _evict_envs(self, keep: str) -> None:
+        """Удаление давно не использованных окружений сверх max_envs (кроме занятых).
+
+        Окружение, арендованное другим процессом, не удаляется.
+        """
+        with self._lock:
+            keys = [
+                name for name in os.listdir(self.root)
+                if os.path.exists(os.path.join(self.root, name, "ready.json"))
+            ]
+            if len(keys) <= self.settings["max_envs"]:
+                return
+            keys.sort(key=lambda name: os.path.getmtime(os.path.join(self.root, name, "ready.json")))
+            for name in keys[:len(keys) - self.settings["max_envs"]]:
+                if name == keep or self._in_use.get(name):
+                    continue
+                lock = self._lock_env(name, exclusive=True)
+                if lock is None:
+                    continue
+                try:
+                    self._idle.pop(name, None)
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                finally:
+                    lock.close()
+                logger.info(f"Удалено окружение песочницы {name}")
+
+    def _acquire(self, key: str, base: str) -> Sandbox:
+        """Свободная прогретая песочница окружения или новая копия эталона."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+            candidates = list(idle)
+            idle.clear()
+        env_dir = os.path.join(self.root, key)
+        # Песочницы, оставшиеся на диске от прошлых запусков
+        if not candidates:
+            candidates = [
+                self._sandbox(os.path.join(env_dir, name))
+                for name in sorted(os.listdir(env_dir)) if name.startswith("sb-")
+            ]
+        for sandbox in candidates:
+            if self._lock_sandbox(sandbox):
+                self._release_idle(key, [c for c in candidates if c is not sandbox])
+                # Песочница с диска могла остаться недоделанной после аварийного завершения
+                if not os.path.exists(sandbox.python):
+                    shutil.rmtree(sandbox.venv, ignore_errors=True)
+                    _copy_tree(base, sandbox.venv)
+                os.makedirs(sandbox.work, exist_ok=True)
+                self.stats["warm"] += 1
+                return sandbox
+        self._release_idle(key, candidates)
+
+        index = 0
+        while True:
+            path = os.path.join(env_dir, f"sb-{index}")
+            try:
+                os.makedirs(path)
+                break
+            except FileExistsError:
+                index += 1
+        sandbox = self._sandbox(path)
+        self._lock_sandbox(sandbox)
+        _copy_tree(base, sandbox.venv)
+        os.makedirs(sandbox.work, exist_ok=True)
+        return sandbox
+
+    def _release_idle(self, key: str, sandboxes: List[Sandbox]) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            paths = {s.path for s in idle}
+            idle.extend(s for s in sandboxes if s.path not in paths and os.path.isdir(s.path))
+
+    @staticmethod
+    def _sandbox(path: str) -> Sandbox:
+        venv = os.path.join(path, "venv")
+        return Sandbox(path, os.path.join(path, "work"), os.path.join(venv, "bin", "python"), venv)
+
+    @staticmethod
+    def _lock_sandbox(sandbox: Sandbox) -> bool:
+        """Межпроцессная блокировка песочницы: одну песочницу не арендуют два конвейера."""
+        try:
+            handle = open(os.path.join(sandbox.path, ".lock"), "a")
+        except OSError:
+            return False
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        sandbox._lock_file = handle
+        return True
+
+    def _reset(self, key: str, sandbox: Sandbox) -> bool:
+        """Возврат песочницы в исходное состояние; False, если её проще удалить."""
+        try:
+            shutil.rmtree(sandbox.work, ignore_errors=True)
+            os.makedirs(sandbox.work)
+            with open(os.path.join(self.root, key, "ready.json"), "r", encoding="utf-8") as f:
+                expected = json.load(f)["fingerprint"]
+            if _fingerprint(sandbox.venv) != expected:
+                logger.info(f"Окружение песочницы {sandbox.path} изменено кодом, восстановление из эталона")
+                shutil.rmtree(sandbox.venv, ignore_errors=True)
+                _copy_tree(os.path.join(self.root, key, "base"), sandbox.venv)
+                self.stats["restored"] += 1
+            return True
+        except Exception as e:
+            logger.warning(f"Не удалось сбросить песочницу {sandbox.path}: {str(e)}")
+            return False
+
+    def _release(self, key: str, sandbox: Sandbox) -> None:
+        keep = self._reset(key, sandbox)
+        with self._lock:
+            self._in_use[key] -= 1
+            idle = self._idle.setdefault(key, [])
+            known = any(s.path == sandbox.path for s in idle)
+            keep = keep and (known or len(idle) < self.settings["idle_per_env"])
+            if keep and not known:
+                idle.append(sandbox)
+        if not keep:
+            shutil.rmtree(sandbox.path, ignore_errors=True)
+        sandbox._lock_file.close()
+        sandbox._lock_file = None
+
+    @contextmanager
+    def lease(self, dependencies: Optional[List[str]] = None) -> Iterator[Sandbox]:
+        """Аренда песочницы с окружением под зависимости.
+
+        Если окружение создать не удалось (нет сети, pip недоступен), выдаётся
+        одноразовый временный каталог с системным интерпретатором.
+        """
+        dependencies = dependencies or []
+        self.stats["leases"] += 1
+        key = self._key(dependencies)
+        # Разделяемая блокировка на всю аренду: другой процесс не удалит окружение между подготовкой и выдачей
+        env_lock = self._lock_env(key, exclusive=False) if self.settings["enabled"] else None
+        try:
+            base = self._ensure_env(dependencies) if env_lock is not None else None
+            if base is None:
+                path = tempfile.mkdtemp(prefix="execution_sandbox_")
+                try:
+                    yield Sandbox(path, path, "python")
+                finally:
+                    shutil.rmtree(path, ignore_errors=True)
+                return
+
+            try:
+                sandbox = self._acquire(key, base)
+            except Exception:
+                with self._lock:
+                    self._in_use[key] -= 1
+                raise
+            logger.info(f"Песочница {sandbox.path} арендована (окружение {key})")
+            try:
+                yield sandbox
+            finally:
+                self._release(key, sandbox)
+        finally:
+            if env_lock is not None:
+                env_lock.close()
@@ -0,0 +1,279 @@
+# scheduler.py
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Callable, Tuple, NamedTuple
+from utils import logger
+
+
+# Граф этапов по умолчанию (используется, если в settings.yml нет секции pipeline)
+DEFAULT_STAGES = {
+    "decomposer": {"needs": []},
+    "validator": {"needs": ["decomposer"], "gate": True},
+    "consistency": {"needs": ["decomposer"], "gate": True},
+    "codegen": {"needs": ["validator", "consistency"]},
+    "extractor": {"needs": ["codegen"]},
+    "docker": {"needs": ["extractor"], "required": False},
+    "tester": {"needs": ["codegen"]},
+    "performance": {"needs": ["docker", "tester"]},
+    "docs": {"needs": ["codegen"]}
+}
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Допустимые переходы конечного автомата этапа
+TRANSITIONS = {
+    PENDING: {RUNNING},
+    RUNNING: {DONE, PENDING, FAILED, SKIPPED},
+    DONE: {PENDING},
+    FAILED: {PENDING},
+    SKIPPED: {PENDING},
+}
+
+
+class StageEvent(NamedTuple):
+    """Событие завершения этапа, публикуемое рабочим потоком."""
+    stage: str
+    ok: bool
+    duration: float
+
+
+class PipelineScheduler:
+    """Планировщик этапов конвейера, заданных графом зависимостей.
+
+    Этап запускается, как только завершены все этапы из его needs (join),
+    поэтому независимые этапы выполняются параллельно, а общее время
+    определяется критическим путём графа.
+    """
+
+    def __init__(self, stages: Dict[str, Dict[str, Any]], runner: Callable[[str], bool],
+                 max_workers: int = 4, max_attempts: int = 3, max_resets: int = 2,
+                 max_steps: int = 50, on_update: Optional[Callable[[Dict[str, str]], None]] = None):
+        """Инициализация планировщика.
+
+        runner(stage) выполняет этап и возвращает True при успехе.
+        on_update(statuses) вызывается после каждого изменения статусов.
+        """
+        self.stages = {name: dict(spec or {}) for name, spec in stages.items()}
+        for spec in self.stages.values():
+            spec.setdefault("needs", [])
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.max_resets = max_resets
+        self.max_steps = max_steps
+        self.on_update = on_update
+
+        self.order = self._topological_order()
+        self.status = {name: PENDING for name in self.order}
+        self.attempts = {name: 0 for name in self.order}
+        self.durations: Dict[str, float] = {}
+        self.resets = 0
+        self.steps = 0
+        self.cancelled = False
+        self._stale = set()
+
+    @classmethod
+    def from_settings(cls, pipeline: Optional[Dict[str, Any]], runner: Callable[[str], bool], **kwargs) -> "PipelineScheduler":
+        """Создание планировщика из секции pipeline в settings.yml."""
+        pipeline = pipeline or {}
+        kwargs.setdefault("max_workers", pipeline.get("max_workers", 4))
+        kwargs.setdefault("max_attempts", pipeline.get("max_attempts", 3))
+        kwargs.setdefault("max_resets", pipeline.get("max_resets", 2))
+        return cls(pipeline.get("stages") or DEFAULT_STAGES, runner, **kwargs)
+
+    def _topological_order(self) -> List[str]:
+        """Топологическая сортировка этапов с проверкой графа."""
+        for name, spec in self.stages.items():
+            for dep in spec["needs"]:
+                if dep not in self.stages:
+                    raise ValueError(f"Этап {name} зависит от неизвестного этапа {dep}")
+
+        order, visiting, visited = [], set(), set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Цикл в графе этапов через {name}")
+            visiting.add(name)
+            for dep in self.stages[name]["needs"]:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def descendants(self, stage: str) -> List[str]:
+        """Все этапы, транзитивно зависящие от stage (в топологическом порядке)."""
+        affected = {stage}
+        for name in self.order:
+            if any(dep in affected for dep in self.stages[name]["needs"]):
+                affected.add(name)
+        affected.discard(stage)
+        return [name for name in self.order if name in affected]
+
+    def _ready(self) -> List[str]:
+        """Этапы, все зависимости которых завершены."""
+        return [
+            name for name in self.order
+            if self.status[name] == PENDING
+            and all(self.status[dep] in (DONE, SKIPPED) for dep in self.stages[name]["needs"])
+        ]
+
+    def _transition(self, stage: str, new_status: str) -> None:
+        """Смена статуса этапа с проверкой допустимости перехода."""
+        old_status = self.status[stage]
+        if new_status not in TRANSITIONS[old_status]:
+            raise RuntimeError(f"Недопустимый переход этапа {stage}: {old_status} → {new_status}")
+        self.status[stage] = new_status
+
+    def _reset(self, stage: str) -> None:
+        """Возврат этапа и всех зависящих от него этапов в ожидание."""
+        for name in [stage] + self.descendants(stage):
+            if self.status[name] == RUNNING:
+                # Результат выполняющегося этапа будет отброшен по завершении
+                self._stale.add(name)
+            elif self.status[name] != PENDING:
+                self._transition(name, PENDING)
+            self.attempts[name] = 0
+
+    def _execute(self, stage: str, events: "queue.Queue[StageEvent]") -> None:
+        """Выполнение этапа в рабочем потоке с публикацией события о завершении."""
+        started = time.monotonic()
+        ok = False
+        try:
+            ok = bool(self.runner(stage))
+        except Exception as e:
+            logger.error(f"Исключение при выполнении этапа {stage}: {str(e)}")
+        finally:
+            events.put(StageEvent(stage, ok, time.monotonic() - started))
+
+    def _on_complete(self, event: StageEvent) -> bool:
+        """Переход по событию завершения этапа. Возвращает False при фатальной ошибке конвейера."""
+        stage = event.stage
+        spec = self.stages[stage]
+        self.durations[stage] = self.durations.get(stage, 0.0) + event.duration
+
+        if stage in self._stale:
+            self._stale.discard(stage)
+            self._transition(stage, PENDING)
+            self.attempts[stage] = 0
+            logger.info(f"Результат этапа {stage} отброшен: вышестоящий этап перезапущен")
+            return True
+
+        if event.ok:
+            self._transition(stage, DONE)
+            logger.info(f"Этап {stage} завершён за {event.duration:.2f} сек")
+            return True
+
+        max_attempts = spec.get("max_attempts", self.max_attempts)
+        if self.attempts[stage] < max_attempts:
+            logger.warning(f"Этап {stage} не удался, попытка {self.attempts[stage]}/{max_attempts}")
+            self._transition(stage, PENDING)
+            return True
+
+        fallback = spec.get("fallback")
+        if fallback and self.resets < self.max_resets:
+            self.resets += 1
+            logger.warning(f"Этап {stage} исчерпал попытки, возврат к этапу {fallback}")
+            self._transition(stage, FAILED)
+            self._reset(fallback)
+            return True
+
+        if not spec.get("required", True):
+            logger.warning(f"Необязательный этап {stage} пропущен после {self.attempts[stage]} попыток")
+            self._transition(stage, SKIPPED)
+            return True
+
+        logger.error(f"Обязательный этап {stage} не выполнен, конвейер остановлен")
+        self._transition(stage, FAILED)
+        return False
+
+    def cancel(self) -> None:
+        """Остановка запуска новых этапов; выполняющиеся этапы дожидаются завершения."""
+        self.cancelled = True
+
+    def _notify(self) -> None:
+        if self.on_update:
+            self.on_update(dict(self.status))
+
+    def run(self) -> Dict[str, str]:
+        """Выполнение графа до завершения всех этапов или фатальной ошибки.
+
+        Цикл не опрашивает этапы и не спит: он блокируется на очереди событий,
+        и переходы срабатывают сразу по завершении очередного этапа.
+        """
+        started = time.monotonic()
+        events: "queue.Queue[StageEvent]" = queue.Queue()
+        in_flight = 0
+        failed = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as pool:
+            while True:
+                if not failed and not self.cancelled:
+                    for stage in self._ready():
+                        if self.steps >= self.max_steps:
+                            break
+                        self._transition(stage, RUNNING)
+                        self.attempts[stage] += 1
+                        self.steps += 1
+                        logger.info(f"Запуск этапа {stage} (попытка {self.attempts[stage]})")
+                        pool.submit(self._execute, stage, events)
+                        in_flight += 1
+                    self._notify()
+
+                if not in_flight:
+                    break
+
+                event = events.get()
+                in_flight -= 1
+                if not self._on_complete(event):
+                    failed = True
+                self._notify()
+
+        if self.steps >= self.max_steps and any(s == PENDING for s in self.status.values()):
+            logger.warning(f"Превышено максимальное количество шагов ({self.max_steps}), выполнение остановлено")
+        if self.cancelled:
+            logger.warning("Выполнение конвейера отменено до завершения всех этапов")
+
+        path, path_time = self.critical_path()
+        logger.info(
+            f"Конвейер завершён за {time.monotonic() - started:.2f} сек, "
+            f"критический путь {' → '.join(path)} ({path_time:.2f} сек)"
+        )
+        return dict(self.status)
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """Самая длинная по времени цепочка этапов графа."""
+        finish: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        for name in self.order:
+            needs = self.stages[name]["needs"]
+            best = max(needs, key=lambda dep: finish[dep], default=None)
+            finish[name] = (finish[best] if best else 0.0) + self.durations.get(name, 0.0)
+            previous[name] = best
+
+        if not finish:
+            return [], 0.0
+        last = max(finish, key=finish.get)
+        path = []
+        node = last
+        while node:
+            path.append(node)
+            node = previous[node]
+        return list(reversed(path)), finish[last]
+
+    def succeeded(self) -> bool:
+        """Все обязательные этапы завершены."""
+        return all(
+            status == DONE or (status == SKIPPED and not self.stages[name].get("required", True))
+            for name, status in self.status.items()
+        )
@@ -0,0 +1,190 @@
+# supervisor.py
+import os
+import fcntl
+import signal
+import tempfile
+import subprocess
+from typing import Dict, Any, Optional, List
+from utils import logger
+from deadlines import current_deadline, DeadlineExceeded
+from probes import poll, port_open, group_listens
+from resources import MeteredPopen, limit_preexec, describe_exit
+from logcapture import read_bounded
+
+PORT_LOCK_DIR = os.path.join(tempfile.gettempdir(), "sandbox-ports")
+
+
+class PortBusy(RuntimeError):
+    """Порт сервера занят процессом вне надзора."""
+
+
+class ServerProcess:
+    """Долгоживущий процесс (сервер, бесконечный цикл) под надзором.
+
+    Запускает процесс с выводом в файл (чтобы заполненный pipe не блокировал
+    его), ждёт готовности по TCP-порту и гарантированно останавливает при
+    выходе из контекста или отмене этапа сторожем.
+
+    С port процесс на время жизни держит блокировку порта: параллельные
+    задачи пакета с одинаковым портом запускаются по очереди, а порт,
+    занятый кем-то ещё, даёт PortBusy до запуска.
+    """
+
+    def __init__(self, cmd: List[str], cwd: str, env: Optional[Dict[str, str]] = None,
+                 limits: Optional[Dict[str, int]] = None, port: Optional[int] = None,
+                 port_wait: float = 300.0):
+        self.cmd = cmd
+        self.port = port
+        self.port_wait = port_wait
+        self._port_lock = None
+        self.limits = limits
+        self.cwd = cwd
+        self.env = {**os.environ, **(env or {})}
+        self.log_path = os.path.join(cwd, "process.log")
+        self.process: Optional[MeteredPopen] = None
+        self._deadline = None
+        self._cancel_handle = None
+
+    def __enter__(self) -> "ServerProcess":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if self.port:
+            self._lock_port()
+        self._log = open(self.log_path, "w", encoding="utf-8")
+        self.process = MeteredPopen(
+            self.cmd, cwd=self.cwd, env=self.env, preexec_fn=limit_preexec(self.limits),
+            stdout=self._log, stderr=subprocess.STDOUT,
+            start_new_session=True  # Группа процессов: останавливаются и дочерние процессы сервера
+        )
+        self._deadline = current_deadline()
+        if self._deadline:
+            self._cancel_handle = self._deadline.on_cancel(self._kill, f"процесс {' '.join(self.cmd[:3])}")
+        logger.info(f"Запущен процесс под надзором: {' '.join(self.cmd)} (pid {self.process.pid})")
+
+    def _lock_port(self) -> None:
+        os.makedirs(PORT_LOCK_DIR, exist_ok=True)
+        lock = open(os.path.join(PORT_LOCK_DIR, f"{self.port}.lock"), "w")
+
+        def acquire() -> bool:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                return False
+
+        try:
+            if not acquire():
+                logger.info(f"Порт {self.port} занят другой задачей, ожидание освобождения")
+                if not poll(acquire, self.port_wait):
+                    raise PortBusy(f"порт {self.port} не освободился за {self.port_wait} сек")
+            if port_open("127.0.0.1", self.port):
+                raise PortBusy(f"порт {self.port} уже занят процессом вне надзора")
+        except BaseException:
+            lock.close()
+            raise
+        self._port_lock = lock
+
+    def _unlock_port(self) -> None:
+        if self._port_lock is not None:
+            self._port_lock.close()
+            self._port_lock = None
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def listening(self, port: int, host: str = "127.0.0.1") -> bool:
+        """Порт открыт, и слушает его процесс из группы этого сервера."""
+        if not port_open(host, port):
+            return False
+        # Без /proc принадлежность не проверить: достаточно открытого порта
+        return group_listens(self.process.pid, port) is not False
+
+    def wait_ready(self, port: int, timeout: float = 15.0, host: str = "127.0.0.1") -> bool:
+        """Ожидание, пока процесс начнёт принимать соединения на порту.
+
+        False, если процесс завершился, порт не открылся за timeout или его
+        слушает посторонний процесс.
+        """
+        ready = poll(lambda: self.listening(port, host), timeout, alive=self.alive)
+        return ready and self.alive()
+
+    def run_for(self, seconds: float) -> bool:
+        """Наблюдение за процессом seconds секунд. True, если он всё это время работал."""
+        try:
+            self.process.wait(timeout=seconds)
+        except subprocess.TimeoutExpired:
+            return True
+        if self._deadline and self._deadline.cancelled.is_set():
+            raise DeadlineExceeded(self._deadline.name)
+        return False
+
+    def _kill(self) -> None:
+        if self.alive():
+            os.killpg(self.process.pid, signal.SIGKILL)
+
+    def stop(self, grace: float = 3.0) -> Optional[int]:
+        """Остановка: SIGTERM группе процессов, затем SIGKILL по истечении grace."""
+        if self.process is None:
+            self._unlock_port()
+            return None
+        if self.alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                self._kill()
+                self.process.wait()
+            except ProcessLookupError:
+                pass
+        if self._cancel_handle is not None:
+            self._deadline.remove_callback(self._cancel_handle)
+            self._cancel_handle = None
+        self._log.close()
+        self._unlock_port()
+        return self.process.returncode
+
+    def logs(self) -> str:
+        """Начало и конец вывода процесса; файл целиком не читается."""
+        return read_bounded(self.log_path)
+
+
+def supervise_long_running(code_path: str, port: Optional[int], startup_timeout: float = 15.0,
+                           observe_seconds: float = 3.0, python: str = "python",
+                           env: Optional[Dict[str, str]] = None,
+                           limits: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Проверка долгоживущего кода запуском под надзором.
+
+    Сервер должен открыть порт за startup_timeout; код без порта (цикл) должен
+    проработать observe_seconds без падения. После проверки процесс останавливается.
+    """
+    cwd = os.path.dirname(code_path)
+    server = ServerProcess([python, code_path], cwd=cwd, env=env, limits=limits, port=port)
+    try:
+        server.start()
+    except PortBusy as e:
+        return {"status": "failed", "logs": str(e), "error": "Port busy"}
+    try:
+        if port:
+            ok = server.wait_ready(port, startup_timeout)
+            outcome = f"сервер принимает соединения на порту {port}" if ok else f"порт {port} не открылся"
+        else:
+            ok = server.run_for(observe_seconds)
+            outcome = f"процесс работал {observe_seconds} сек без ошибок" if ok else "процесс завершился досрочно"
+        crashed = not server.alive()
+    finally:
+        server.stop()
+    logs = server.logs()
+    usage = server.process.usage
+    if ok and not crashed:
+        return {"status": "success", "logs": f"{outcome}\n{logs}", "usage": usage}
+    # Код, который сам завершился без ошибки (например, сервер не стартовал по условию), тоже годен
+    if crashed and server.process.returncode == 0 and not port:
+        return {"status": "success", "logs": f"Процесс завершился с кодом 0\n{logs}", "usage": usage}
+    reason = describe_exit(server.process.returncode) if crashed else ""
+    outcome = f"{outcome} ({reason})" if reason else outcome
+    return {"status": "failed", "logs": f"{outcome}\n{logs}", "error": "Server check failed", "usage": usage}
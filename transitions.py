@@ -0,0 +1,112 @@
+# transitions.py
+import time
+from typing import Dict, Any, Optional, List
+from utils import logger, read_settings_section
+
+
+TRANSITION_DEFAULTS = {
+    "flow": ["decomposer", "validator", "consistency", "codegen", "extractor", "docker", "tester", "performance", "docs"],
+    "fallback_agent": "decomposer",
+    "min_confidence": 0.5,
+    "max_consecutive_runs": {"validator": 3},
+    "max_stage_seconds": 600,
+    "llm_fallback": False,
+}
+
+NO_COMMAND = "none"
+
+
+class TransitionEngine:
+    """Детерминированные переходы между агентами по правилам из settings.yml.
+
+    Заменяет LLM-решения CoordinatorAgent и MonitorAgent: следующий агент
+    берётся из порядка flow, а команды монитора вычисляются по счётчикам
+    и времени работы этапа. LLM используется только для нестандартных
+    состояний и только при llm_fallback: true.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        config = {**TRANSITION_DEFAULTS, **(config or {})}
+        self.flow: List[str] = list(config["flow"])
+        self.successor: Dict[str, Optional[str]] = dict(zip(self.flow, self.flow[1:] + [None]))
+        self.fallback_agent = config["fallback_agent"]
+        self.min_confidence = config["min_confidence"]
+        self.max_consecutive_runs: Dict[str, int] = dict(config["max_consecutive_runs"] or {})
+        self.max_stage_seconds = config["max_stage_seconds"]
+        self.llm_fallback = config["llm_fallback"]
+
+    @classmethod
+    def from_settings(cls, settings_path: str = "settings.yml") -> "TransitionEngine":
+        """Создание движка из секции transitions в settings.yml."""
+        return cls(read_settings_section("transitions", TRANSITION_DEFAULTS, settings_path))
+
+    def knows(self, agent: Any) -> bool:
+        """Агент входит в порядок flow (состояние штатное)."""
+        return agent in self.successor
+
+    def next_agent(self, source: str, data: Any = None) -> Optional[str]:
+        """Следующий агент после source; None — конвейер завершён."""
+        # Ошибка может явно указывать, куда вернуться
+        if isinstance(data, dict) and "error" in data and self.knows(data.get("next_agent")):
+            return data["next_agent"]
+        return self.successor.get(source, self.fallback_agent)
+
+    def monitor_command(self, state: Dict[str, Any], now: Optional[float] = None) -> str:
+        """Команда монитора по состоянию конвейера.
+
+        "Перезапустить <agent>" — текущий агент работает дольше max_stage_seconds;
+        "Принудительный переход к <agent>" — агент запускался подряд больше
+        max_consecutive_runs раз; иначе "none".
+        """
+        now = time.time() if now is None else now
+        current = state.get("current_agent")
+        started = (state.get("stage_started") or {}).get(current)
+        if current and started and now - started > self.max_stage_seconds:
+            return f"Перезапустить {current}"
+
+        runs = state.get("consecutive_runs") or {}
+        for agent, limit in self.max_consecutive_runs.items():
+            count = runs.get(agent, state.get(f"{agent}_consecutive_runs", 0))
+            target = self.successor.get(agent)
+            if count > limit and target:
+                return f"Принудительный переход к {target}"
+        return NO_COMMAND
+
+    def command_target(self, command: str) -> Optional[str]:
+        """Агент, к которому ведёт команда монитора, или None для "none"."""
+        if command.startswith("Перезапустить "):
+            target = command[len("Перезапустить "):].strip()
+        elif command.startswith("Принудительный переход к "):
+            target = command[len("Принудительный переход к "):].strip()
+        else:
+            return None
+        return target if self.knows(target) else None
+
+    def decide(self, current_agent: str, result: Any, verification: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Следующий агент с учётом результата и верификации текущего."""
+        if isinstance(result, dict) and "error" in result and "next_agent" in result:
+            return result["next_agent"]
+
+        if current_agent == "coordinator":
+            # Coordinator возвращает имя агента напрямую
+            if self.knows(result):
+                return result
+            logger.warning(f"Координатор вернул недопустимого агента: {result}, используется {self.fallback_agent}")
+            return self.fallback_agent
+
+        if current_agent == "monitor":
+            command = result.get("command", NO_COMMAND) if isinstance(result, dict) else NO_COMMAND
+            # Без команды продолжаем нормальный поток через координатора
+            return self.command_target(command) or "coordinator"
+
+        if not self.knows(current_agent):
+            return "coordinator"
+        next_agent = self.successor[current_agent]
+        if not next_agent:
+            logger.info("Все агенты завершены")
+            return None
+
+        if verification and verification["status"] == "failed" and verification["confidence"] < self.min_confidence:
+            logger.warning(f"Верификация не прошла для {current_agent}, возврат к {self.fallback_agent}")
+            return self.fallback_agent
+        return next_agent
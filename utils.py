@@ -1,26 +1,197 @@
 # utils.py
 import os
 import json
+import math
+import time
+import queue
+import atexit
+import random
+import threading
+import hashlib
 import logging
 import yaml
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Any, List, Optional  # Dict заменён на dict в коде
-from typing import Any, List, Optional
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
 from qdrant_client import QdrantClient
 from qdrant_client.models import VectorParams, Distance, PointStruct
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("project/system.log"),
-        logging.StreamHandler()
-    ]
-)
+# Настройки логирования по умолчанию (переопределяются секцией logging в settings.yml)
+LOGGING_DEFAULTS = {
+    "level": "INFO",
+    "file": "project/system.log",
+    "max_bytes": 10 * 1024 * 1024,
+    "backup_count": 5,
+    "blobs_dir": "logs/blobs",
+    "queue_size": 0,  # 0 — очередь без ограничения
+}
+
+# Повторы после временных ошибок (секция retry в settings.yml)
+RETRY_DEFAULTS = {
+    "attempts": 3,
+    "base_delay": 1.0,
+    "max_delay": 16.0,
+}
+
+# Ошибки OpenRouter, после которых имеет смысл повторить запрос
+TRANSIENT_LLM_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+# Стандартные атрибуты LogRecord, которые не попадают в структурированную запись
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирование записи лога в одну строку JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        # Дополнительные поля, переданные через extra (кроме служебных с "_")
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BlobHandler(logging.Handler):
+    """Запись объёмного содержимого (промпты, ответы) в content-addressed хранилище."""
+
+    def __init__(self, blobs_dir: str):
+        super().__init__()
+        self.blobs_dir = blobs_dir
+
+    def emit(self, record: logging.LogRecord) -> None:
+        content = getattr(record, "_blob_content", None)
+        digest = getattr(record, "blob", None)
+        if content is None or not digest:
+            return
+        try:
+            path = blob_path(digest, self.blobs_dir)
+            if os.path.exists(path):
+                return  # Одинаковое содержимое хранится один раз
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except Exception:
+            self.handleError(record)
+
+
+_log_listener: Optional[QueueListener] = None
+_log_handler: Optional[QueueHandler] = None
+_log_settings = dict(LOGGING_DEFAULTS)
+
+
+# Каталог конвейера: общие кэши привязаны к нему, а не к рабочему каталогу задачи (batch.py меняет его)
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def repo_path(path: str) -> str:
+    """Абсолютный путь: относительные пути отсчитываются от каталога конвейера."""
+    return os.path.normpath(os.path.join(REPO_ROOT, os.path.expanduser(path)))
+
+
+def read_settings_section(section: str, defaults: dict, settings_path: str = "settings.yml") -> dict:
+    """Чтение секции settings.yml поверх значений по умолчанию без использования логгера."""
+    settings = dict(defaults)
+    try:
+        if os.path.exists(settings_path):
+            with open(settings_path, 'r', encoding='utf-8') as f:
+                data = yaml.safe_load(f) or {}
+            settings.update(data.get(section) or {})
+    except Exception:
+        pass
+    return settings
+
+
+def setup_logging(log_file: Optional[str] = None, settings_path: str = "settings.yml") -> None:
+    """Настройка неблокирующего логирования через очередь.
+
+    Вызывающий поток только кладёт запись в очередь; форматирование JSON,
+    запись в файл с ротацией и сохранение blob выполняются в потоке QueueListener.
+    Повторный вызов перенастраивает обработчики (например, для другого log_file).
+    """
+    global _log_listener, _log_handler, _log_settings
+
+    settings = read_settings_section("logging", LOGGING_DEFAULTS, settings_path)
+    if log_file:
+        settings["file"] = log_file
+
+    root = logging.getLogger()
+    shutdown_logging()
+
+    log_dir = os.path.dirname(settings["file"])
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    file_handler = RotatingFileHandler(
+        settings["file"],
+        maxBytes=int(settings["max_bytes"]),
+        backupCount=int(settings["backup_count"]),
+        encoding='utf-8',
+        delay=True
+    )
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    blob_handler = BlobHandler(settings["blobs_dir"])
+
+    log_queue = queue.Queue(maxsize=int(settings["queue_size"]))
+    _log_handler = QueueHandler(log_queue)
+    root.addHandler(_log_handler)
+    root.setLevel(settings["level"])
+    _log_listener = QueueListener(log_queue, file_handler, console_handler, blob_handler)
+    _log_listener.start()
+    _log_settings = settings
+
+
+def shutdown_logging() -> None:
+    """Остановка потока логирования с дозаписью очереди."""
+    global _log_listener, _log_handler
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+    if _log_handler is not None:
+        logging.getLogger().removeHandler(_log_handler)
+        _log_handler = None
+
+
+def blob_path(digest: str, blobs_dir: Optional[str] = None) -> str:
+    """Путь к blob по его sha256."""
+    blobs_dir = blobs_dir or _log_settings["blobs_dir"]
+    return os.path.join(blobs_dir, digest[:2], digest)
+
+
+def log_payload(kind: str, owner: str, content: Any, level: int = logging.INFO) -> Optional[str]:
+    """Логирование объёмного содержимого ссылкой на blob.
+
+    В строку лога попадает только хэш и длина; само содержимое записывается
+    в хранилище blob потоком логирования. Возвращает sha256 содержимого.
+    """
+    if not logger.isEnabledFor(level):
+        return None
+    text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False, default=str)
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    logger.log(
+        level, "%s для %s: blob %s (%d символов)", kind, owner, digest[:12], len(text),
+        extra={"kind": kind, "owner": owner, "blob": digest, "_blob_content": text}
+    )
+    return digest
+
+
+setup_logging()
+atexit.register(shutdown_logging)
 logger = logging.getLogger(__name__)
 
 # Конфигурация
@@ -35,6 +206,7 @@ MODEL = "openai/gpt-4o-mini"
 client = OpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=OPENROUTER_API_KEY,
+    max_retries=0,  # Повторы с отсрочкой — только в call_openrouter, без второго слоя в SDK
 )
 qdrant_client = QdrantClient(QDRANT_HOST, port=QDRANT_PORT)
 model = SentenceTransformer('all-MiniLM-L6-v2')
@@ -50,7 +222,7 @@ def load_yaml(filepath: str) -> Optional[Any]:
         if os.path.exists(filepath):
             with open(filepath, 'r', encoding='utf-8') as f:
                 data = yaml.safe_load(f)
-                logger.debug(f"Загружен YAML из {filepath}")
+                logger.debug("Загружен YAML из %s", filepath)
                 return data
         logger.warning(f"Файл {filepath} не найден")
         return None
@@ -69,33 +241,69 @@ def save_yaml(data: Any, filepath: str) -> None:
         logger.error(f"Ошибка сохранения YAML в {filepath}: {str(e)}")
 
 
+def backoff_delay(attempt: int, retry: Optional[dict] = None) -> float:
+    """Экспоненциальная задержка с джиттером перед повтором после временной ошибки."""
+    retry = retry or RETRY_DEFAULTS
+    delay = min(float(retry["max_delay"]), float(retry["base_delay"]) * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
 def call_openrouter(prompt: str, model: str = MODEL) -> str:
-    """Вызов OpenRouter API с обработкой ошибок."""
-    try:
-        logger.info(f"Запрос к OpenRouter, модель: {model}")
-        completion = client.chat.completions.create(
-            extra_headers={
-                "HTTP-Referer": "http://localhost",
-                "X-Title": "Multi-Agent System",
-            },
-            model=model,
-            temperature=0.15,
-            messages=[{"role": "user", "content": prompt}],
-            timeout=30
-        )
-        result = completion.choices[0].message.content
-        logger.debug(f"Ответ OpenRouter: {result}")
-        return result
-    except Exception as e:
-        logger.error(f"Ошибка OpenRouter: {str(e)}")
-        return ""
+    """Вызов OpenRouter API с обработкой ошибок.
+
+    Повтор с экспоненциальной задержкой выполняется только для временных
+    ошибок (сеть, таймаут, лимит запросов, 5xx); остальные ошибки сразу
+    возвращают пустую строку.
+    """
+    from deadlines import current_deadline, bounded_timeout, DeadlineExceeded
+
+    retry = read_settings_section("retry", RETRY_DEFAULTS)
+    attempts = max(1, int(retry["attempts"]))
+    deadline = current_deadline()
+    for attempt in range(attempts):
+        try:
+            # Запрос не может пережить срок текущего этапа: таймаут ограничен остатком времени
+            timeout = bounded_timeout(30)
+            logger.info(f"Запрос к OpenRouter, модель: {model}")
+            completion = client.chat.completions.create(
+                extra_headers={
+                    "HTTP-Referer": "http://localhost",
+                    "X-Title": "Multi-Agent System",
+                },
+                model=model,
+                temperature=0.15,
+                messages=[{"role": "user", "content": prompt}],
+                timeout=timeout
+            )
+            result = completion.choices[0].message.content
+            log_payload("Ответ", model, result)
+            return result
+        except TRANSIENT_LLM_ERRORS as e:
+            if attempt + 1 >= attempts:
+                logger.error(f"Ошибка OpenRouter после {attempts} попыток: {str(e)}")
+                return ""
+            delay = backoff_delay(attempt, retry)
+            logger.warning(f"Временная ошибка OpenRouter: {str(e)}, повтор через {delay:.1f} сек")
+            if deadline:
+                deadline.cancelled.wait(delay)  # Сторож прерывает ожидание при отмене этапа
+            else:
+                time.sleep(delay)
+        except DeadlineExceeded as e:
+            logger.error(f"Запрос к OpenRouter отменён: {str(e)}")
+            return ""
+        except Exception as e:
+            logger.error(f"Ошибка OpenRouter: {str(e)}")
+            return ""
+    return ""
 
 def save_json(data: Any, filepath: str) -> None:
     """Сохранение данных в JSON-файл с проверкой пути."""
     try:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, 'w', encoding='utf-8') as f:
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, filepath)  # Атомарная замена: читатели не видят частичный файл
         logger.info(f"Сохранён JSON в {filepath}")
     except Exception as e:
         logger.error(f"Ошибка сохранения JSON в {filepath}: {str(e)}")
@@ -106,7 +314,7 @@ def load_json(filepath: str) -> Optional[Any]:
         if os.path.exists(filepath):
             with open(filepath, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                logger.debug(f"Загружен JSON из {filepath}")
+                logger.debug("Загружен JSON из %s", filepath)
                 return data
         logger.warning(f"Файл {filepath} не найден")
         return None
@@ -118,8 +326,10 @@ def save_text(text: str, filepath: str) -> None:
     """Сохранение текста в файл."""
     try:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, 'w', encoding='utf-8') as f:
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             f.write(text)
+        os.replace(tmp_path, filepath)
         logger.info(f"Сохранён текст в {filepath}, длина: {len(text)} символов")
     except Exception as e:
         logger.error(f"Ошибка сохранения текста в {filepath}: {str(e)}")
@@ -135,7 +345,7 @@ def setup_qdrant_collection() -> None:
             )
             logger.info(f"Создана коллекция {COLLECTION_NAME}")
         else:
-            logger.debug(f"Коллекция {COLLECTION_NAME} уже существует")
+            logger.debug("Коллекция %s уже существует", COLLECTION_NAME)
     except Exception as e:
         logger.error(f"Ошибка создания коллекции Qdrant: {str(e)}")
 
@@ -168,18 +378,26 @@ def get_from_qdrant(query: str, top_k: int = 3) -> List[dict[str, Any]]:
             limit=top_k
         )
         result = [{"content": r.payload["content"], "category": r.payload["category"]} for r in search_result]
-        logger.debug(f"Получено из Qdrant: {len(result)} записей")
+        logger.debug("Получено из Qdrant: %d записей", len(result))
         return result
     except Exception as e:
         logger.error(f"Ошибка запроса к Qdrant: {str(e)}")
         return []
 
+def percentile(values: List[float], pct: float) -> float:
+    """Перцентиль по методу ближайшего ранга (0 для пустого списка)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
 def validate_json(data: str) -> Optional[dict[str, Any]]:
     """Проверка и парсинг JSON-строки."""
     try:
         return json.loads(data)
     except json.JSONDecodeError as e:
-        logger.error(f"Невалидный JSON: {data}, ошибка: {str(e)}")
+        logger.error("Невалидный JSON: %s, ошибка: %s", data, e)
         return None
 
 if __name__ == "__main__":
@@ -3,9 +3,36 @@ import json
 import re
 import os
 import ast
-from typing import Dict, Any, List, Optional, Union
+import time
+import threading
+from typing import Dict, Any, List, Optional, Union, Callable
 from utils import logger, load_json
 from utils import logger, load_json, save_json, load_yaml  # Добавьте load_yaml
+from utils import read_settings_section, MODEL
+from cache import DiskCache, CACHE_DEFAULTS, stable_hash, artifact_of
+from code_analysis import AppAnalyzer, check_plan_conformance, plan_requirements
+from chunking import Chunk, CHUNKING_DEFAULTS, split_code, split_markdown, code_imports, map_chunks
+
+
+# Версия логики проверок: увеличивается при их изменении, чтобы старые вердикты в кэше не использовались
+VERIFIER_VERSION = "5"
+
+# Обязательные разделы документации
+DOC_SECTIONS = [
+    "Описание приложения и его назначение",
+    "Требования и зависимости",
+    "Инструкции по установке",
+    "Инструкции по использованию",
+    "Описание API (endpoints, параметры, форматы ответов)",
+    "Примеры запросов и ответов",
+]
+
+# Результаты предыдущих этапов, которые читает проверка агента
+VERDICT_INPUTS = {
+    "consistency": ["decomposer"],
+    "codegen": ["decomposer"],
+    "docs": ["codegen"],
+}
 
 
 class VerificationAgent:
@@ -13,6 +40,18 @@ class VerificationAgent:
         """Инициализация агента верификации с загрузкой правил."""
         self.rules_path = rules_path
         self.rules = self._load_verification_rules ()
+        # Проверки выполнением по агентам (уровень sandbox), подключаются снаружи
+        self.sandbox_checks: Dict[str, Callable[[Any], List[str]]] = {}
+
+        # Кэш вердиктов: версия правил входит в ключ, поэтому правка
+        # verification_rules в settings.yml делает старые вердикты недостижимыми
+        self.rules_version = stable_hash(self.rules)
+        cache_settings = read_settings_section("cache", CACHE_DEFAULTS, rules_path)
+        self.verdicts = DiskCache(
+            os.path.join(cache_settings["dir"], "verdicts"), cache_settings["verdict_max_entries"]
+        ) if cache_settings["enabled"] else None
+        self._local = threading.local()
+        self.chunking = read_settings_section("chunking", CHUNKING_DEFAULTS, rules_path)
     
 
     def _load_verification_rules(self) -> Dict[str, Any]:
@@ -45,9 +84,78 @@ class VerificationAgent:
         data = self._extract_data_for_verification(result)
         
         # Запись результата для отладки
-        logger.debug(f"Результат агента {agent_name} для верификации: {data}")
+        logger.debug("Результат агента %s для верификации: %s", agent_name, data)
+
+        key = self._verdict_key(agent_name, data, task, previous_results) if self.verdicts else None
+        if key:
+            cached = self.verdicts.get(key)
+            if cached:
+                logger.info(f"Верификация агента {agent_name}: вердикт из кэша (status={cached['status']})")
+                return {**cached, "cached": True}
+        self._local.uncacheable = False
+
+        # Уровни проверки от дешёвых к дорогим; уровень с замечаниями останавливает
+        # проверку, поэтому песочница и LLM видят только прошедшие дешёвые проверки
+        tiers = [
+            ("schema", self._verify_schema),
+            ("static", self._verify_static),
+            ("sandbox", self._verify_sandbox),
+            ("llm", self._verify_llm),
+        ]
+        timings = {}
+        stopped_at = None
+        for tier, check in tiers:
+            started = time.perf_counter()
+            confidence, issues = check(agent_name, data, task, previous_results, rules, confidence, issues)
+            timings[tier] = round(time.perf_counter() - started, 4)
+            if issues and tier != "llm":
+                stopped_at = tier
+                break
+
+        # Определение статуса верификации
+        status = "passed" if confidence >= 0.7 and not issues else "failed"
+        logger.info(
+            f"Верификация агента {agent_name}: status={status}, confidence={confidence}, issues={issues}, "
+            f"уровни={timings}" + (f", остановлена на {stopped_at}" if stopped_at else "")
+        )
+        verdict = {"status": status, "confidence": confidence, "issues": issues, "tiers": timings, "stopped_at": stopped_at}
+        # Сбой вызова LLM — не свойство артефакта, такой вердикт не запоминается
+        if key and not self._local.uncacheable:
+            self.verdicts.set(key, verdict)
+        return verdict
+
+    def _verdict_key(self, agent_name: str, data: Any, task: str, previous_results: Dict[str, Any]) -> str:
+        """Ключ вердикта: агент, хэш артефакта, хэши влияющих на проверку входов и версия правил."""
+        relevant = {
+            name: stable_hash(artifact_of(previous_results.get(name)))
+            for name in VERDICT_INPUTS.get(agent_name, [])
+        }
+        if agent_name == "docs" and os.path.exists("project/app.py"):
+            # Документация сверяется с кодом из файла, а не из previous_results
+            with open("project/app.py", "r") as f:
+                relevant["app.py"] = stable_hash(f.read())
+        return stable_hash({
+            "agent": agent_name,
+            "artifact": stable_hash(data),
+            "task": task,
+            "inputs": relevant,
+            "rules": self.rules_version,
+            "verifier": VERIFIER_VERSION,
+            "sandbox": agent_name in self.sandbox_checks,
+            "model": MODEL,
+        })
 
-        # Проверка обязательных полей
+    def _mark_uncacheable(self) -> None:
+        """Текущий вердикт зависит от сбоя внешнего вызова и не должен попасть в кэш."""
+        self._local.uncacheable = True
+
+    def register_sandbox_check(self, agent_name: str, check: Callable[[Any], List[str]]) -> None:
+        """Подключение проверки выполнением для агента: check(data) возвращает список проблем."""
+        self.sandbox_checks[agent_name] = check
+
+    def _verify_schema(self, agent_name: str, data: Any, task: str, previous_results: Dict[str, Any],
+                       rules: Dict[str, Any], confidence: float, issues: List[str]) -> tuple:
+        """Уровень schema: наличие и заполненность обязательных полей."""
         if rules.get("required_fields"):
             if not isinstance(data, dict):
                 issues.append(f"Результат должен быть словарем, получен {type(data)}")
@@ -60,8 +168,11 @@ class VerificationAgent:
                     elif data[field] is None or (isinstance(data[field], str) and not data[field].strip()):
                         issues.append(f"Поле {field} пустое")
                         confidence -= 0.1
+        return confidence, issues
 
-        # Специфические проверки для агентов
+    def _verify_static(self, agent_name: str, data: Any, task: str, previous_results: Dict[str, Any],
+                       rules: Dict[str, Any], confidence: float, issues: List[str]) -> tuple:
+        """Уровень static: специфические проверки агента (AST, формат) и паттерны ошибок."""
         specific_verifications = {
             "decomposer": lambda d, t, p, r, c, i: self._verify_decomposer(d, t, i, c, r),
             "validator": lambda d, t, p, r, c, i: self._verify_validator(d, i, c, r),
@@ -71,6 +182,7 @@ class VerificationAgent:
             "docker": lambda d, t, p, r, c, i: self._verify_docker(d, i, c, r),
             "tester": lambda d, t, p, r, c, i: self._verify_tester(d, p, i, c, r),
             "docs": lambda d, t, p, r, c, i: self._verify_docs(d, p, i, c, r),
+            "performance": lambda d, t, p, r, c, i: self._verify_performance(d, i, c, r),
             "monitor": lambda d, t, p, r, c, i: self._verify_monitor(d, i, c, r),
             "coordinator": lambda d, t, p, r, c, i: self._verify_coordinator(d, i, c, r),
             "knowledge": lambda d, t, p, r, c, i: self._verify_knowledge(d, i, c, r)
@@ -91,11 +203,31 @@ class VerificationAgent:
                 if re.search(pattern, data, re.IGNORECASE):
                     issues.append(f"Обнаружен паттерн ошибки: {pattern}")
                     confidence -= 0.2
+        return confidence, issues
 
-        # Определение статуса верификации
-        status = "passed" if confidence >= 0.7 and not issues else "failed"
-        logger.info(f"Верификация агента {agent_name}: status={status}, confidence={confidence}, issues={issues}")
-        return {"status": status, "confidence": confidence, "issues": issues}
+    def _verify_sandbox(self, agent_name: str, data: Any, task: str, previous_results: Dict[str, Any],
+                        rules: Dict[str, Any], confidence: float, issues: List[str]) -> tuple:
+        """Уровень sandbox: проверка выполнением, если она подключена для агента."""
+        check = self.sandbox_checks.get(agent_name)
+        if check:
+            sandbox_issues = check(data)
+            if sandbox_issues:
+                # Сбой выполнения может зависеть от окружения (таймаут, отмена)
+                self._mark_uncacheable()
+                issues.extend(sandbox_issues)
+                confidence -= 0.3
+        return confidence, issues
+
+    def _verify_llm(self, agent_name: str, data: Any, task: str, previous_results: Dict[str, Any],
+                    rules: Dict[str, Any], confidence: float, issues: List[str]) -> tuple:
+        """Уровень llm: дорогие проверки через LLM."""
+        llm_verifications = {
+            "codegen": lambda d, p, r, c, i: self._verify_codegen_llm(d, p, i, c, r),
+            "docs": lambda d, p, r, c, i: self._verify_docs_llm(d, p, i, c, r),
+        }
+        if agent_name in llm_verifications:
+            confidence, issues = llm_verifications[agent_name](data, previous_results, rules, confidence, issues)
+        return confidence, issues
 
     def _extract_data_for_verification(self, result: Any) -> Any:
         """Извлечение данных для верификации из различных форматов результата."""
@@ -208,50 +340,88 @@ class VerificationAgent:
             ast.parse(data)
         except SyntaxError as e:
             issues.append(f"Синтаксическая ошибка в коде: {str(e)}")
-            confidence -= 0.3
-            
-        # Проверка соответствия плану через ЛЛМ
-        decomposer_result = previous_results.get("decomposer", {})
-        if decomposer_result and isinstance(decomposer_result, dict) and "data" in decomposer_result:
-            decomposer_data = decomposer_result["data"]
-            if decomposer_data and "modules" in decomposer_data:
-                plan_str = json.dumps(decomposer_data, ensure_ascii=False)
-                code_snippet = data[:1500] + ("..." if len(data) > 1500 else "")
-                
-                prompt = f"""
-                Ты — эксперт по верификации кода. Проверь, реализует ли код требования из плана.
-                
-                План:
-                {plan_str}
-                
-                Код:
-                {code_snippet}
-                
-                Проверь только:
-                1. Импортированы ли все необходимые зависимости
-                2. Реализованы ли все маршруты (/sum и т.д.)
-                3. Обрабатываются ли параметры из плана
-                4. Выдаётся ли результат в нужном формате
-                
-                Верни только JSON: {{"status": "passed", "issues": []}} или {{"status": "failed", "issues": ["список проблем"]}}
-                """
-                
-                try:
-                    from utils import call_openrouter
-                    result = call_openrouter(prompt)
-                    try:
-                        verification = json.loads(result)
-                        if isinstance(verification, dict) and "status" in verification:
-                            if verification["status"] == "failed" and "issues" in verification:
-                                issues.extend(verification["issues"])
-                                confidence -= 0.1 * len(verification["issues"])
-                    except json.JSONDecodeError:
-                        logger.error(f"Ошибка JSON в результате проверки кода: {result}")
-                except Exception as e:
-                    logger.error(f"Ошибка при вызове ЛЛМ для проверки кода: {str(e)}")
+            return confidence - 0.3, issues
+
+        # Соответствие плану по AST: маршруты, читаемые параметры, импорты и поля ответа
+        conformance = check_plan_conformance(data, artifact_of(previous_results.get("decomposer")))
+        if conformance:
+            issues.extend(conformance)
+            confidence -= 0.1 * len(conformance)
                     
         return confidence, issues
 
+    def _verify_codegen_llm(self, data: Any, previous_results: Dict[str, Any], issues: List[str], confidence: float, rules: Dict[str, Any]) -> tuple:
+        """Проверка соответствия кода плану через ЛЛМ.
+
+        Нужна только для кода, который статический анализ не распознал
+        (не aiohttp/Flask/FastAPI): иначе план уже сверен по AST. Код
+        проверяется целиком: фрагменты по узлам AST отправляются параллельно,
+        требование плана считается реализованным, если его покрыл любой фрагмент.
+        """
+        from utils import call_openrouter
+
+        plan = artifact_of(previous_results.get("decomposer"))
+        if check_plan_conformance(data, plan) is not None:
+            return confidence, issues
+        if not isinstance(plan, dict) or not plan.get("modules"):
+            return confidence, issues
+
+        requirements = plan_requirements(plan)
+        requirements_str = "\n".join(f"{number}. {text}" for number, text in enumerate(requirements, 1))
+        imports = code_imports(data) or "нет"
+
+        def check(chunk: Chunk) -> Optional[Dict[str, Any]]:
+            prompt = f"""
+            Ты — эксперт по верификации кода. Перед тобой фрагмент программы ({chunk.location}).
+
+            Требования плана:
+            {requirements_str}
+
+            Импорты модуля:
+            {imports}
+
+            Фрагмент:
+            {chunk.text}
+
+            Укажи номера требований, которые реализует этот фрагмент, и ошибки в самом фрагменте
+            (необработанные параметры, неверный формат ответа). Не считай ошибкой то, что фрагмент
+            не реализует остальные требования: они могут быть в других фрагментах.
+
+            Верни только JSON: {{"covered": [<номера требований>], "issues": [<ошибки фрагмента>]}}
+            """
+            try:
+                return json.loads(self._clean_llm_json(call_openrouter(prompt)))
+            except (json.JSONDecodeError, TypeError):
+                return None
+
+        chunks = split_code(data, self.chunking["code_chars"])
+        covered, answered = set(), 0
+        for chunk, verdict in map_chunks(chunks, check, self.chunking["max_workers"]):
+            if not isinstance(verdict, dict):
+                self._mark_uncacheable()
+                logger.error(f"Ошибка JSON в результате проверки фрагмента кода ({chunk.location})")
+                continue
+            answered += 1
+            covered.update(int(n) for n in verdict.get("covered", []) if str(n).isdigit())
+            for issue in verdict.get("issues", []):
+                issues.append(f"[{chunk.location}] {issue}")
+                confidence -= 0.1
+
+        # Без ответов по фрагментам непокрытые требования не означают их отсутствие в коде
+        if answered == len(chunks):
+            for number, text in enumerate(requirements, 1):
+                if number not in covered:
+                    issues.append(f"Требование плана не реализовано: {text}")
+                    confidence -= 0.1
+        logger.info(f"Проверка кода по {len(chunks)} фрагментам: покрыто требований {len(covered)}/{len(requirements)}")
+        return confidence, issues
+
+    def _clean_llm_json(self, text: str) -> str:
+        """Ответ LLM без markdown-обёрток вокруг JSON."""
+        text = re.sub(r'```json\s*', '', text)
+        text = re.sub(r'```\s*$', '', text)
+        return text.strip()
+
     def _verify_codegen_old(self, data: Any, previous_results: Dict[str, Any], issues: List[str], confidence: float, rules: Dict[str, Any]) -> tuple:
         """Верификация результата CodeGeneratorAgent."""
         if data is None:
@@ -386,9 +556,7 @@ class VerificationAgent:
 
 
     def _verify_docs(self, data: Any, previous_results: Dict[str, Any], issues: List[str], confidence: float, rules: Dict[str, Any]) -> tuple:
-        """Верификация результата DocumentationAgent с использованием LLM."""
-        from utils import call_openrouter
-        
+        """Верификация результата DocumentationAgent без LLM: тип и минимальный объём."""
         if not isinstance(data, str):
             issues.append(f"Документация должна быть строкой, получен {type(data)}")
             return confidence - 0.3, issues
@@ -396,6 +564,22 @@ class VerificationAgent:
         if not data.strip():
             issues.append("Документация пустая")
             return confidence - 0.5, issues
+
+        min_length = rules.get("min_length", 200)
+        if len(data.strip()) < min_length:
+            issues.append(f"Документация слишком короткая: {len(data.strip())} символов (минимум {min_length})")
+            confidence -= 0.4
+        return confidence, issues
+
+    def _verify_docs_llm(self, data: Any, previous_results: Dict[str, Any], issues: List[str], confidence: float, rules: Dict[str, Any]) -> tuple:
+        """Оценка качества документации с использованием LLM.
+
+        Документация делится на разделы markdown, которые оцениваются
+        параллельно; итоговая оценка — средняя оценка разделов, взвешенная
+        по их длине. Обязательные разделы, не найденные ни в одном фрагменте,
+        попадают в замечания.
+        """
+        from utils import call_openrouter
         
         # Получаем код приложения из предыдущих результатов или файла
         code = None
@@ -408,105 +592,80 @@ class VerificationAgent:
                 code = code_result["data"]
             elif isinstance(code_result, str):
                 code = code_result
-        
-        # Формирование промта для LLM
-        prompt = f"""
-        Оцени качество документации README.md для API-сервера. Проверь наличие следующих разделов:
-        1. Описание приложения и его назначение
-        2. Требования и зависимости
-        3. Инструкции по установке
-        4. Инструкции по использованию
-        5. Описание API (endpoints, параметры, форматы ответов)
-        6. Примеры запросов и ответов
-        
-        Код приложения:
-        ```python
-        {code[:1000]}{"..." if code and len(code) > 1000 else ""}
-        ```
-        
-        Документация:
-        ```markdown
-        {data[:2000]}{"..." if len(data) > 2000 else ""}
-        ```
-        
-        Оцени документацию по шкале от 0 до 10, где:
-        - 0-4: документация неприемлема и требует значительной доработки
-        - 5-7: документация приемлема, но могла бы быть улучшена
-        - 8-10: документация хорошего качества
-        
-        Верни только JSON в формате:
-        {{"score": <число от 0 до 10>, "is_acceptable": <true/false>, "missing_sections": [<список отсутствующих разделов>], "recommendations": [<краткие рекомендации>]}}
-        
-        Документация считается приемлемой, если набирает 5 и более баллов.
-        Важно: не используй макеры ```json или ``` в своем ответе, просто верни чистый JSON.
-        """
-        
+
+        # Вместо начала кода — описание API, извлечённое из всего файла
         try:
-            # Вызов LLM
-            result = call_openrouter(prompt)
-            
-            # Очистка от маркеров форматирования
-            result = re.sub(r'```json\s*', '', result)
-            result = re.sub(r'```\s*$', '', result)
-            result = result.strip()
-            
-            # Парсинг результата
-            import json
+            api = json.dumps(AppAnalyzer(code).summary(), ensure_ascii=False) if code else "Код не доступен"
+        except SyntaxError:
+            api = code[:1000] + ("..." if len(code) > 1000 else "")
+        sections_str = "\n".join(f"{number}. {title}" for number, title in enumerate(DOC_SECTIONS, 1))
+
+        def check(chunk: Chunk) -> Optional[Dict[str, Any]]:
+            prompt = f"""
+            Оцени фрагмент документации README.md для API-сервера ({chunk.location}).
+
+            Обязательные разделы документации:
+            {sections_str}
+
+            API приложения (извлечено из кода):
+            {api}
+
+            Фрагмент документации:
+            ```markdown
+            {chunk.text}
+            ```
+
+            Укажи номера обязательных разделов, которые есть в этом фрагменте, и оцени качество
+            фрагмента по шкале от 0 до 10 (точность относительно API, полнота, ясность).
+
+            Верни только JSON в формате:
+            {{"sections": [<номера разделов>], "score": <число от 0 до 10>, "recommendations": [<краткие рекомендации>]}}
+            Важно: не используй макеры ```json или ``` в своем ответе, просто верни чистый JSON.
+            """
             try:
-                verification = json.loads(result)
-                
-                # Анализ результатов
-                if "score" in verification:
-                    score = float(verification["score"])
-                    is_acceptable = verification.get("is_acceptable", score >= 5.0)
-                    
-                    # Установка уверенности на основе оценки
-                    confidence = min(1.0, max(0.1, score / 10))
-                    
-                    # Формирование списка проблем
-                    if "missing_sections" in verification and verification["missing_sections"]:
-                        issues.extend([f"Отсутствует раздел: {section}" for section in verification["missing_sections"]])
-                    
-                    if "recommendations" in verification and verification["recommendations"]:
-                        issues.extend([f"Рекомендация: {rec}" for rec in verification["recommendations"]])
-                    
-                    logger.info(f"LLM оценка документации: {score}/10, приемлемо: {is_acceptable}")
-                    
-                    # Если документация приемлема, считаем верификацию пройденной
-                    if is_acceptable:
-                        return confidence, []
-                else:
-                    issues.append("LLM не вернула оценку документации")
-                    confidence -= 0.3
-                    
-            except json.JSONDecodeError as e:
-                issues.append(f"Ошибка парсинга результата LLM: {str(e)}")
-                confidence -= 0.3
-                logger.error(f"Ошибка парсинга JSON в результате LLM (после очистки): '{result}'")
-                
-                # Аварийный механизм - если оценка высокая (содержит значение 8-10), 
-                # всё равно принимаем документацию
-                if re.search(r'"score":\s*(8|9|10)', result):
-                    logger.info("Принудительное принятие документации из-за высокой оценки")
-                    return 0.8, []
-                
-        except Exception as e:
-            issues.append(f"Ошибка при проверке документации через LLM: {str(e)}")
+                verdict = json.loads(self._clean_llm_json(call_openrouter(prompt)))
+                return verdict if isinstance(verdict, dict) and "score" in verdict else None
+            except (json.JSONDecodeError, TypeError):
+                return None
+
+        chunks = split_markdown(data, self.chunking["docs_chars"])
+        covered, weighted, total = set(), 0.0, 0
+        for chunk, verdict in map_chunks(chunks, check, self.chunking["max_workers"]):
+            if verdict is None:
+                self._mark_uncacheable()
+                logger.error(f"LLM не вернула оценку фрагмента документации ({chunk.location})")
+                continue
+            try:
+                score = float(verdict["score"])
+            except (TypeError, ValueError):
+                self._mark_uncacheable()
+                continue
+            covered.update(int(n) for n in verdict.get("sections", []) if str(n).isdigit())
+            weighted += score * len(chunk.text)
+            total += len(chunk.text)
+            issues.extend(f"Рекомендация [{chunk.location}]: {rec}" for rec in verdict.get("recommendations", []))
+
+        if total:
+            missing = [title for number, title in enumerate(DOC_SECTIONS, 1) if number not in covered]
+            issues.extend(f"Отсутствует раздел: {title}" for title in missing)
+            score = weighted / total
+            confidence = min(1.0, max(0.1, score / 10))
+            logger.info(f"LLM оценка документации по {len(chunks)} фрагментам: {score:.1f}/10, разделов {len(DOC_SECTIONS) - len(missing)}/{len(DOC_SECTIONS)}")
+
+            # Документация считается приемлемой, если набирает 5 и более баллов
+            if score >= 5.0:
+                return confidence, []
+        else:
+            issues.append("LLM не вернула оценку документации")
             confidence -= 0.3
-            logger.error(f"Ошибка при вызове LLM для проверки документации: {str(e)}")
-        
+
         # Если confidence достаточно высокая, считаем документацию приемлемой
         # даже при наличии незначительных проблем
         if confidence >= 0.5:
             logger.info(f"Документация принята с confidence={confidence}, несмотря на проблемы")
             return confidence, []
-        
         return confidence, issues
 
-
-
-
-        
     def _verify_monitor(self, data: Any, issues: List[str], confidence: float, rules: Dict[str, Any]) -> tuple:
         """Верификация результата MonitorAgent."""
         if not isinstance(data, dict) or "command" not in data:
@@ -523,11 +682,21 @@ class VerificationAgent:
             
         return confidence, issues
         
+    def _verify_performance(self, data: Any, issues: List[str], confidence: float, rules: Dict[str, Any]) -> tuple:
+        """Верификация результата PerformanceAgent: нарушенные пороги нагрузки — замечания."""
+        if not isinstance(data, dict) or data.get("status") not in rules.get("valid_statuses", ["passed", "failed", "skipped"]):
+            issues.append(f"Неожиданный формат отчёта о нагрузке: {type(data)}")
+            return confidence - 0.3, issues
+        for violation in data.get("violations", []):
+            issues.append(f"Нагрузка: {violation}")
+            confidence -= 0.2
+        return confidence, issues
+
     def _verify_coordinator(self, data: Any, issues: List[str], confidence: float, rules: Dict[str, Any]) -> tuple:
         """Верификация результата CoordinatorAgent."""
         valid_agents = [
             "decomposer", "validator", "consistency", "codegen", 
-            "extractor", "docker", "tester", "docs", "monitor", "coordinator"
+            "extractor", "docker", "tester", "docs", "performance", "monitor", "coordinator"
         ]
         
         if isinstance(data, str):
@@ -0,0 +1,224 @@
+# wheelhouse.py
+import os
+import re
+import sys
+import json
+import fcntl
+import shutil
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+from utils import logger, read_settings_section, repo_path
+from deadlines import run_process
+
+
+WHEELHOUSE_DEFAULTS = {
+    "enabled": True,
+    "dir": ".wheelhouse",      # Относительно каталога конвейера: общий для всех задач пакета
+    "offline": False,          # Только локальные колёса: без обращений к индексу пакетов
+    "fetch_timeout": 600,
+    # Колёса для Docker-образов: интерпретатор образа и платформы manylinux
+    "docker_platforms": ["manylinux_2_28_x86_64", "manylinux_2_17_x86_64", "manylinux2014_x86_64"],
+    "prefetch": ["pytest", "aiohttp", "flask", "fastapi", "uvicorn", "requests"],
+    "prefetch_python": ["3.9"],  # Версии Python образов, для которых колёса загружаются заранее
+}
+
+_IMAGE_PYTHON = re.compile(r"(?:^|/)python:(\d+\.\d+)")
+
+
+def image_python_version(image: str) -> Optional[str]:
+    """Версия Python официального образа python:X.Y[-вариант]; None для прочих образов."""
+    match = _IMAGE_PYTHON.search(image)
+    return match.group(1) if match else None
+
+
+class Wheelhouse:
+    """Локальный склад колёс и кэш pip для установки зависимостей без сети.
+
+    Требования разрешаются один раз и хранятся колёсами в плоском каталоге
+    <dir>/wheels; песочницы ставят пакеты из него (--no-index --find-links),
+    а сборки базовых Docker-образов получают нужные колёса в контексте
+    сборки. Набор требований, полностью разрешимый из склада, — попадание;
+    недостающие колёса загружаются (кроме режима offline) — промах.
+    Счётчики сохраняются на диске и общие для всех процессов.
+    """
+
+    def __init__(self, settings: Dict[str, Any]):
+        self.settings = settings
+        self.root = repo_path(settings["dir"])
+        self.wheels = os.path.join(self.root, "wheels")
+        self.cache = os.path.join(self.root, "pip-cache")
+        self.stats = {"hits": 0, "misses": 0, "failures": 0}
+        os.makedirs(self.wheels, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.settings["enabled"])
+
+    def pip_env(self) -> Dict[str, str]:
+        """Окружение pip: общий кэш и, в режиме offline, запрет обращения к индексу."""
+        env = {**os.environ, "PIP_CACHE_DIR": self.cache, "PIP_DISABLE_PIP_VERSION_CHECK": "1"}
+        if self.settings["offline"]:
+            env["PIP_NO_INDEX"] = "1"
+        return env
+
+    def install_args(self) -> List[str]:
+        """Аргументы pip install для установки только из склада."""
+        return ["--no-index", "--find-links", self.wheels]
+
+    def _target_args(self, python_version: Optional[str]) -> List[str]:
+        """Колёса под другой интерпретатор (образ Docker): только бинарные, с явной платформой и ABI."""
+        if not python_version:
+            return []
+        version = python_version.replace(".", "")
+        args = ["--only-binary=:all:", "--python-version", python_version, "--implementation", "cp"]
+        for platform in self.settings["docker_platforms"]:
+            args += ["--platform", platform]
+        for abi in (f"cp{version}", "abi3", "none"):
+            args += ["--abi", abi]
+        return args
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _resolve_offline(self, requirements: List[str], python_version: Optional[str], dest: str) -> bool:
+        """Разрешение требований (с зависимостями) только из склада; колёса копируются в dest."""
+        result = run_process(
+            [sys.executable, "-m", "pip", "download", "-q", "--no-index", "--find-links", self.wheels,
+             "-d", dest, *self._target_args(python_version), *requirements],
+            timeout=self.settings["fetch_timeout"], env=self.pip_env()
+        )
+        return result.returncode == 0
+
+    def _fetch(self, requirements: List[str], python_version: Optional[str]) -> None:
+        """Загрузка недостающих колёс в склад; пакеты без колёс собираются (только под текущий Python)."""
+        if python_version:
+            cmd = [sys.executable, "-m", "pip", "download", "-q", "-d", self.wheels, "--find-links", self.wheels,
+                   *self._target_args(python_version), *requirements]
+        else:
+            cmd = [sys.executable, "-m", "pip", "wheel", "-q", "-w", self.wheels, "--find-links", self.wheels,
+                   *requirements]
+        env = {key: value for key, value in self.pip_env().items() if key != "PIP_NO_INDEX"}
+        result = run_process(cmd, timeout=self.settings["fetch_timeout"], env=env)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip()[-2000:])
+
+    def ensure(self, requirements: List[str], python_version: Optional[str] = None,
+               dest: Optional[str] = None, count: bool = True) -> bool:
+        """Наличие в складе колёс для требований и всех их зависимостей.
+
+        python_version — версия Python образа (колёса под другой интерпретатор),
+        dest — каталог, куда копируется ровно нужный набор колёс (контекст сборки),
+        count — учитывать ли обращение в статистике попаданий.
+        False, если требования не удалось разрешить: нет сети или нет колёс.
+        """
+        requirements = [r for r in requirements if r.strip()]
+        if not self.enabled or not requirements:
+            return False
+        scratch = None
+        if dest is None:
+            scratch = dest = tempfile.mkdtemp(prefix="wheelhouse_")
+        try:
+            if self._resolve_offline(requirements, python_version, dest):
+                self._count("hits", count)
+                return True
+            self._count("misses", count)
+            if self.settings["offline"]:
+                logger.warning(f"В складе колёс нет {', '.join(requirements)}, а загрузка запрещена (offline)")
+                self._count("failures", count)
+                return False
+            with self._locked():
+                self._fetch(requirements, python_version)
+            logger.info(f"Колёса загружены в склад: {', '.join(requirements)}"
+                        + (f" (Python {python_version})" if python_version else ""))
+            if self._resolve_offline(requirements, python_version, dest):
+                return True
+            raise RuntimeError("требования не разрешаются из склада после загрузки")
+        except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Не удалось подготовить колёса для {', '.join(requirements)}: {str(e)}")
+            self._count("failures", count)
+            return False
+        finally:
+            if scratch:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+    def prefetch(self, requirements: List[str], python_versions: List[Optional[str]]) -> Dict[str, bool]:
+        """Заблаговременное заполнение склада под текущий Python и версии образов."""
+        results = {}
+        for version in python_versions:
+            results[version or "host"] = self.ensure(requirements, version, count=False)
+        return results
+
+    def _count(self, name: str, enabled: bool = True) -> None:
+        if not enabled:
+            return
+        self.stats[name] += 1
+        path = os.path.join(self.root, "stats.json")
+        with self._locked():
+            totals = self._load_totals(path)
+            totals[name] = totals.get(name, 0) + 1
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(totals, f)
+
+    @staticmethod
+    def _load_totals(path: str) -> Dict[str, int]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _hit_rate(counts: Dict[str, int]) -> float:
+        lookups = counts.get("hits", 0) + counts.get("misses", 0)
+        return round(counts.get("hits", 0) / lookups, 3) if lookups else 0.0
+
+    def report(self) -> Dict[str, Any]:
+        """Попадания за запуск и за всё время, размер склада."""
+        totals = self._load_totals(os.path.join(self.root, "stats.json"))
+        wheels = [name for name in os.listdir(self.wheels) if name.endswith(".whl")]
+        size = sum(os.path.getsize(os.path.join(self.wheels, name)) for name in wheels)
+        return {
+            "run": {**self.stats, "hit_rate": self._hit_rate(self.stats)},
+            "total": {**totals, "hit_rate": self._hit_rate(totals)},
+            "wheels": len(wheels),
+            "size_mb": round(size / (1024 * 1024), 1),
+        }
+
+
+def main():
+    settings = read_settings_section("wheelhouse", WHEELHOUSE_DEFAULTS)
+    parser = argparse.ArgumentParser(description="Склад колёс для установки зависимостей без сети")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prefetch = commands.add_parser("prefetch", help="Загрузить колёса заранее")
+    prefetch.add_argument("packages", nargs="*", help="Требования (по умолчанию — wheelhouse.prefetch)")
+    prefetch.add_argument("-r", "--requirement", action="append", default=[], help="Файл требований")
+    prefetch.add_argument("--python", action="append", default=None,
+                          help="Версия Python образа (по умолчанию — wheelhouse.prefetch_python)")
+    commands.add_parser("stats", help="Попадания и размер склада")
+    args = parser.parse_args()
+
+    house = Wheelhouse(settings)
+    if args.command == "prefetch":
+        requirements = list(args.packages)
+        for path in args.requirement:
+            with open(path, "r", encoding="utf-8") as f:
+                requirements += [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+        requirements = requirements or list(settings["prefetch"])
+        versions = [None] + list(args.python if args.python is not None else settings["prefetch_python"])
+        results = house.prefetch(requirements, versions)
+        print(json.dumps({"prefetch": results, **house.report()}, ensure_ascii=False, indent=2))
+        sys.exit(0 if all(results.values()) else 1)
+    print(json.dumps(house.report(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()